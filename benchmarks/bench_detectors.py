@@ -0,0 +1,159 @@
+"""Cost and accuracy of the jump/duck detectors over recorded traces, as JSON for comparing runs.
+
+Every trace goes through the full live chain (pipeline, pattern matchers, state machine) as fast as it can. Per trace
+this reports CPU time per sample, peak Python memory, the jumps and ducks detected and, where the trace has a
+`.events` annotation file next to it (see `dino.evaluation`), precision, recall and detection latency in samples.
+
+    python benchmarks/bench_detectors.py data/*.txt -o before.json
+    python benchmarks/bench_detectors.py data/*.txt -o after.json --compare before.json
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tracemalloc
+from pathlib import Path
+
+from dino.evaluation import (
+    DEFAULT_TOLERANCE,
+    annotation_path,
+    detect,
+    load_annotations,
+    score,
+)
+from dino.recording import load_samples
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+def evaluate(trace: Path, repeats: int, batch_size: int, tolerance: int) -> dict:
+    timestamps, force = load_samples(trace)
+    result = {"samples": len(timestamps)}
+    try:
+        runs = [detect(timestamps, force, batch_size) for _ in range(repeats)]
+        tracemalloc.start()
+        detect(timestamps, force, batch_size)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    except RuntimeError as e:
+        # eg a trace that starts with someone already on the scale
+        result["error"] = str(e)
+        return result
+
+    detection = runs[0]
+    result.update(
+        cpu_us_per_sample=min(run.cpu_seconds for run in runs) / len(timestamps) * 1e6,
+        wall_us_per_sample=min(run.wall_seconds for run in runs)
+        / len(timestamps)
+        * 1e6,
+        peak_memory_kb=peak / 1024,
+        detected={
+            kind: sum(1 for _, detected in detection.events if detected == kind)
+            for kind in ("jump", "duck")
+        },
+        events=[list(event) for event in detection.events],
+    )
+
+    annotations = annotation_path(trace)
+    if annotations.exists():
+        matched = score(
+            detection.events, load_annotations(annotations), timestamps, tolerance
+        )
+        result.update(
+            precision=matched.precision,
+            recall=matched.recall,
+            true_positives=matched.true_positives,
+            false_positives=matched.false_positives,
+            false_negatives=matched.false_negatives,
+            latency_samples=(
+                {
+                    "mean": matched.mean_latency,
+                    "median": statistics.median(matched.latencies),
+                    "max": max(matched.latencies),
+                }
+                if matched.latencies
+                else None
+            ),
+        )
+    else:
+        result.update(precision=None, recall=None, latency_samples=None)
+    return result
+
+
+def compare(results: dict, baseline: dict):
+    print(f"\ncompared with {baseline.get('commit') or 'baseline'}:")
+    for name, result in results["traces"].items():
+        before = baseline["traces"].get(name)
+        if before is None or "error" in result or "error" in before:
+            continue
+        cost = result["cpu_us_per_sample"] / before["cpu_us_per_sample"] - 1
+        line = f"  {name:<16} cpu/sample {cost:+.1%}"
+        for metric in ("precision", "recall"):
+            if result.get(metric) is not None and before.get(metric) is not None:
+                line += f"  {metric} {result[metric] - before[metric]:+.3f}"
+        if result["events"] != before["events"]:
+            line += "  (detections changed)"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("traces", type=Path, nargs="+", help="Recordings or text dumps")
+    parser.add_argument("-o", "--output", type=Path, help="Write the results here")
+    parser.add_argument("--compare", type=Path, help="Results of an earlier run")
+    parser.add_argument("-r", "--repeats", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument(
+        "--tolerance",
+        type=int,
+        default=DEFAULT_TOLERANCE,
+        help="Samples a detection may be off from its annotation by",
+    )
+    args = parser.parse_args()
+
+    results = {
+        "commit": commit(),
+        "python": sys.version.split()[0],
+        "machine": platform.machine(),
+        "batch_size": args.batch_size,
+        "tolerance": args.tolerance,
+        "traces": {},
+    }
+    for trace in args.traces:
+        result = evaluate(trace, args.repeats, args.batch_size, args.tolerance)
+        results["traces"][trace.name] = result
+        if "error" in result:
+            print(f"{trace.name:<16} error: {result['error']}")
+            continue
+        accuracy = (
+            f"precision {result['precision']:.2f} recall {result['recall']:.2f}"
+            if result["precision"] is not None and result["recall"] is not None
+            else "not annotated"
+        )
+        print(
+            f"{trace.name:<16} {result['cpu_us_per_sample']:6.1f} us/sample  "
+            f"{result['peak_memory_kb']:7.0f} kB peak  "
+            f"{result['detected']['jump']} jumps {result['detected']['duck']} ducks  {accuracy}"
+        )
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+    if args.compare:
+        compare(results, json.loads(args.compare.read_text()))
+
+
+if __name__ == "__main__":
+    main()
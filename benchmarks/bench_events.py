@@ -0,0 +1,123 @@
+"""Event transport: events per second and send-to-receive delay over loopback, and what coalescing saves on a trace.
+
+    python benchmarks/bench_events.py -n 200000 --trace data/michelle.txt
+
+With `--listen`, stand in for the game instead: print every event `python -m dino serve` (or `plot`, `simulate`)
+sends, then loss, reordering and delay on Ctrl+C.
+
+    python benchmarks/bench_events.py --listen --port 12345
+"""
+
+import argparse
+import asyncio
+import socket
+import time
+
+from dino.socket_rpc import (
+    HOST,
+    PORT,
+    AsyncUDPSender,
+    EventReceiver,
+    EventSender,
+)
+
+
+async def throughput(n: int, burst: int, legacy: bool):
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+    sock.bind((HOST, 0))
+    transport, receiver = await loop.create_datagram_endpoint(EventReceiver, sock=sock)
+    async with AsyncUDPSender(*sock.getsockname()) as sender:
+        events = EventSender(sender, clock=lambda: 0, legacy=legacy)
+        start = time.perf_counter()
+        for i in range(n):
+            events.send(b"j" if i % 10 == 0 else b"s")
+            if i % burst == burst - 1:
+                # Wait for the receiver to catch up, as the game would between batches from the scale, rather than
+                # measuring how fast its socket buffer overflows
+                while receiver.packets < i + 1 and time.perf_counter() - start < 30:
+                    await asyncio.sleep(0)
+        while receiver.packets < n and time.perf_counter() - start < 30:
+            await asyncio.sleep(0.001)
+        elapsed = time.perf_counter() - start
+    transport.close()
+    return elapsed, receiver
+
+
+def coalescing(trace):
+    from dino.recording import load_samples
+    from dino.replay import replay_streaming
+
+    messages = replay_streaming(*load_samples(trace))
+    sent = {}
+    for coalesce in (False, True):
+
+        class _Count:
+            packets = 0
+
+            @classmethod
+            def send(cls, _message):
+                cls.packets += 1
+
+        events = EventSender(_Count, clock=lambda: 0, coalesce=coalesce)
+        for _ts, message in messages:
+            events.send(message)
+        sent[coalesce] = _Count.packets
+    return sent
+
+
+async def listen(host: str, port: int):
+    loop = asyncio.get_running_loop()
+    transport, receiver = await loop.create_datagram_endpoint(
+        lambda: EventReceiver(
+            lambda packet: print(
+                packet.kind.decode(), packet.seq, packet.source_ts, packet.coalesced
+            )
+        ),
+        local_addr=(host, port),
+    )
+    try:
+        await asyncio.Event().wait()
+    finally:
+        transport.close()
+        print(receiver)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--events", type=int, default=200_000)
+    parser.add_argument(
+        "--burst", type=int, default=8, help="Events sent before waiting for them"
+    )
+    parser.add_argument(
+        "--trace", type=str, help="Recording to count coalesced events on"
+    )
+    parser.add_argument("--listen", action="store_true", help="Stand in for the game")
+    parser.add_argument("--host", type=str, default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+
+    if args.listen:
+        try:
+            asyncio.run(listen(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    for legacy in (True, False):
+        elapsed, receiver = asyncio.run(throughput(args.events, args.burst, legacy))
+        name = "one byte" if legacy else "header"
+        print(
+            f"{name:<9} {args.events / elapsed / 1e3:8.1f} k events/s  received {receiver.packets}"
+        )
+        if not legacy:
+            print(f"          {receiver}")
+
+    if args.trace:
+        sent = coalescing(args.trace)
+        print(f"{args.trace}: {sent[False]} datagrams, {sent[True]} with --coalesce")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Start-up cost of the headless `serve` path versus the GUI path: wall time and peak RSS of a fresh interpreter.
+
+`import dino.plot` is what `import dino` used to do unconditionally.
+
+    python benchmarks/bench_import.py -n 10
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+CASES = {
+    "python": "pass",
+    "import dino": "import dino",
+    "serve path": "import dino.__main__, dino.runtime",
+    "gui path (old import dino)": "import dino.__main__, dino.plot",
+}
+
+# Run in the child, so the numbers only cover that one interpreter
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+exec(sys.argv[1])
+elapsed = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+# ru_maxrss is in bytes on macOS and kilobytes elsewhere
+print(json.dumps({"seconds": elapsed, "rss_mb": rss / (2**20 if sys.platform == "darwin" else 2**10),
+                  "matplotlib": "matplotlib" in sys.modules}))
+"""
+
+
+def measure(statement: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE, statement],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'':<28} {'import ms':>10} {'peak RSS MB':>12} {'matplotlib':>11}")
+    for name, statement in CASES.items():
+        runs = [measure(statement) for _ in range(args.runs)]
+        seconds = statistics.median(run["seconds"] for run in runs)
+        rss = statistics.median(run["rss_mb"] for run in runs)
+        print(
+            f"{name:<28} {seconds * 1e3:>10.1f} {rss:>12.1f} {str(runs[0]['matplotlib']):>11}"
+        )
+
+
+if __name__ == "__main__":
+    main()
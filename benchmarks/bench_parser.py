@@ -0,0 +1,89 @@
+"""Parse a synthetic OpenScale capture line by line (`handle_line`) and chunk by chunk (`handle_chunk`).
+
+python benchmarks/bench_parser.py -n 1000000 --corrupt 0.001
+"""
+
+import argparse
+import random
+import time
+
+from dino.openscale_serial.fake_scale import SPLASH, format_readings
+from dino.openscale_serial.openscale_reader import OpenScaleReader
+
+
+def synthetic_capture(n: int, corrupt: float, seed=0) -> bytes:
+    rng = random.Random(seed)
+    lines = format_readings(
+        range(0, 50 * n, 50), (rng.uniform(-5, 200) for _ in range(n))
+    )
+    for i in range(n):
+        if rng.random() < corrupt:
+            # Dropped bytes, line noise or a truncated line
+            line = lines[i]
+            cut = rng.randrange(1, len(line) - 2)
+            lines[i] = rng.choice(
+                [
+                    line[:cut] + line[cut + 1 :],
+                    line[:cut] + b"\xff" + line[cut:],
+                    line[:cut] + b"\r\n",
+                ]
+            )
+    return SPLASH + b"".join(lines)
+
+
+def chunks(capture: bytes, size: int):
+    """Split at line boundaries into roughly `size`-byte blocks, like SerialSource hands to the parser"""
+    start = 0
+    while start < len(capture):
+        end = (
+            capture.rfind(b"\n", start, start + size) + 1
+            or capture.find(b"\n", start) + 1
+        )
+        if not end:
+            end = len(capture)
+        yield capture[start:end]
+        start = end
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--lines", type=int, default=1_000_000)
+    parser.add_argument(
+        "--corrupt", type=float, default=0.001, help="Fraction of lines to corrupt"
+    )
+    parser.add_argument(
+        "--chunk-sizes", type=int, nargs="+", default=[512, 4096, 65536]
+    )
+    args = parser.parse_args()
+
+    capture = synthetic_capture(args.lines, args.corrupt)
+    print(
+        f"{len(capture) / 1e6:.1f} MB, {args.lines} lines, {args.corrupt:.2%} corrupt"
+    )
+
+    def report(name, seconds, reader):
+        print(
+            f"{name:<22} {seconds:6.3f}s {args.lines / seconds / 1e6:6.2f} M lines/s "
+            f"({reader.readings} readings, {reader.malformed} malformed)"
+        )
+
+    samples = []
+    reader = OpenScaleReader(lambda *item: samples.append(item))
+    lines = capture.split(b"\n")
+    start = time.perf_counter()
+    for line in lines:
+        reader.handle_line(line)
+    report("handle_line", time.perf_counter() - start, reader)
+
+    for size in args.chunk_sizes:
+        blocks = list(chunks(capture, size))
+        batches = []
+        reader = OpenScaleReader(batch_callback=lambda ts, w: batches.append((ts, w)))
+        start = time.perf_counter()
+        for block in blocks:
+            reader.handle_chunk(block)
+        report(f"handle_chunk {size}B", time.perf_counter() - start, reader)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Per-sample cost of pattern matching as the number of registered patterns grows.
+
+Compares re-evaluating every pattern over its window (`PatternMatcher.match`) with the compiled automaton behind
+`PatternMatcher.receive_item`, on a recorded trace.
+
+    python benchmarks/bench_pattern_matching.py data/michelle.txt
+"""
+import argparse
+import operator
+import random
+import time
+from pathlib import Path
+
+from dino.buffer import Buffer
+from dino.pattern_matching import PatternMatcher
+from dino.pattern_matching.patterns import (
+    mag_rel,
+    peak_down,
+    peak_up,
+    tare,
+    gt_pos_5p,
+    lt_neg_5p,
+)
+from dino.recording import load_samples
+
+COMPARATORS = [
+    tare,
+    peak_up,
+    peak_down,
+    gt_pos_5p,
+    lt_neg_5p,
+    *(mag_rel(operator.lt, mag) for mag in (1, 3, 7, 20)),
+]
+
+
+def make_patterns(n: int, rng: random.Random):
+    patterns = [
+        ("steady_1s", (tare,) * 20),
+        ("steady_velocity", (mag_rel(operator.lt, 1),) * 4),
+        ("positive_large", (peak_up, peak_up)),
+    ]
+    while len(patterns) < n:
+        length = rng.randint(2, 20)
+        if rng.random() < 0.5:
+            pattern = (rng.choice(COMPARATORS),) * length
+        else:
+            pattern = tuple(rng.choice(COMPARATORS) for _ in range(length))
+        patterns.append((f"pattern_{len(patterns)}", pattern))
+    return patterns[:n]
+
+
+def bench(values, patterns, mode: str) -> float:
+    matcher = PatternMatcher()
+    for name, pattern in patterns:
+        matcher.register_pattern(name, pattern, lambda: None)
+    buffer = Buffer()
+
+    start = time.perf_counter()
+    if mode == "window":
+        for i, value in enumerate(values):
+            buffer.append(i, value)
+            matcher.match(buffer.values)
+    else:
+        for i, value in enumerate(values):
+            buffer.append(i, value)
+            matcher.receive_item((i, value))
+    return (time.perf_counter() - start) / len(values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "trace", type=Path, help="Text dump, recording or session to replay"
+    )
+    parser.add_argument(
+        "-n",
+        "--counts",
+        type=int,
+        nargs="+",
+        default=[3, 10, 30, 100],
+        help="Numbers of patterns to register",
+    )
+    args = parser.parse_args()
+
+    values = load_samples(args.trace)[1].tolist()
+
+    print(f"{'patterns':>8} {'window us/sample':>17} {'automaton us/sample':>20} {'speedup':>8}")
+    for n in args.counts:
+        patterns = make_patterns(n, random.Random(n))
+        window = bench(values, patterns, "window")
+        automaton = bench(values, patterns, "automaton")
+        print(
+            f"{n:>8} {window * 1e6:>17.1f} {automaton * 1e6:>20.1f} {window / automaton:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
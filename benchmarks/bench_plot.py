@@ -0,0 +1,67 @@
+"""Time to draw a frame of `Plotter` as the plotted window grows, with and without decimation.
+
+Renders off-screen (Agg). Each window is filled with a synthetic force trace at the scale's sample rate, then frames
+are drawn the way the live plot draws them, with one new sample between frames.
+
+    python benchmarks/bench_plot.py --minutes 1 10 30 --blit
+"""
+
+import argparse
+import os
+import time
+import typing as t
+
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import numpy as np
+
+import dino.plot
+from dino.decimation import DEFAULT_MAX_POINTS
+from dino.openscale_serial.openscale_reader import SAMPLES_PER_SEC
+
+
+def frame_ms(
+    minutes: int, max_points: t.Optional[int], blit: bool, frames: int
+) -> float:
+    """Mean ms per frame; `max_points` None gives a bucket per sample, ie every sample drawn"""
+    n = SAMPLES_PER_SEC * 60 * minutes
+    # The plotted window is as long as the series buffers
+    dino.plot.BUFFER_MINUTES = minutes
+    dino.plot.ANIMATION = None
+    plotter = dino.plot.Plotter(
+        n_derivates=1, blit=blit, max_points=max_points or 2 * n
+    )
+    series = plotter.get_differentiable_series("Force")
+    rng = np.random.default_rng(0)
+    timestamps = np.arange(n + frames) * (1000 // SAMPLES_PER_SEC)
+    values = 150 + np.cumsum(rng.normal(0, 0.5, n + frames))
+    for item in zip(timestamps[:n].tolist(), values[:n].tolist()):
+        series.append_item(item)
+
+    plotter.draw_frame()
+    plotter.figure.canvas.draw()
+    start = time.perf_counter()
+    for item in zip(timestamps[n:].tolist(), values[n:].tolist()):
+        series.append_item(item)
+        plotter.draw_frame()
+    elapsed = time.perf_counter() - start
+    plotter.stop()
+    return elapsed / frames * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--minutes", type=int, nargs="+", default=[1, 10, 30])
+    parser.add_argument("--max-points", type=int, default=DEFAULT_MAX_POINTS)
+    parser.add_argument("--blit", action="store_true")
+    parser.add_argument("-n", "--frames", type=int, default=50)
+    args = parser.parse_args()
+
+    for label, max_points in (("decimated", args.max_points), ("every sample", None)):
+        for minutes in args.minutes:
+            ms = frame_ms(minutes, max_points, args.blit, args.frames)
+            print(f"{label:<13} {minutes:3d} min  {ms:7.2f} ms/frame")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Throughput of the vectorized batch replay against the streaming objects it stands in for.
+
+The trace is tiled end to end (with timestamps shifted so they keep increasing) to reach the requested length.
+
+    python benchmarks/bench_replay.py data/michelle.txt -n 2000000
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+from dino.recording import load_samples
+from dino.replay import replay, replay_streaming
+
+
+def tile(timestamps, force, n):
+    repeats = -(-n // len(force))
+    span = timestamps[-1] - timestamps[0] + (timestamps[1] - timestamps[0])
+    offsets = np.repeat(np.arange(repeats, dtype=np.int64) * span, len(timestamps))
+    return (np.tile(timestamps, repeats) + offsets)[:n], np.tile(force, repeats)[:n]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("trace", type=Path, help="Recording or text dump to replay")
+    parser.add_argument(
+        "-n", "--samples", type=int, default=2_000_000, help="Samples to replay"
+    )
+    parser.add_argument(
+        "--streaming-samples",
+        type=int,
+        default=50_000,
+        help="Samples to push through the streaming path for comparison",
+    )
+    args = parser.parse_args()
+
+    timestamps, force = load_samples(args.trace)
+
+    ts, y = tile(timestamps, force, args.samples)
+    start = time.perf_counter()
+    result = replay(ts, y)
+    elapsed = time.perf_counter() - start
+    print(
+        f"batch:     {len(y):>9} samples in {elapsed:6.3f}s "
+        f"({len(y) / elapsed / 1e6:6.2f} M samples/s, {len(result.event_timestamps)} events)"
+    )
+
+    ts, y = tile(timestamps, force, args.streaming_samples)
+    start = time.perf_counter()
+    messages = replay_streaming(ts, y)
+    elapsed = time.perf_counter() - start
+    print(
+        f"streaming: {len(y):>9} samples in {elapsed:6.3f}s "
+        f"({len(y) / elapsed / 1e6:6.2f} M samples/s, {len(messages)} events)"
+    )
+
+
+if __name__ == "__main__":
+    main()
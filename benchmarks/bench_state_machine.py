@@ -0,0 +1,104 @@
+"""Events per second through `DinoStateMachine`: one `receive_event` at a time and whole arrays with `feed`.
+
+`if/elif` is the machine as it was before it was table-driven (without its print on every transition), for
+comparison. Events are drawn at random, so there are many more transitions than a real session has.
+
+    python benchmarks/bench_state_machine.py -n 1000000
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from dino.state_machine import DinoStateMachine
+from dino.state_machine.state_machine import EVENTS
+from dino.state_machine.types import Event, State
+
+
+class IfElseMachine:
+    def __init__(self):
+        self.current_state = State.UNCALIBRATED
+        self.allowed_transitions = {
+            State.UNCALIBRATED: {State.UNCALIBRATED, State.STEADY},
+            State.STEADY: {State.STEADY, State.DUCKING, State.JUMPING},
+            State.JUMPING: {State.JUMPING, State.STEADY},
+            State.DUCKING: {State.DUCKING, State.STEADY, State.JUMPING},
+        }
+        self.transition_callbacks = {}
+        self.time_in_state = 0
+
+    def receive_event(self, event):
+        new_state = self.current_state
+        if self.current_state == State.UNCALIBRATED:
+            if event == event.VELOCITY_STEADY:
+                new_state = State.STEADY
+        elif self.current_state == State.STEADY:
+            if event in (Event.VELOCITY_POSITIVE_SMALL, Event.VELOCITY_POSITIVE_LARGE):
+                new_state = State.JUMPING
+            if event == Event.VELOCITY_NEGATIVE:
+                new_state = State.DUCKING
+        elif self.current_state == State.JUMPING:
+            if event == Event.VELOCITY_STEADY:
+                new_state = State.STEADY
+            if self.time_in_state >= 4:
+                new_state = State.STEADY
+        elif self.current_state == State.DUCKING:
+            if event == Event.VELOCITY_POSITIVE_SMALL:
+                new_state = State.STEADY
+            if event == Event.VELOCITY_POSITIVE_LARGE:
+                new_state = State.JUMPING
+        if new_state in self.allowed_transitions.get(self.current_state, set()):
+            if new_state != self.current_state:
+                self.time_in_state = 0
+            callback = self.transition_callbacks.get(self.current_state, {}).get(
+                new_state, None
+            )
+            self.current_state = new_state
+            if callback is not None:
+                callback()
+
+
+def timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--events", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    codes = rng.integers(0, len(EVENTS), args.events).astype(np.int8)
+    timestamps = np.cumsum(rng.integers(0, 100, args.events))
+    events = [EVENTS[code] for code in codes.tolist()]
+    stamps = timestamps.tolist()
+
+    def one_at_a_time(machine):
+        def run():
+            for event in events:
+                machine.receive_event(event)
+
+        return run
+
+    def one_at_a_time_with_time():
+        machine = DinoStateMachine()
+        for event, ts in zip(events, stamps):
+            machine.receive_event(event, ts)
+
+    cases = {
+        "if/elif receive_event": one_at_a_time(IfElseMachine()),
+        "table receive_event": one_at_a_time(DinoStateMachine()),
+        "table receive_event + ts": one_at_a_time_with_time,
+        "table feed": lambda: DinoStateMachine().feed(codes),
+        "table feed + ts": lambda: DinoStateMachine().feed(codes, timestamps),
+    }
+    for name, fn in cases.items():
+        elapsed = timed(fn)
+        print(f"{name:<26} {args.events / elapsed / 1e6:6.2f} M events/s")
+
+
+if __name__ == "__main__":
+    main()
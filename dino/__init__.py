@@ -1,14 +1,34 @@
-from .openscale_serial import OpenScaleReader
-from .pattern_matching import PatternMatcher
-from .plot import Plotter
-from .state_machine import DinoStateMachine
-from .state_machine.types import State, Event
-
-__all__ = [
-    OpenScaleReader,
-    PatternMatcher,
-    Plotter,
-    DinoStateMachine,
-    State,
-    Event,
-]
+import importlib
+import typing as t
+
+# Loaded on first access, so `import dino` (and the headless `serve` path) never pays for matplotlib
+_LAZY = {
+    "OpenScaleReader": ".openscale_serial",
+    "PatternMatcher": ".pattern_matching",
+    "Plotter": ".plot",
+    "DinoStateMachine": ".state_machine",
+    "State": ".state_machine.types",
+    "Event": ".state_machine.types",
+}
+
+__all__ = list(_LAZY)
+
+if t.TYPE_CHECKING:
+    from .openscale_serial import OpenScaleReader
+    from .pattern_matching import PatternMatcher
+    from .plot import Plotter
+    from .state_machine import DinoStateMachine
+    from .state_machine.types import State, Event
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_LAZY[name], __name__), name)
+    # Cache it, so later lookups don't come back through here
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
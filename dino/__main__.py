@@ -1,163 +1,250 @@
-import operator
-from functools import partial
-from threading import Thread
-
-from dino import (
-    DinoStateMachine,
-    PatternMatcher,
-    OpenScaleReader,
-    Plotter,
-    State,
-    Event,
-)
+import asyncio
+import logging
+
 from dino.args import collect_args
-from dino.buffer import Buffer
-from dino.openscale_serial.openscale_reader import (
-    read_from_serial,
-    SAMPLES_PER_SEC,
-)
-from dino.pattern_matching.patterns import (
-    mag_rel,
-    tare,
-    peak_up,
-    peak_down,
+from dino.latency import LatencyRecorder, report_on_signal
+from dino.pipeline import (
+    DinoPipeline,
+    connect_feed,
+    connect_plotter,
+    connect_recorder,
+    connect_recording,
 )
-from dino.physics import PhysicsSolver
-from dino.simulate import Simulator
-from dino.socket_rpc import SocketSender
-
-SHORT_SAMPLES = 3
-POS_LARGE_THRESH = 20
-POS_SMALL_THRESH = 7
-NEG_THRESH = -3
-STABLE_THRESH = 1
+from dino.players import make_players, run_players
+from dino.plot_process import RemotePlotter
+from dino.recording import RecordingWriter, load_samples
+from dino.replay import replay
+from dino.runtime import SerialSource, SimulatedSource, run
+from dino.session import SessionWriter
+from dino.smoother import make_filter
+from dino.socket_rpc import AsyncUDPSender, EventSender
 
 
 def main():
     args = collect_args()
 
-    # Create a matplotlib window to view the animated data
-    plotter = Plotter(n_derivates=args.n_derivatives)
-    # Make a pattern matcher to help us recognize trends in the data
-    force_matcher = PatternMatcher()
-    velocity_matcher = PatternMatcher()
-
-    socket_rpc = SocketSender()
-
-    # Add a buffer to store the last several samples
-    buffer = Buffer()
-
-    # Add a simple state machine to tare the data and calculate user weight/velocity/position
-    physics = PhysicsSolver(buffer)
-
-    # Create some patterns
-    register_default_patterns(force_matcher, physics, velocity_matcher,         lambda color: plotter.draw_vertical_line(buffer.last_item[0], color),
-        socket_rpc)
-
-    # Plot the data as it comes in
-    def pass_tared_to_plotter(last_item):
-        ts, y = last_item
-        plotter.get_differentiable_series("Force").append(
-            (ts, physics.correct_for_tare(y))
-        )
-
-    buffer.register_callback(
-        partial(
-            Buffer.call_with_last_item,
-            pass_tared_to_plotter,
-        )
+    if args.command == "simulate" and args.fast:
+        # Skip the animation entirely and run the detectors over the whole trace in one go
+        try:
+            result = replay(*load_samples(args.simulation_data_file))
+        except RuntimeError as e:
+            # eg a trace that starts with someone already on the scale
+            raise SystemExit(f"{args.simulation_data_file}: {e}")
+        for ts, message in result.messages:
+            print(ts, message.decode())
+        return
+
+    if args.command == "serve":
+        serve(args)
+        return
+
+    if args.command == "sweep":
+        sweep(args)
+        return
+
+    plot_args = dict(
+        n_derivates=args.n_derivatives,
+        blit=args.blit,
+        fps=args.fps,
+        max_points=args.max_points,
     )
-
-    buffer.register_callback(
-        lambda buffer: plotter.set_min_x(buffer[0][0])
+    if args.plot_process:
+        # matplotlib only gets imported in the child
+        plotter = RemotePlotter(**plot_args).start()
+    else:
+        # Only the GUI commands pay for matplotlib
+        from dino.plot import Plotter
+
+        # Create a matplotlib window to view the animated data
+        plotter = Plotter(**plot_args)
+
+    # Tare the scale, integrate force into velocity/position and match jumps, sending events to the game
+    sender = AsyncUDPSender(args.host, args.udp_port)
+    events = EventSender(sender, coalesce=args.coalesce, legacy=args.legacy_events)
+    smoother = make_filter(args.filter) if args.filter else None
+    pipeline = DinoPipeline(events, plotter.draw_vertical_line, smoother)
+    if smoother is not None:
+        print("Filter:", smoother)
+    events.clock = lambda: pipeline.now
+    connect_plotter(pipeline, plotter, args.n_integrals)
+    latency = LatencyRecorder() if args.latency else None
+    pipeline.latency = latency
+    feeds = connect_feed(pipeline, args.feed) if args.feed else {}
+    recorder = (
+        connect_recorder(
+            pipeline, SessionWriter(args.record, drop=not args.record_wait)
+        ).start()
+        if args.record
+        else None
     )
-
-    if args.n_integrals >= 1:
-        physics.velocity.register_callback(
-            partial(
-                Buffer.call_with_last_item,
-                plotter.get_differentiable_series("Velocity").append,
-            )
-        )
-
-    if args.n_integrals >= 2:
-        physics.position.register_callback(
-            partial(
-                Buffer.call_with_last_item,
-                plotter.get_differentiable_series("Position").append,
-            )
-        )
-
-    # Attempt to pattern match on incoming data
-    buffer.register_callback(partial(Buffer.call_with_underlying, force_matcher.match))
-
-    physics.velocity.register_callback(
-        partial(Buffer.call_with_underlying, velocity_matcher.match)
+    dump = (
+        connect_recording(pipeline, RecordingWriter(open(args.dump, "wb")))
+        if args.dump
+        else None
     )
 
     # Either ingest or simulate the data
     if args.command == "plot":
-        # Create a reader that feeds data to the buffer
-        reader = OpenScaleReader(buffer.append)
-
-        # Run the openscale data collection in the background so it can ingest data as fast as possible
-        runner = Thread(
-            target=partial(
-                read_from_serial,
-                reader.handle_line,
-                port=args.port,
-                baud=args.baudrate,
-                limit=args.limit,
-            ),
-            daemon=True,
-        )
-
+        source = SerialSource(port=args.port, baud=args.baudrate, limit=args.limit)
+        source.latency = latency
     elif args.command == "simulate":
         # Read a trace of weights from a file
-        reader = Simulator(open(args.simulation_data_file, "r"), buffer.append)
-
-        runner = Thread(
-            target=reader.simulate,
-            daemon=True,
-        )
+        source = SimulatedSource(*load_samples(args.simulation_data_file))
     else:
         raise RuntimeError(f"Unknown command: {args.command}")
 
-    runner.start()
-
-    # Show the graph. This will block until the X button is clicked
-    plotter.animate()
-    print("Stopped animation")
-
-    # Kill the thread reading the data
-    reader.stop()
-
-
-def register_default_patterns(force_matcher, physics, velocity_matcher, draw_vline, socket_rpc):
-    def on_jump():
-        draw_vline("green")
-        socket_rpc.send(b"j")
-
-    def on_steady():
-        # draw_vline("orange")
-        socket_rpc.send(b"s")
-
-    force_matcher.register_pattern(
-        "steady_1s",
-        (tare,)
-        * SAMPLES_PER_SEC,  # 20 samples either close to each other or very small
-        physics.calibrate_steady_state,
-    )
-    velocity_matcher.register_pattern(
-        "steady_velocity",
-        (mag_rel(operator.lt, STABLE_THRESH),) * (SAMPLES_PER_SEC // 5),
-        on_steady,
-    )
-    velocity_matcher.register_pattern(
-        "positive_large",
-        (peak_up, peak_up),
-        on_jump,
+    if latency is not None:
+        latency.install_signal_handler()
+
+    # Read, process and draw on one event loop until the window is closed
+    try:
+        asyncio.run(run(source, pipeline, plotter, sender))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        plotter.stop()
+        for writer in feeds.values():
+            writer.close()
+        if recorder is not None:
+            recorder.close()
+        if dump is not None:
+            dump.close()
+    print("Stopped")
+
+    if isinstance(source, SerialSource):
+        print("Serial stats:", source.stats)
+    if isinstance(plotter, RemotePlotter):
+        print("Plot process:", plotter.stats)
+    print(pipeline.report())
+    print("Events:", events)
+    if recorder is not None:
+        print("Recorded:", recorder.stats)
+    if latency is not None:
+        print(latency.report())
+
+
+def serve(args):
+    """No GUI: one player per serial port, each with their own pipeline and event channel"""
+    if args.debug:
+        logging.basicConfig(format="%(name)s: %(message)s")
+        logging.getLogger("dino").setLevel(logging.DEBUG)
+    sender = AsyncUDPSender(args.host, args.udp_port)
+    sources = [
+        SerialSource(port=port, baud=args.baudrate, limit=args.limit)
+        for port in args.port
+    ]
+    players = make_players(
+        sources,
+        sender,
+        latency=args.latency,
+        debug=args.debug,
+        coalesce=args.coalesce,
+        smoother=args.filter,
+        legacy=args.legacy_events,
     )
+    if args.filter:
+        print("Filter:", players[0].pipeline.smoother)
+    feeds, recorders, dumps = [], {}, []
+    for i, player in enumerate(players):
+        player.source.latency = player.pipeline.latency
+        if args.feed:
+            prefix = args.feed if len(players) == 1 else f"{args.feed}-{i + 1}"
+            feeds.extend(connect_feed(player.pipeline, prefix).values())
+        if args.record:
+            directory = (
+                args.record if len(players) == 1 else args.record / f"player-{i + 1}"
+            )
+            recorders[player.name] = connect_recorder(
+                player.pipeline, SessionWriter(directory, drop=not args.record_wait)
+            ).start()
+        if args.dump:
+            path = (
+                args.dump
+                if len(players) == 1
+                else args.dump.with_stem(f"{args.dump.stem}-{i + 1}")
+            )
+            dumps.append(
+                connect_recording(player.pipeline, RecordingWriter(open(path, "wb")))
+            )
+
+    def report() -> str:
+        sections = []
+        for player in players:
+            sections.append(
+                f"{player.name} ({player.source.port}): {player.source.stats}"
+            )
+            if player.error is not None:
+                sections.append(f"Stopped early: {player.error!r}")
+            sections.append(player.pipeline.report())
+            sections.append(f"Events: {player.events}")
+            if player.name in recorders:
+                sections.append(f"Recorded: {recorders[player.name].stats}")
+            if player.pipeline.latency is not None:
+                sections.append(player.pipeline.latency.report())
+        return "\n".join(sections)
+
+    if args.latency:
+        report_on_signal(report)
+
+    try:
+        asyncio.run(run_players(players, sender))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for writer in feeds:
+            writer.close()
+        for recorder in recorders.values():
+            recorder.close()
+        for dump in dumps:
+            dump.close()
+    print("Stopped")
+    print(report())
+
+
+def sweep(args):
+    """Score threshold settings over every annotated trace, on every core, and list the best"""
+    import json
+    from dataclasses import asdict
+
+    from dino.evaluation import annotation_path, load_annotations
+    from dino.sweep import random_search, run_sweep, grid
+
+    traces = {}
+    for path in args.traces:
+        annotations = annotation_path(path)
+        if not annotations.exists():
+            print(f"Skipping {path}: no {annotations.name}")
+            continue
+        traces[path.name] = (*load_samples(path), load_annotations(annotations))
+    if not traces:
+        raise SystemExit("None of the traces are annotated")
+
+    if args.random:
+        ranges = {}
+        for name, bounds in args.range:
+            low, high = bounds.split(":")
+            ranges[name] = (float(low), float(high))
+        candidates = random_search(args.random, ranges or None, args.seed)
+    else:
+        candidates = grid({name: values.split(",") for name, values in args.grid})
+    print(f"Trying {len(candidates)} settings on {len(traces)} traces")
+
+    trials = run_sweep(traces, candidates, args.jobs, args.tolerance)
+    for trial in trials[: args.top]:
+        latency = trial.mean_latency
+        print(
+            f"f1 {trial.f1:.3f}  latency "
+            + ("   -  " if latency is None else f"{latency:5.1f} ")
+            + f"fp {trial.score.false_positives:<3} "
+            + " ".join(
+                f"{name}={value:g}" for name, value in asdict(trial.params).items()
+            )
+            + (f"  (failed on {', '.join(trial.failed)})" if trial.failed else "")
+        )
+    if args.output:
+        args.output.write_text(
+            json.dumps([trial.as_dict() for trial in trials], indent=2)
+        )
 
 
 if __name__ == "__main__":
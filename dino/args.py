@@ -1,17 +1,34 @@
 import argparse
+import typing as t
+from pathlib import Path
 
+from dino.decimation import DEFAULT_MAX_POINTS
+from dino.evaluation import DEFAULT_TOLERANCE
 from dino.openscale_serial.openscale_reader import DEFAULT_PORT, DEFAULT_BAUD
+from dino.smoother import FILTERS, make_filter
+from dino.socket_rpc import HOST, PORT
+from dino.sweep import PARAMETERS
 
 
-def collect_serial_args(parser):
-    parser.add_argument(
-        "-p",
-        "--port",
-        type=str,
-        action="store",
-        default=DEFAULT_PORT,
-        help="COM/Serial port to read from",
-    )
+def collect_serial_args(parser, multiple=False):
+    if multiple:
+        parser.add_argument(
+            "-p",
+            "--port",
+            type=str,
+            action="append",
+            default=None,
+            help="COM/Serial port to read from. Repeat for one player per scale",
+        )
+    else:
+        parser.add_argument(
+            "-p",
+            "--port",
+            type=str,
+            action="store",
+            default=DEFAULT_PORT,
+            help="COM/Serial port to read from",
+        )
     parser.add_argument(
         "-b",
         "--baudrate",
@@ -32,12 +49,121 @@ def collect_serial_args(parser):
     return parser
 
 
+def collect_latency_args(parser):
+    parser.add_argument(
+        "--latency",
+        action="store_true",
+        help="Measure latency from serial read to event send; report on exit or SIGUSR1",
+    )
+    return parser
+
+
+def collect_event_args(parser):
+    parser.add_argument(
+        "--host",
+        type=str,
+        action="store",
+        default=HOST,
+        help="Host the game listens on",
+    )
+    parser.add_argument(
+        "--udp-port",
+        type=int,
+        action="store",
+        default=PORT,
+        help="UDP port the game listens on (the first player's, when serving several)",
+    )
+    parser.add_argument(
+        "--coalesce",
+        action="store_true",
+        help="Don't send steady events while the game is already steady",
+    )
+    parser.add_argument(
+        "--legacy-events",
+        action="store_true",
+        help="Send bare one-byte events, without sequence numbers or timestamps",
+    )
+    return parser
+
+
+def _filter_spec(text: str) -> str:
+    # Build the filter once just to check the spec; each player gets their own from it later
+    try:
+        make_filter(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return text
+
+
+def collect_filter_args(parser):
+    parser.add_argument(
+        "--filter",
+        type=_filter_spec,
+        action="store",
+        default=None,
+        metavar="NAME[:PARAMS]",
+        help=f"Filter the force before detecting anything: one of {', '.join(FILTERS)}, "
+        "optionally with comma-separated parameters (eg median:7)",
+    )
+    return parser
+
+
+def collect_feed_args(parser):
+    parser.add_argument(
+        "--feed",
+        type=str,
+        action="store",
+        default=None,
+        help="Publish force, velocity and position to shared memory as FEED-force etc., for other processes to read",
+    )
+    return parser
+
+
+def collect_record_args(parser):
+    parser.add_argument(
+        "--record",
+        type=Path,
+        action="store",
+        default=None,
+        metavar="DIR",
+        help="Record the whole session (raw force, velocity, position and events) as compressed segments in DIR",
+    )
+    parser.add_argument(
+        "--record-wait",
+        action="store_true",
+        help="When the disk can't keep up with --record, hold up the pipeline instead of dropping recorded samples",
+    )
+    parser.add_argument(
+        "--dump",
+        type=Path,
+        action="store",
+        default=None,
+        metavar="FILE",
+        help="Write the raw force to FILE as a binary recording, which simulate and replay read back",
+    )
+    return parser
+
+
+def collect_debug_args(parser):
+    parser.add_argument(
+        "--debug",
+        action="store_true",
+        help="Log every player's state transitions",
+    )
+    return parser
+
+
 def collect_simulate_args(parser):
     parser.add_argument(
         "simulation_data_file",
         type=str,
         action="store",
-        help="File from which to read dumped simulation data",
+        help="File from which to read dumped simulation data, or a directory recorded with --record",
+    )
+    parser.add_argument(
+        "--fast",
+        action="store_true",
+        help="Replay the whole file at once without plotting and print the detected events",
     )
     return parser
 
@@ -61,6 +187,106 @@ def collect_plot_args(parser):
         help="Number of integrals to show on the plot",
     )
 
+    parser.add_argument(
+        "--blit",
+        action="store_true",
+        help="Only redraw the data between full redraws of the axes (much faster)",
+    )
+
+    parser.add_argument(
+        "--plot-process",
+        action="store_true",
+        help="Draw the plot from a separate process, so redrawing never holds up reading the scale",
+    )
+
+    parser.add_argument(
+        "--max-points",
+        type=int,
+        action="store",
+        default=DEFAULT_MAX_POINTS,
+        help="Decimate each plotted line to about this many points, keeping every peak",
+    )
+
+    parser.add_argument(
+        "--fps",
+        type=int,
+        action="store",
+        default=25,
+        help="Frames per second to draw at when blitting",
+    )
+
+    return parser
+
+
+def _assignment(text: str) -> t.Tuple[str, str]:
+    name, equals, value = text.partition("=")
+    if not equals:
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE, got {text!r}")
+    return name, value
+
+
+def collect_sweep_args(parser):
+    parser.add_argument(
+        "traces",
+        type=Path,
+        nargs="+",
+        help="Recordings or text dumps, each annotated with a .events file next to it",
+    )
+    parser.add_argument(
+        "--grid",
+        type=_assignment,
+        action="append",
+        default=[],
+        metavar="NAME=V1,V2,...",
+        help=f"Values to try for a threshold; repeat for more. One of {', '.join(PARAMETERS)}",
+    )
+    parser.add_argument(
+        "--random",
+        type=int,
+        action="store",
+        default=None,
+        metavar="N",
+        help="Try N random settings instead of a grid",
+    )
+    parser.add_argument(
+        "--range",
+        type=_assignment,
+        action="append",
+        default=[],
+        metavar="NAME=LOW:HIGH",
+        help="Where --random draws a threshold from (defaults to all of them over sensible ranges)",
+    )
+    parser.add_argument("--seed", type=int, action="store", default=0)
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        action="store",
+        default=None,
+        help="Worker processes (one per core by default)",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=int,
+        action="store",
+        default=DEFAULT_TOLERANCE,
+        help="Samples a detection may be off from its annotation by",
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        action="store",
+        default=10,
+        help="How many of the best settings to print",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        action="store",
+        default=None,
+        help="Write every result, best first, here as JSON",
+    )
     return parser
 
 
@@ -75,7 +301,58 @@ def collect_args():
         "plot", help="Plot live readings from the openscale"
     )
 
-    _plot_parser = collect_serial_args(collect_plot_args(plot_parser))
-    _simulate_parser = collect_simulate_args(collect_plot_args(simulate_parser))
+    serve_parser = operations.add_parser(
+        "serve", help="Send events from the openscale to the game, without plotting"
+    )
+    sweep_parser = operations.add_parser(
+        "sweep",
+        help="Search for the detector thresholds that best fit annotated traces",
+    )
+
+    _plot_parser = collect_record_args(
+        collect_filter_args(
+            collect_feed_args(
+                collect_event_args(
+                    collect_latency_args(
+                        collect_serial_args(collect_plot_args(plot_parser))
+                    )
+                )
+            )
+        )
+    )
+    _simulate_parser = collect_record_args(
+        collect_filter_args(
+            collect_feed_args(
+                collect_event_args(
+                    collect_latency_args(
+                        collect_simulate_args(collect_plot_args(simulate_parser))
+                    )
+                )
+            )
+        )
+    )
+    _serve_parser = collect_record_args(
+        collect_filter_args(
+            collect_feed_args(
+                collect_event_args(
+                    collect_latency_args(
+                        collect_debug_args(
+                            collect_serial_args(serve_parser, multiple=True)
+                        )
+                    )
+                )
+            )
+        )
+    )
+
+    _sweep_parser = collect_sweep_args(sweep_parser)
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.command == "sweep":
+        if args.range and not args.random:
+            sweep_parser.error("--range only applies to --random")
+        if args.grid and args.random:
+            sweep_parser.error("choose either --grid or --random")
+    if args.command == "serve" and args.port is None:
+        args.port = [DEFAULT_PORT]
+    return args
@@ -1,24 +1,82 @@
-from collections import deque
 import typing as t
+import unittest
+from functools import partial
+
+import numpy as np
+
 from dino.openscale_serial.openscale_reader import SAMPLES_PER_SEC
 
 BUFFER_MINUTES = 1
 
 
 class Buffer:
+    """Fixed-capacity ring buffer of (timestamp, value) samples.
+
+    Samples live in preallocated int64/float64 arrays that are twice the capacity. Every sample is written at both
+    `i` and `i + maxlen`, so the most recent `n <= maxlen` samples are always contiguous and can be handed out as
+    zero-copy views.
+    """
+
     def __init__(self, maxlen=SAMPLES_PER_SEC * 60 * BUFFER_MINUTES):
-        self.buffer = deque(maxlen=maxlen)
+        self.maxlen = maxlen
+        self._timestamps = np.zeros(2 * maxlen, dtype=np.int64)
+        self._values = np.zeros(2 * maxlen, dtype=np.float64)
+        # Index of the next slot to write, in [0, maxlen)
+        self._head = 0
+        self._len = 0
         self.callbacks = []
+        self.amend_callbacks = []
 
     def append(self, *next_item):
-        self.buffer.append(next_item)
+        ts, value = next_item
+        head = self._head
+        self._timestamps[head] = self._timestamps[head + self.maxlen] = ts
+        self._values[head] = self._values[head + self.maxlen] = value
+
+        self._head = head + 1 if head + 1 < self.maxlen else 0
+        if self._len < self.maxlen:
+            self._len += 1
 
         for cb in self.callbacks:
             cb(self)
 
+    def append_item(self, item: t.Tuple[int, float]):
+        """`append` for callers that hand over a (ts, value) tuple, like `Buffer.call_with_last_item`"""
+        self.append(*item)
+
+    @property
+    def _end(self) -> int:
+        # One past the newest sample in the mirrored half of the arrays
+        return self._head + self.maxlen
+
+    def tail(self, n: int) -> t.Tuple[np.ndarray, np.ndarray]:
+        """Zero-copy views of the timestamps and values of the last `n` samples"""
+        n = min(max(n, 0), self._len)
+        end = self._end
+        return self._timestamps[end - n : end], self._values[end - n : end]
+
+    def window(self, start_ts: int, end_ts: t.Optional[int] = None):
+        """Zero-copy views of the samples with `start_ts <= ts < end_ts`"""
+        timestamps, values = self.tail(self._len)
+        lo = np.searchsorted(timestamps, start_ts, side="left")
+        hi = (
+            len(timestamps)
+            if end_ts is None
+            else np.searchsorted(timestamps, end_ts, side="left")
+        )
+        return timestamps[lo:hi], values[lo:hi]
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self.tail(self._len)[0]
+
+    @property
+    def values(self) -> np.ndarray:
+        return self.tail(self._len)[1]
+
     @property
     def last_item(self):
-        return self.buffer[-1]
+        return self[-1]
 
     @staticmethod
     def call_with_last_item(callback: t.Callable, b: "Buffer"):
@@ -26,23 +84,102 @@ class Buffer:
 
     @staticmethod
     def call_with_underlying(callback: t.Callable, b: "Buffer"):
-        return callback(b.buffer)
+        return callback(b.values)
 
     def register_callback(self, cb: t.Callable):
         self.callbacks.append(cb)
 
+    def register_amend_callback(self, cb: t.Callable):
+        """Called with the buffer whenever the newest sample is overwritten with `amend_last`"""
+        self.amend_callbacks.append(cb)
+
+    def amend_last(self, *item):
+        self[-1] = item
+        for cb in self.amend_callbacks:
+            cb(self)
+
     def dump(self, file_like: t.TextIO):
-        for line in self.buffer:
+        for line in self:
             file_like.write(repr(line) + "\n")
 
     def is_empty(self):
-        return len(self.buffer) == 0
+        return self._len == 0
 
     def clear(self):
-        self.buffer.clear()
+        self._head = 0
+        self._len = 0
+
+    def _index(self, item: int) -> int:
+        if not isinstance(item, (int, np.integer)):
+            raise TypeError(f"Buffer indices must be integers, not {type(item)}")
+        if item < 0:
+            item += self._len
+        if not 0 <= item < self._len:
+            raise IndexError("Buffer index out of range")
+        return self._end - self._len + item
 
     def __getitem__(self, item):
-        return self.buffer[item]
+        i = self._index(item)
+        return int(self._timestamps[i]), float(self._values[i])
+
+    def __setitem__(self, item, value):
+        i = self._index(item)
+        ts, y = value
+        # Keep both halves of the mirror in sync
+        other = i - self.maxlen if i >= self.maxlen else i + self.maxlen
+        self._timestamps[i] = self._timestamps[other] = ts
+        self._values[i] = self._values[other] = y
+
+    def __len__(self):
+        return self._len
 
     def __iter__(self):
-        return iter(self.buffer)
+        timestamps, values = self.tail(self._len)
+        return zip(timestamps.tolist(), values.tolist())
+
+
+class TestBuffer(unittest.TestCase):
+    def setUp(self) -> None:
+        self.buffer = Buffer(maxlen=4)
+
+    def test_wraparound(self):
+        for i in range(10):
+            self.buffer.append(i * 50, float(i))
+        self.assertEqual(len(self.buffer), 4)
+        self.assertEqual(
+            list(self.buffer), [(300, 6.0), (350, 7.0), (400, 8.0), (450, 9.0)]
+        )
+        self.assertEqual(self.buffer[0], (300, 6.0))
+        self.assertEqual(self.buffer.last_item, (450, 9.0))
+
+    def test_tail_is_view(self):
+        for i in range(6):
+            self.buffer.append(i, float(i))
+        ts, values = self.buffer.tail(3)
+        self.assertEqual(values.tolist(), [3.0, 4.0, 5.0])
+        self.assertIsNotNone(values.base)
+
+    def test_window(self):
+        for i in range(4):
+            self.buffer.append(i * 10, float(i))
+        ts, values = self.buffer.window(10, 30)
+        self.assertEqual(ts.tolist(), [10, 20])
+
+    def test_setitem(self):
+        for i in range(5):
+            self.buffer.append(i, float(i))
+        self.buffer[-1] = (4, 0)
+        self.assertEqual(self.buffer.last_item, (4, 0.0))
+        self.assertEqual(self.buffer.tail(1)[1].tolist(), [0.0])
+
+    def test_callbacks(self):
+        seen = []
+        self.buffer.register_callback(
+            partial(Buffer.call_with_last_item, seen.append)
+        )
+        self.buffer.append(1, 2.0)
+        self.assertEqual(seen, [(1, 2.0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
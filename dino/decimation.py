@@ -0,0 +1,140 @@
+"""Decimating plotted series as they grow, so drawing costs the same however long the plotted window is.
+
+Time is cut into fixed buckets of `width` ms and each bucket is reduced to its lowest and highest sample, in the order
+they happened. That keeps every spike (unlike averaging, or picking one sample per bucket) and, unlike LTTB, doesn't
+depend on the buckets either side, so finished buckets never change and each sample costs O(1). With a bucket per
+pixel or two, the plotted line looks the same as the full series.
+"""
+
+import math
+import typing as t
+import unittest
+
+import numpy as np
+
+from dino.buffer import BUFFER_MINUTES, Buffer
+
+# Points drawn per series, roughly a wide plot's width in pixels
+DEFAULT_MAX_POINTS = 2000
+
+Item = t.Tuple[int, float]
+
+
+class MinMaxDecimator:
+    """The lowest and highest sample of every `width` ms, for the last `buckets` buckets"""
+
+    def __init__(self, width: int, buckets: int):
+        self.width = width
+        # Two points per finished bucket, plus room for the bucket in progress to be pushed out of the window
+        self.points = Buffer(maxlen=2 * buckets + 2)
+        self._bucket: t.Optional[int] = None
+        self._low: t.Optional[Item] = None
+        self._high: t.Optional[Item] = None
+
+    def append(self, ts: int, value: float):
+        bucket = ts // self.width
+        if bucket != self._bucket:
+            for point in self._open_points():
+                self.points.append(*point)
+            self._bucket = bucket
+            self._low = self._high = (ts, value)
+        elif value < self._low[1]:
+            self._low = (ts, value)
+        elif value > self._high[1]:
+            self._high = (ts, value)
+
+    def _open_points(self) -> t.List[Item]:
+        """The bucket in progress, which isn't in `points` yet"""
+        if self._bucket is None:
+            return []
+        if self._low is self._high:
+            return [self._low]
+        return sorted((self._low, self._high))
+
+    def window(self, start_ts: int) -> t.Tuple[np.ndarray, np.ndarray]:
+        xs, ys = self.points.window(start_ts)
+        current = [point for point in self._open_points() if point[0] >= start_ts]
+        if current:
+            open_xs, open_ys = zip(*current)
+            xs = np.concatenate((xs, open_xs))
+            ys = np.concatenate((ys, open_ys))
+        return xs, ys
+
+
+class DecimatedSeries:
+    """A series and its first `n_derivatives` differences, each decimated as samples arrive.
+
+    The differences are taken between consecutive raw samples (what `numpy.diff` of the whole series gives) before
+    decimating, since differences of the decimated points would mean nothing.
+    """
+
+    def __init__(
+        self,
+        n_derivatives=0,
+        window_ms=BUFFER_MINUTES * 60 * 1000,
+        max_points=DEFAULT_MAX_POINTS,
+    ):
+        buckets = max(max_points // 2, 1)
+        width = max(math.ceil(window_ms / buckets), 1)
+        self.decimators = [
+            MinMaxDecimator(width, buckets) for _ in range(n_derivatives + 1)
+        ]
+        # The last value of the series and of each difference
+        self._last: t.List[t.Optional[float]] = [None] * (n_derivatives + 1)
+
+    def append(self, ts: int, value: float):
+        last = self._last
+        for nth, decimator in enumerate(self.decimators):
+            decimator.append(ts, value)
+            previous, last[nth] = last[nth], value
+            if previous is None:
+                break
+            value = value - previous
+
+    def receive_item(self, item: Item):
+        self.append(*item)
+
+    def window(self, start_ts: int, nth=0) -> t.Tuple[np.ndarray, np.ndarray]:
+        """The decimated `nth` difference (0 for the series itself) from `start_ts` on"""
+        return self.decimators[nth].window(start_ts)
+
+
+class TestDecimation(unittest.TestCase):
+    def test_min_max_per_bucket(self):
+        rng = np.random.default_rng(0)
+        timestamps = np.cumsum(rng.integers(1, 80, 5000))
+        values = rng.normal(0, 1, len(timestamps))
+        values[1234] = 50.0
+        series = DecimatedSeries(window_ms=int(timestamps[-1]) + 1, max_points=200)
+        for ts, value in zip(timestamps.tolist(), values.tolist()):
+            series.append(ts, value)
+
+        xs, ys = series.window(0)
+        self.assertLessEqual(len(xs), 200)
+        self.assertIn(50.0, ys.tolist())
+        self.assertTrue(np.all(np.diff(xs) > 0))
+        width = series.decimators[0].width
+        buckets = timestamps // width
+        for bucket in np.unique(buckets)[::7]:
+            inside = buckets == bucket
+            shown = ys[xs // width == bucket]
+            self.assertEqual(shown.min(), values[inside].min())
+            self.assertEqual(shown.max(), values[inside].max())
+
+    def test_constant_size_and_derivatives(self):
+        timestamps = np.arange(0, 50 * 100_000, 50)
+        values = np.sin(timestamps / 3000)
+        # A bucket per sample: nothing is lost
+        series = DecimatedSeries(2, window_ms=50 * 1000, max_points=2000)
+        for ts, value in zip(timestamps.tolist(), values.tolist()):
+            series.append(ts, value)
+        for nth in range(3):
+            xs, ys = series.window(int(timestamps[-1000]), nth)
+            self.assertEqual(xs.tolist(), timestamps[-1000:].tolist())
+            self.assertEqual(ys.tolist(), np.diff(values, nth)[-1000:].tolist())
+        # However long it runs, only the window's worth of points is kept
+        self.assertEqual(len(series.decimators[0].points), 2002)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,216 @@
+"""Scoring the detectors against annotated traces.
+
+`detect` runs a trace through the whole live chain (`DinoPipeline`, so `PhysicsSolver` and the pattern matchers from
+`register_default_patterns`, then a `DinoStateMachine`) and lists the jumps and ducks the state machine went into.
+`detect_offline` finds the same events from the vectorized `replay`, much faster. `score` matches either against
+ground truth.
+
+Ground truth for `data/eric.txt` lives next to it in `data/eric.events`: one annotated event per line, as the
+timestamp (ms, on the trace's clock) at which the movement starts and its kind, `jump` or `duck`. Blank lines and
+anything after a `#` are ignored. For example:
+
+    # annotated from video of the session
+    12650 jump
+    20100 duck
+"""
+
+import tempfile
+import time
+import statistics
+import typing as t
+import unittest
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+
+from dino.pattern_matching.defaults import (
+    DEFAULT_PARAMS,
+    VELOCITY_EVENTS,
+    DetectorParams,
+)
+from dino.pipeline import DinoPipeline
+from dino.replay import replay
+from dino.socket_rpc import NullSender
+from dino.state_machine import DinoStateMachine
+from dino.state_machine.types import State
+
+ANNOTATION_SUFFIX = ".events"
+# What the state machine going into each state means
+KINDS = {State.JUMPING: "jump", State.DUCKING: "duck"}
+# The transitions that count as detecting one
+DETECTIONS = {
+    (State.STEADY, State.JUMPING): "jump",
+    (State.DUCKING, State.JUMPING): "jump",
+    (State.STEADY, State.DUCKING): "duck",
+}
+# How far (in samples) a detection may be from the annotation it's matched to
+DEFAULT_TOLERANCE = 10
+
+
+def annotation_path(trace: Path) -> Path:
+    return Path(trace).with_suffix(ANNOTATION_SUFFIX)
+
+
+def load_annotations(path: Path) -> t.List[t.Tuple[int, str]]:
+    annotations = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            ts, kind = line.split()
+            if kind not in KINDS.values():
+                raise ValueError(f"{path}:{number}: unknown event kind {kind!r}")
+            annotations.append((int(ts), kind))
+    return sorted(annotations)
+
+
+@dataclass
+class Detection:
+    # (timestamp, kind) of every jump and duck, in order
+    events: t.List[t.Tuple[int, str]]
+    # Process CPU time spent in the pipeline and state machine
+    cpu_seconds: float
+    wall_seconds: float
+
+
+def _record_detections(
+    machine: DinoStateMachine, clock: t.Callable[[], int]
+) -> t.List[t.Tuple[int, str]]:
+    """A list that fills up with (`clock()`, kind) whenever `machine` detects a jump or duck"""
+    events = []
+    for (from_state, to_state), kind in DETECTIONS.items():
+        machine.register_callback(
+            from_state, to_state, lambda kind=kind: events.append((clock(), kind))
+        )
+    return events
+
+
+def detect(
+    timestamps: np.ndarray,
+    force: np.ndarray,
+    batch_size=256,
+    params: DetectorParams = DEFAULT_PARAMS,
+) -> Detection:
+    """Feed a trace through the live pipeline and state machine as fast as possible"""
+    pipeline = DinoPipeline(NullSender, params=params)
+    machine = DinoStateMachine()
+    events = _record_detections(machine, lambda: pipeline.now)
+    pipeline.event_listeners.append(
+        lambda ts, name: machine.receive_event(VELOCITY_EVENTS[name], ts)
+    )
+
+    cpu, wall = time.process_time(), time.perf_counter()
+    for start in range(0, len(timestamps), batch_size):
+        end = start + batch_size
+        pipeline.process(timestamps[start:end], force[start:end])
+        machine.advance(int(timestamps[min(end, len(timestamps)) - 1]))
+    return Detection(events, time.process_time() - cpu, time.perf_counter() - wall)
+
+
+def detect_offline(
+    timestamps: np.ndarray, force: np.ndarray, params: DetectorParams = DEFAULT_PARAMS
+) -> t.List[t.Tuple[int, str]]:
+    """The events `detect` finds, from `replay` instead of the live pipeline"""
+    machine = DinoStateMachine()
+    now = 0
+    events = _record_detections(machine, lambda: now)
+    for now, name in replay(timestamps, force, params=params).events:
+        machine.receive_event(VELOCITY_EVENTS[name], now)
+    return events
+
+
+@dataclass
+class Score:
+    true_positives: int = 0
+    false_positives: int = 0
+    false_negatives: int = 0
+    # Detected minus annotated sample, for every match
+    latencies: t.List[int] = field(default_factory=list)
+
+    @property
+    def precision(self) -> t.Optional[float]:
+        detected = self.true_positives + self.false_positives
+        return self.true_positives / detected if detected else None
+
+    @property
+    def recall(self) -> t.Optional[float]:
+        annotated = self.true_positives + self.false_negatives
+        return self.true_positives / annotated if annotated else None
+
+    @property
+    def mean_latency(self) -> t.Optional[float]:
+        """Mean of `latencies`: how many samples late detections are on average (negative if early)"""
+        return statistics.mean(self.latencies) if self.latencies else None
+
+
+def score(
+    detected: t.Sequence[t.Tuple[int, str]],
+    annotated: t.Sequence[t.Tuple[int, str]],
+    timestamps: np.ndarray,
+    tolerance=DEFAULT_TOLERANCE,
+) -> Score:
+    """Match each annotation, in order, to the nearest detection of the same kind within `tolerance` samples"""
+    result = Score()
+    detected_at = np.searchsorted(timestamps, [ts for ts, _ in detected])
+    used = np.zeros(len(detected), dtype=bool)
+    for ts, kind in annotated:
+        at = int(np.searchsorted(timestamps, ts))
+        candidates = [
+            i
+            for i, (_, detected_kind) in enumerate(detected)
+            if not used[i]
+            and detected_kind == kind
+            and abs(detected_at[i] - at) <= tolerance
+        ]
+        if not candidates:
+            result.false_negatives += 1
+            continue
+        best = min(candidates, key=lambda i: abs(detected_at[i] - at))
+        used[best] = True
+        result.true_positives += 1
+        result.latencies.append(int(detected_at[best] - at))
+    result.false_positives = int((~used).sum())
+    return result
+
+
+class TestEvaluation(unittest.TestCase):
+    def test_score(self):
+        timestamps = np.arange(0, 10_000, 50)
+        annotated = [(1000, "jump"), (3000, "duck"), (6000, "jump")]
+        # A late jump, a duck mistaken for a jump, and a jump nobody annotated
+        detected = [(1150, "jump"), (3000, "jump"), (8000, "jump")]
+        result = score(detected, annotated, timestamps)
+        self.assertEqual(
+            (result.true_positives, result.false_positives, result.false_negatives),
+            (1, 2, 2),
+        )
+        self.assertEqual(result.latencies, [3])
+        self.assertEqual(result.mean_latency, 3)
+        self.assertAlmostEqual(result.precision, 1 / 3)
+        self.assertAlmostEqual(result.recall, 1 / 3)
+        self.assertIsNone(score([], [], timestamps).precision)
+
+    def test_annotations_and_detect(self):
+        from dino.replay import load_trace
+
+        timestamps, force = load_trace("eric.txt")
+        detection = detect(timestamps, force)
+        self.assertTrue(any(kind == "jump" for _, kind in detection.events))
+        self.assertEqual(detect_offline(timestamps, force), detection.events)
+
+        # Annotating exactly what was detected scores perfectly
+        with tempfile.TemporaryDirectory() as directory:
+            path = annotation_path(Path(directory) / "eric.txt")
+            path.write_text(
+                "# made up\n\n"
+                + "".join(f"{ts} {kind}\n" for ts, kind in detection.events)
+            )
+            annotated = load_annotations(path)
+        result = score(detection.events, annotated, timestamps)
+        self.assertEqual((result.precision, result.recall), (1.0, 1.0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,176 @@
+"""Force deviation -> velocity -> position, with drift correction.
+
+Both integrals use the trapezoidal rule. Drift is kept in check by zero-velocity updates (`zero_velocity`, called
+whenever the force settles) and, optionally, by leaking velocity back towards zero with time constant `leak_tau`.
+`integrate` does the same thing to a whole trace at once and gives bit-for-bit the same answers as `step`.
+"""
+
+import typing as t
+import unittest
+
+import numpy as np
+
+
+class Integrator:
+    def __init__(self, leak_tau: t.Optional[float] = None):
+        # Time constant, in seconds, with which velocity leaks back towards zero: each step scales it by
+        # 1 - dt / leak_tau. None disables the leak
+        self.leak_tau = leak_tau
+        self.reset()
+
+    def reset(self):
+        """Forget everything, eg after a re-tare, so the next sample starts from rest"""
+        self.ts: t.Optional[int] = None
+        self.acceleration = 0.0
+        self.velocity = 0.0
+        self.position = 0.0
+
+    def zero_velocity(self):
+        """Zero-velocity update: we know we're at rest, so whatever velocity has built up is drift"""
+        self.velocity = 0.0
+
+    def step(self, ts: int, acceleration: float) -> t.Tuple[float, float]:
+        """Integrate one more sample; returns the new velocity and position"""
+        if self.ts is not None:
+            dt = (ts - self.ts) / 1000
+            decay = 1.0 if self.leak_tau is None else max(0.0, 1 - dt / self.leak_tau)
+            velocity = (
+                decay * self.velocity + (self.acceleration + acceleration) / 2 * dt
+            )
+            self.position = self.position + (self.velocity + velocity) / 2 * dt
+            self.velocity = velocity
+        self.ts, self.acceleration = ts, acceleration
+        return self.velocity, self.position
+
+    def integrate(
+        self,
+        timestamps: np.ndarray,
+        acceleration: np.ndarray,
+        starts: np.ndarray = None,
+        zeroed: np.ndarray = None,
+    ) -> t.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """`step` over a whole trace, starting from rest.
+
+        `starts` are the indices at which `reset` was called just before stepping, and `zeroed` the indices after
+        which `zero_velocity` was called (unique, ascending). Returns the velocity as each sample was stepped, the
+        velocity after any zero-velocity updates, and the position.
+        """
+        n = len(timestamps)
+        if not n:
+            return np.zeros(0), np.zeros(0), np.zeros(0)
+        # Masks rather than set operations: these can be a sizable fraction of a long trace
+        is_start = np.zeros(n, dtype=bool)
+        is_start[0] = True
+        if starts is not None:
+            is_start[starts] = True
+        starts = np.flatnonzero(is_start)
+        zeroed = np.asarray(zeroed if zeroed is not None else [], dtype=np.int64)
+
+        dt = np.diff(timestamps, prepend=timestamps[:1]) / 1000
+        velocity_increments = np.empty(n)
+        velocity_increments[0] = 0.0
+        velocity_increments[1:] = (acceleration[:-1] + acceleration[1:]) / 2 * dt[1:]
+        velocity_increments[starts] = 0.0
+        decay = None
+        if self.leak_tau is not None:
+            decay = np.maximum(0.0, 1 - dt / self.leak_tau)
+
+        # Velocity restarts from zero after every reset and every zero-velocity update
+        is_start[zeroed[zeroed + 1 < n] + 1] = True
+        restarts = np.flatnonzero(is_start)
+        at_step = _segmented_recurrence(velocity_increments, restarts, decay)
+        velocity = at_step.copy()
+        velocity[zeroed] = 0.0
+
+        position_increments = np.empty(n)
+        position_increments[0] = 0.0
+        position_increments[1:] = (velocity[:-1] + at_step[1:]) / 2 * dt[1:]
+        position_increments[starts] = 0.0
+        position = _segmented_recurrence(position_increments, starts)
+        return at_step, velocity, position
+
+
+def _segmented_recurrence(
+    increments: np.ndarray, starts: np.ndarray, decay: np.ndarray = None
+) -> np.ndarray:
+    """`x[i] = decay[i] * x[i - 1] + increments[i]`, restarting from `x[start] = increments[start]`.
+
+    The recurrence is evaluated left to right one step at a time, so it comes out bit-for-bit identical to running it
+    in a Python loop. Without `decay` it's a plain running sum, and a few long segments are each one `np.cumsum`
+    (which also adds strictly left to right); otherwise the loop runs over positions within the segments, vectorized
+    across segments.
+    """
+    sums = increments.copy()
+    bounds = np.append(starts, len(increments))
+    lengths = np.diff(bounds)
+    longest = lengths.max(initial=0)
+    if decay is None and len(lengths) < longest:
+        for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            np.cumsum(increments[start:end], out=sums[start:end])
+        return sums
+    for offset in range(1, longest):
+        live = bounds[:-1][lengths > offset] + offset
+        if decay is None:
+            sums[live] = sums[live - 1] + increments[live]
+        else:
+            sums[live] = decay[live] * sums[live - 1] + increments[live]
+    return sums
+
+
+class TestIntegrator(unittest.TestCase):
+    def test_trapezoid_is_exact_for_linear_acceleration(self):
+        integrator = Integrator()
+        for ts in range(0, 2001, 50):
+            velocity, position = integrator.step(ts, ts / 1000)
+        # a = t, so v = t^2 / 2 and, with a trapezoid per step, p overshoots t^3 / 6 by a small known amount
+        self.assertAlmostEqual(velocity, 2.0)
+        self.assertAlmostEqual(position, 8 / 6, places=3)
+
+    def test_zero_velocity_and_reset(self):
+        integrator = Integrator()
+        integrator.step(0, 1.0)
+        integrator.step(1000, 1.0)
+        integrator.zero_velocity()
+        self.assertEqual(integrator.step(2000, 0.0), (0.5, 0.75))
+        integrator.reset()
+        # A long gap after a reset doesn't turn into one enormous step
+        self.assertEqual(integrator.step(60_000, 5.0), (0.0, 0.0))
+
+    def test_leak(self):
+        integrator = Integrator(leak_tau=1.0)
+        integrator.step(0, 1.0)
+        integrator.step(100, 1.0)
+        for ts in range(200, 5100, 100):
+            velocity, _ = integrator.step(ts, 0.0)
+        # Five time constants later, nearly all of it is gone
+        self.assertLess(abs(velocity), 1e-3)
+
+    def test_batch_matches_streaming(self):
+        rng = np.random.default_rng(0)
+        n = 2000
+        timestamps = np.cumsum(rng.integers(40, 60, n))
+        acceleration = rng.normal(0, 3, n)
+        starts = np.sort(rng.choice(np.arange(1, n), 5, replace=False))
+        zeroed = np.sort(rng.choice(n, 200, replace=False))
+        for leak_tau in (None, 2.0):
+            with self.subTest(leak_tau=leak_tau):
+                streaming = Integrator(leak_tau)
+                expected = []
+                for i, (ts, a) in enumerate(
+                    zip(timestamps.tolist(), acceleration.tolist())
+                ):
+                    if i in starts:
+                        streaming.reset()
+                    expected.append(streaming.step(ts, a))
+                    if i in zeroed:
+                        streaming.zero_velocity()
+                at_step, _, position = Integrator(leak_tau).integrate(
+                    timestamps, acceleration, starts, zeroed
+                )
+                self.assertEqual(
+                    list(zip(at_step.tolist(), position.tolist())), expected
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,195 @@
+"""Opt-in end-to-end latency measurement, from the moment bytes come off the serial port to the moment an event is sent.
+
+Every sample carries the `time.monotonic()` at which its bytes were read. Each checkpoint it passes (parsing, every
+pipeline stage, the socket send for an event) records how long it has been since then into a per-checkpoint
+histogram. With no `LatencyRecorder` attached, the only cost is an `is None` check per batch.
+"""
+
+import signal
+import sys
+import typing as t
+import unittest
+from time import monotonic
+
+import numpy as np
+
+# Percentiles shown in reports
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class LatencyHistogram:
+    """Log-linear histogram in the style of HdrHistogram.
+
+    Values (in nanoseconds) below `2 ** sub_bucket_bits` are counted exactly; above that, each power of two is split
+    into `2 ** (sub_bucket_bits - 1)` equal buckets, so every value is kept to within 1/64th of itself by default.
+    Counts live in one fixed array: recording never allocates and the whole thing is a few kB.
+    """
+
+    def __init__(self, highest_ns=60 * 10**9, sub_bucket_bits=7):
+        self.sub_bucket_bits = sub_bucket_bits
+        self._half = 1 << (sub_bucket_bits - 1)
+        self.highest = highest_ns
+        self.counts = np.zeros(self._index(highest_ns) + 1, dtype=np.int64)
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    def _index(self, value: int) -> int:
+        shift = max(0, value.bit_length() - self.sub_bucket_bits)
+        return shift * self._half + (value >> shift)
+
+    def _indices(self, values: np.ndarray) -> np.ndarray:
+        # frexp's exponent is the bit length, exactly, for integers this small
+        bit_length = np.frexp(values.astype(np.float64))[1]
+        shift = np.maximum(0, bit_length - self.sub_bucket_bits)
+        return shift * self._half + (values >> shift)
+
+    def value_at(self, index: int) -> int:
+        """The middle of the range of values counted in bucket `index`"""
+        shift = max(0, (index >> (self.sub_bucket_bits - 1)) - 1)
+        return ((index - shift * self._half) << shift) + (1 << shift) // 2
+
+    def record(self, value_ns: int, count=1):
+        value_ns = min(max(int(value_ns), 0), self.highest)
+        self.counts[self._index(value_ns)] += count
+        self.total += count
+        self.min = value_ns if self.min is None else min(self.min, value_ns)
+        self.max = max(self.max, value_ns)
+
+    def record_many(self, values_ns: np.ndarray):
+        if not len(values_ns):
+            return
+        values = np.clip(np.asarray(values_ns, dtype=np.int64), 0, self.highest)
+        np.add.at(self.counts, self._indices(values), 1)
+        self.total += len(values)
+        low, high = int(values.min()), int(values.max())
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = max(self.max, high)
+
+    def merge(self, other: "LatencyHistogram"):
+        if len(other.counts) != len(self.counts):
+            raise ValueError("Can only merge histograms with the same layout")
+        self.counts += other.counts
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q: float) -> int:
+        if not self.total:
+            return 0
+        rank = max(1, int(np.ceil(q / 100 * self.total)))
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        # Never claim more than was actually seen
+        return min(self.value_at(index), self.max)
+
+    @property
+    def mean(self) -> float:
+        if not self.total:
+            return 0.0
+        values = np.array([self.value_at(i) for i in np.flatnonzero(self.counts)])
+        return float(values @ self.counts[self.counts > 0]) / self.total
+
+    def reset(self):
+        self.counts[:] = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+
+class LatencyRecorder:
+    """One `LatencyHistogram` per checkpoint, in the order checkpoints were first reached"""
+
+    def __init__(self, **histogram_args):
+        self.histogram_args = histogram_args
+        self.histograms: t.Dict[str, LatencyHistogram] = {}
+
+    def histogram(self, checkpoint: str) -> LatencyHistogram:
+        histogram = self.histograms.get(checkpoint)
+        if histogram is None:
+            histogram = self.histograms.setdefault(
+                checkpoint, LatencyHistogram(**self.histogram_args)
+            )
+        return histogram
+
+    def record(self, checkpoint: str, read_time: float, count=1, now=None):
+        """`count` samples read off the wire at `read_time` (`time.monotonic()`) have just reached `checkpoint`"""
+        now = monotonic() if now is None else now
+        self.histogram(checkpoint).record((now - read_time) * 1e9, count)
+
+    def record_batch(self, checkpoint: str, read_times: np.ndarray, now=None):
+        now = monotonic() if now is None else now
+        self.histogram(checkpoint).record_many(
+            ((now - np.asarray(read_times)) * 1e9).astype(np.int64)
+        )
+
+    def report(self) -> str:
+        width = max(map(len, self.histograms), default=0)
+        percentiles = "".join(f"{f'p{q:g}':>9}" for q in PERCENTILES)
+        lines = [f"{'checkpoint':<{width}} {'count':>8}{percentiles}{'max':>9}  (ms)"]
+        for name, histogram in self.histograms.items():
+            values = [histogram.percentile(q) for q in PERCENTILES] + [histogram.max]
+            lines.append(
+                f"{name:<{width}} {histogram.total:>8}"
+                + "".join(f"{value / 1e6:>9.3f}" for value in values)
+            )
+        return "\n".join(lines)
+
+    def install_signal_handler(self, signum=None, file=sys.stderr):
+        """Print the report whenever the process gets `signum` (SIGUSR1 by default, where there is one)"""
+        report_on_signal(self.report, signum, file)
+
+    def reset(self):
+        for histogram in self.histograms.values():
+            histogram.reset()
+
+
+def report_on_signal(report: t.Callable[[], str], signum=None, file=sys.stderr):
+    """Print `report()` whenever the process gets `signum` (SIGUSR1 by default, where there is one)"""
+    if signum is None:
+        signum = getattr(signal, "SIGUSR1", None)
+        if signum is None:
+            return
+    signal.signal(signum, lambda *_: print(report(), file=file, flush=True))
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    def test_percentiles_within_precision(self):
+        rng = np.random.default_rng(0)
+        values = rng.lognormal(14, 1.5, 100_000).astype(np.int64)
+        histogram = LatencyHistogram()
+        histogram.record_many(values)
+        self.assertEqual(histogram.total, len(values))
+        self.assertEqual(histogram.max, values.max())
+        for q in (1, 50, 90, 99, 99.9):
+            expected = np.percentile(values, q, method="inverted_cdf")
+            self.assertAlmostEqual(histogram.percentile(q) / expected, 1, delta=1 / 64)
+
+    def test_record_many_matches_record(self):
+        values = np.array([0, 1, 63, 64, 127, 128, 129, 1000, 10**6, 10**12])
+        one, many = LatencyHistogram(), LatencyHistogram()
+        for value in values:
+            one.record(value)
+        many.record_many(values)
+        self.assertEqual(one.counts.tolist(), many.counts.tolist())
+        self.assertEqual((one.min, one.max), (many.min, many.max))
+        # Small values are exact
+        self.assertEqual(one.percentile(10), 0)
+        self.assertEqual(one.percentile(30), 63)
+
+    def test_pipeline_checkpoints(self):
+        from dino.pipeline import Pipeline
+
+        pipeline = Pipeline()
+        pipeline.latency = LatencyRecorder()
+        pipeline.add_stage("a", lambda batch: None)
+        pipeline.add_stage("b", lambda batch: None)
+        pipeline.process(np.arange(3), np.zeros(3), np.full(3, monotonic() - 0.01))
+        self.assertEqual(list(pipeline.latency.histograms), ["a", "b"])
+        self.assertEqual(pipeline.latency.histogram("b").total, 3)
+        self.assertGreaterEqual(pipeline.latency.histogram("a").min, 10**7)
+        self.assertIn("p99.9", pipeline.latency.report())
+
+
+if __name__ == "__main__":
+    unittest.main()
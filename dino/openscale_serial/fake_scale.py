@@ -0,0 +1,55 @@
+"""Stand-ins for an OpenScale, so serial ingest can be exercised without the hardware"""
+
+import os
+import time
+import typing as t
+
+SPLASH = b"SparkFun OpenScale\r\nSerial Load Cell Converter\r\nPress x to bring up settings\r\nReadings:\r\n"
+
+
+def format_readings(
+    timestamps: t.Iterable[int], values: t.Iterable[float], units="lbs"
+) -> t.List[bytes]:
+    """Lines the way the OpenScale firmware prints them: `ts,weight,units,`"""
+    return [
+        f"{ts},{value:.2f},{units},\r\n".encode()
+        for ts, value in zip(timestamps, values)
+    ]
+
+
+class FakeOpenScale:
+    """An OpenScale on the far end of a pseudo-terminal. Open `port` the way you'd open the real COM port"""
+
+    def __init__(self):
+        import pty
+        import tty
+
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+    def write(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            written = os.write(self.master, view)
+            view = view[written:]
+
+    def play(
+        self,
+        timestamps: t.Sequence[int],
+        values: t.Sequence[float],
+        realtime=False,
+        splash=SPLASH,
+    ):
+        """Print the splash screen and then every reading, optionally paced by the timestamps"""
+        self.write(splash)
+        last_ts = timestamps[0] if len(timestamps) else 0
+        for ts, line in zip(timestamps, format_readings(timestamps, values)):
+            if realtime:
+                time.sleep((ts - last_ts) / 1000)
+                last_ts = ts
+            self.write(line)
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
@@ -0,0 +1,99 @@
+import typing as t
+import unittest
+from time import monotonic
+
+import numpy as np
+
+# Samples still sitting in the queue this long after they were read off the wire are counted as late
+LATE_AFTER = 0.1
+
+
+class SampleQueue:
+    """Bounded single-producer/single-consumer ring of (ts, value, read time) samples.
+
+    No locks: the producer only ever advances `_tail` and the consumer only ever advances `_head`, and each slot is
+    written before `_tail` moves past it. When the ring is full, new samples are dropped and counted rather than
+    blocking the reader.
+    """
+
+    def __init__(self, capacity=4096, late_after=LATE_AFTER):
+        self.capacity = capacity
+        self.late_after = late_after
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros(capacity, dtype=np.float64)
+        self.read_times = np.zeros(capacity, dtype=np.float64)
+        # Total samples ever consumed / produced. Slots are these modulo capacity
+        self._head = 0
+        self._tail = 0
+        self.dropped = 0
+        self.late = 0
+
+    def put(self, ts: int, value: float, read_time: float) -> bool:
+        tail = self._tail
+        if tail - self._head >= self.capacity:
+            self.dropped += 1
+            return False
+        i = tail % self.capacity
+        self.timestamps[i] = ts
+        self.values[i] = value
+        self.read_times[i] = read_time
+        self._tail = tail + 1
+        return True
+
+    def put_batch(
+        self, timestamps: np.ndarray, values: np.ndarray, read_time: float
+    ) -> int:
+        """`put` for a whole batch. Whatever doesn't fit is dropped; returns how many samples were queued"""
+        tail = self._tail
+        n = min(len(timestamps), self.capacity - (tail - self._head))
+        self.dropped += len(timestamps) - n
+        slots = (tail + np.arange(n)) % self.capacity
+        self.timestamps[slots] = timestamps[:n]
+        self.values[slots] = values[:n]
+        self.read_times[slots] = read_time
+        self._tail = tail + n
+        return n
+
+    def drain(
+        self, max_items: int = None
+    ) -> t.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Copy out and consume up to `max_items` of the oldest samples"""
+        head = self._head
+        n = self._tail - head
+        if max_items is not None:
+            n = min(n, max_items)
+        slots = (head + np.arange(n)) % self.capacity
+        batch = self.timestamps[slots], self.values[slots], self.read_times[slots]
+        self._head = head + n
+
+        self.late += int(np.count_nonzero(monotonic() - batch[2] > self.late_after))
+        return batch
+
+    def __len__(self):
+        return self._tail - self._head
+
+
+class TestSampleQueue(unittest.TestCase):
+    def test_put_batch(self):
+        queue = SampleQueue(capacity=4, late_after=float("inf"))
+        queue.put(0, 0.0, 0.0)
+        queue.drain()
+        self.assertEqual(queue.put_batch(np.arange(1, 6), np.ones(5), 0.0), 4)
+        self.assertEqual(queue.dropped, 1)
+        self.assertEqual(queue.drain()[0].tolist(), [1, 2, 3, 4])
+
+    def test_wraparound_and_drops(self):
+        queue = SampleQueue(capacity=4, late_after=float("inf"))
+        for i in range(3):
+            self.assertTrue(queue.put(i, float(i), 0.0))
+        self.assertEqual(queue.drain(2)[0].tolist(), [0, 1])
+        for i in range(3, 7):
+            queue.put(i, float(i), 0.0)
+        self.assertEqual(queue.dropped, 1)
+        timestamps, values, _ = queue.drain()
+        self.assertEqual(timestamps.tolist(), [2, 3, 4, 5])
+        self.assertEqual(len(queue), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
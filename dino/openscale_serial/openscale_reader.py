@@ -1,6 +1,9 @@
+import re
 import typing as t
+import unittest
 
-from serial import Serial
+import numpy as np
+from serial import serial_for_url
 
 DEFAULT_PORT = "COM4"
 DEFAULT_BAUD = 115_200
@@ -13,9 +16,12 @@ def read_from_serial(
     """Read data from the openscale serial port"""
 
     def do_read():
-        with Serial(port, baud, timeout=1) as ser:
+        with serial_for_url(port, baud, timeout=1) as ser:
+            pending = b""
             while True:
-                yield ser.readline()
+                # Take everything that's waiting at once and split it into lines ourselves
+                *lines, pending = (pending + ser.read(ser.in_waiting or 1)).split(b"\n")
+                yield from lines
 
     for i, line in enumerate(do_read()):
         res = callback(line)
@@ -23,19 +29,159 @@ def read_from_serial(
             break
 
 
+_READINGS_HEADER = re.compile(rb"^[ \t]*Readings:[^\n]*\n?", re.M)
+# ts,weight,units, -- with a trailing empty field
+_READING = re.compile(
+    rb"^[ \t]*([-+]?\d+)[ \t]*,[ \t]*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)[ \t]*,"
+    rb"[ \t]*([A-Za-z]*)[ \t]*,[ \t]*$",
+    re.M,
+)
+_NON_BLANK = re.compile(rb"^[ \t]*\S", re.M)
+# What's left of a run of clean lines once their units are gone: `ts,weight` on each, with no blanks
+_CLEAN_LINES = re.compile(rb"(?:[-+]?\d+,[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?\n)*")
+
+
+def _parse_clean(chunk: bytes, units: bytes):
+    """Parse a chunk in which every line is exactly `ts,weight,units,`, or return None if any line isn't.
+
+    Each line is checked on its own, so a chunk is only accepted if `_READING` would accept every line of it too.
+    """
+    suffix = b"," + units + b",\n"
+    if chunk.count(suffix) != chunk.count(b"\n"):
+        return None
+    # Every line ended with the suffix, so what's left of each should be `ts,weight`
+    body = chunk.replace(suffix, b"\n")
+    if not body or _CLEAN_LINES.fullmatch(body) is None:
+        return None
+    numbers = np.array(body.replace(b",", b"\n").split(), dtype=np.float64)
+    timestamps, weights = numbers[0::2], numbers[1::2]
+    # Weights too big for a double come out infinite
+    if not np.isfinite(weights).all():
+        return None
+    return timestamps.astype(np.int64), weights.copy()
+
+
+# Below this many lines, a chunk with a bad line in it is parsed line by line instead of being split further
+_MIN_SPLIT_LINES = 64
+
+
+def parse_readings(
+    chunk: bytes, units: bytes = None
+) -> t.Tuple[np.ndarray, np.ndarray, int, t.Optional[bytes]]:
+    """Parse every `ts,weight,units,` line in a chunk of complete lines.
+
+    Returns the timestamps, weights, how many non-blank lines were malformed and were skipped, and the units of the
+    last good line. Once `units` is known, clean stretches of the chunk are parsed without any Python-level loop; a
+    chunk containing bad lines is halved until the bad lines are isolated in small pieces.
+    """
+    return _parse(chunk.replace(b"\r", b""), units)
+
+
+def _split_point(chunk: bytes) -> int:
+    """Start of the line nearest the middle of `chunk`, or 0 if no line starts inside it"""
+    half = len(chunk) // 2
+    before = chunk.rfind(b"\n", 0, half) + 1
+    after = chunk.find(b"\n", half) + 1
+    if not 0 < after < len(chunk):
+        return before
+    if not before or after - half < half - before:
+        return after
+    return before
+
+
+def _parse(chunk: bytes, units: t.Optional[bytes]):
+    if units is not None and (parsed := _parse_clean(chunk, units)) is not None:
+        return (*parsed, 0, units)
+
+    middle = _split_point(chunk) if units is not None else 0
+    if chunk.count(b"\n") > _MIN_SPLIT_LINES and 0 < middle < len(chunk):
+        first_ts, first_w, first_bad, units = _parse(chunk[:middle], units)
+        second_ts, second_w, second_bad, units = _parse(chunk[middle:], units)
+        return (
+            np.concatenate((first_ts, second_ts)),
+            np.concatenate((first_w, second_w)),
+            first_bad + second_bad,
+            units,
+        )
+
+    matches = _READING.findall(chunk)
+    lines = len(_NON_BLANK.findall(chunk))
+    if not matches:
+        return np.empty(0, dtype=np.int64), np.empty(0), lines, units
+    timestamps = np.array([m[0] for m in matches], dtype=np.int64)
+    weights = np.array([m[1] for m in matches], dtype=np.float64)
+    # Weights too big for a double come out infinite
+    finite = np.isfinite(weights)
+    if not finite.all():
+        timestamps, weights = timestamps[finite], weights[finite]
+    return timestamps, weights, lines - len(timestamps), matches[-1][2]
+
+
 class OpenScaleReader:
     """Helper class to drop everything before `Readings:` and parse everything after"""
 
     def __init__(
         self,
         primary_callback: t.Callable = None,
+        batch_callback: t.Callable = None,
     ):
         self.is_reading: bool = False
         self.should_read: bool = True
         self.callback: t.Callable = primary_callback
+        # Called with arrays of timestamps and weights by `handle_chunk`, if set
+        self.batch_callback: t.Callable = batch_callback
+        self.units: t.Optional[bytes] = None
+        self.readings = 0
+        self.malformed = 0
+        # The incomplete last line from `feed`, until the rest of it arrives
+        self._pending = b""
+
+    def feed(self, data: bytes) -> int:
+        """`handle_chunk` for raw bytes off the port. Keeps any partial last line for next time.
+
+        Returns how many complete lines were handled.
+        """
+        data = self._pending + data
+        end = data.rfind(b"\n") + 1
+        self._pending = data[end:]
+        if not end:
+            return 0
+        self.handle_chunk(data[:end])
+        return data.count(b"\n", 0, end)
+
+    def handle_chunk(self, chunk: bytes) -> bool:
+        """`handle_line` for a whole block of complete lines at once"""
+        if not self.is_reading:
+            header = _READINGS_HEADER.search(chunk)
+            if header is None:
+                return self.should_read
+            self.is_reading = True
+            chunk = chunk[header.end() :]
+
+        timestamps, weights, malformed, self.units = parse_readings(chunk, self.units)
+        self.readings += len(timestamps)
+        self.malformed += malformed
+        if not len(timestamps):
+            return self.should_read
+
+        if self.batch_callback is not None:
+            res = self.batch_callback(timestamps, weights)
+        else:
+            res = None
+            for relevant in zip(timestamps.tolist(), weights.tolist()):
+                if (res := self.callback(*relevant)) is not None and not res:
+                    break
+        if res is not None:
+            self.should_read = res
+
+        return self.should_read
 
     def handle_line(self, line: bytes) -> bool:
-        line = line.decode("utf-8").strip()
+        try:
+            line = line.decode("utf-8").strip()
+        except UnicodeDecodeError:
+            self.malformed += 1
+            return self.should_read
 
         # Sometimes we get empty lines
         if not line:
@@ -48,11 +194,14 @@ class OpenScaleReader:
             return self.should_read
 
         if self.is_reading:
-            # This probably needs better error handling in case we get malformed output. It's a microcontroller,
-            # after all.
-            ts, weight, _unit, _ = tuple(line.split(","))
-
-            relevant = (int(ts), float(weight))
+            # It's a microcontroller, after all: skip (and count) anything that doesn't parse rather than dying
+            try:
+                ts, weight, _unit, _ = tuple(line.split(","))
+                relevant = (int(ts), float(weight))
+            except ValueError:
+                self.malformed += 1
+                return self.should_read
+            self.readings += 1
 
             if (res := self.callback(*relevant)) is not None:
                 self.should_read = res
@@ -61,3 +210,66 @@ class OpenScaleReader:
 
     def stop(self):
         self.should_read = False
+
+
+class TestParseReadings(unittest.TestCase):
+    def test_clean_chunk(self):
+        timestamps, weights, malformed, units = parse_readings(
+            b"30,-4.12,lbs,\r\n80,-4.10,lbs,\r\n", b"lbs"
+        )
+        self.assertEqual(timestamps.tolist(), [30, 80])
+        self.assertEqual(weights.tolist(), [-4.12, -4.1])
+        self.assertEqual((malformed, units), (0, b"lbs"))
+
+    def test_malformed_lines_are_skipped(self):
+        chunk = b"30,-4.12,lbs,\r\n\r\n8\xff0,-4.1,lbs,\r\n130,-4\r\n180,-4.2,kg,\r\n"
+        timestamps, weights, malformed, units = parse_readings(chunk, b"lbs")
+        self.assertEqual(timestamps.tolist(), [30, 180])
+        self.assertEqual((malformed, units), (2, b"kg"))
+
+    def test_fast_path_matches_regex(self):
+        chunks = [
+            # Two bad lines whose fields add up to two good ones
+            b"30,1,2,lbs,\n40,lbs,\n",
+            b"3 0,1,lbs,\n40,,lbs,\n",
+            b"30,nan,lbs,\n80,inf,lbs,\n130,1e999,lbs,\n",
+            b"30.0,1,lbs,\n80,1_0,lbs,\n130,0x1,lbs,\n180,-.5e-2,lbs,\n",
+            b"30,1.5,lbs,\n80,+2.,lbs,\n",
+        ]
+        for chunk in chunks:
+            with self.subTest(chunk=chunk):
+                fast = parse_readings(chunk, b"lbs")
+                regex = parse_readings(chunk)
+                self.assertEqual(fast[0].tolist(), regex[0].tolist())
+                self.assertEqual(fast[1].tolist(), regex[1].tolist())
+                self.assertEqual(fast[2], regex[2])
+        self.assertIsNone(_parse_clean(chunks[0], b"lbs"))
+        self.assertIsNotNone(_parse_clean(chunks[-1], b"lbs"))
+        self.assertEqual(parse_readings(chunks[0], b"lbs")[2], 2)
+        self.assertEqual(parse_readings(chunks[-1], b"lbs")[1].tolist(), [1.5, 2.0])
+
+    def test_chunk_matches_lines(self):
+        chunk = b"splash\r\nReadings:\r\n30,-4.12,lbs,\r\nbad\r\n80,1.5,lbs,\r\n"
+        by_line, by_chunk = [], []
+        line_reader = OpenScaleReader(lambda *item: by_line.append(item))
+        for line in chunk.split(b"\n"):
+            line_reader.handle_line(line)
+        chunk_reader = OpenScaleReader(lambda *item: by_chunk.append(item))
+        chunk_reader.handle_chunk(chunk)
+        self.assertEqual(by_chunk, by_line)
+        self.assertEqual(chunk_reader.malformed, line_reader.malformed)
+
+    def test_long_garbage_line(self):
+        garbage, good = b"x" * 10000 + b"\n", b"30,1,lbs,\n" * 65
+        for chunk in (garbage + good, good + garbage):
+            with self.subTest(garbage_first=chunk.startswith(b"x")):
+                timestamps, _, malformed, units = parse_readings(chunk, b"lbs")
+                self.assertEqual(timestamps.tolist(), [30] * 65)
+                self.assertEqual((malformed, units), (1, b"lbs"))
+                reader = OpenScaleReader(batch_callback=lambda ts, w: None)
+                reader.handle_chunk(b"Readings:\n" + chunk)
+                self.assertEqual((reader.readings, reader.malformed), (65, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
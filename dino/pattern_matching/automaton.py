@@ -0,0 +1,54 @@
+import typing as t
+
+
+class PatternAutomaton:
+    """All of a matcher's patterns compiled into one bit-parallel (shift-and) automaton.
+
+    Every distinct comparator is evaluated once per sample, however many patterns (or positions within a pattern) use
+    it. Its outcome is then folded into each pattern's state with a couple of integer operations: bit `j` of a
+    pattern's state is set when the last `j + 1` pairs of samples satisfied its first `j + 1` comparators, so the
+    pattern matches whenever the bit for its final comparator is set.
+    """
+
+    def __init__(self, patterns: t.Mapping[str, t.Tuple[t.Tuple, t.Callable]]):
+        self.names: t.List[str] = list(patterns)
+        self.callbacks: t.List[t.Callable] = [cb for _, cb in patterns.values()]
+        self.match_bits: t.List[int] = [
+            1 << (len(pattern) - 1) for pattern, _ in patterns.values()
+        ]
+        self.prefixes: t.List[int] = [0] * len(self.names)
+
+        # Distinct comparators, and for each one the (pattern index, position mask) pairs it feeds
+        self.comparators: t.List[t.Callable] = []
+        self.users: t.List[t.List[t.Tuple[int, int]]] = []
+        index: t.Dict[t.Callable, int] = {}
+        for p, (pattern, _) in enumerate(patterns.values()):
+            masks: t.Dict[int, int] = {}
+            for position, comparator in enumerate(pattern):
+                if comparator not in index:
+                    index[comparator] = len(self.comparators)
+                    self.comparators.append(comparator)
+                    self.users.append([])
+                c = index[comparator]
+                masks[c] = masks.get(c, 0) | (1 << position)
+            for c, mask in masks.items():
+                self.users[c].append((p, mask))
+
+    def step(self, new, old) -> t.List[int]:
+        """Advance every pattern by one pair of samples and return the indices of the patterns that now match"""
+        allowed = [0] * len(self.prefixes)
+        for comparator, users in zip(self.comparators, self.users):
+            if comparator(new, old):
+                for p, mask in users:
+                    allowed[p] |= mask
+
+        matched = []
+        prefixes = self.prefixes
+        for p, match_bit in enumerate(self.match_bits):
+            prefixes[p] = ((prefixes[p] << 1) | 1) & allowed[p]
+            if prefixes[p] & match_bit:
+                matched.append(p)
+        return matched
+
+    def reset(self):
+        self.prefixes = [0] * len(self.names)
@@ -0,0 +1,81 @@
+import operator
+import typing as t
+from dataclasses import dataclass
+
+from dino.openscale_serial.openscale_reader import SAMPLES_PER_SEC
+from dino.physics import TARE_THRESHOLD
+from dino.state_machine.types import Event
+from .patterns import JUMP_INCREASE_THRESHOLD, mag_rel, rises_by, tare
+
+SHORT_SAMPLES = 3
+POS_LARGE_THRESH = 20
+POS_SMALL_THRESH = 7
+NEG_THRESH = -3
+STABLE_THRESH = 1
+
+# What gets sent to the game when each velocity pattern matches
+VELOCITY_MESSAGES = {
+    "steady_velocity": b"s",
+    "positive_large": b"j",
+}
+# And what each one means to the state machine
+VELOCITY_EVENTS = {
+    "steady_velocity": Event.VELOCITY_STEADY,
+    "positive_large": Event.VELOCITY_POSITIVE_LARGE,
+}
+
+
+@dataclass(frozen=True)
+class DetectorParams:
+    """The thresholds the default patterns and `PhysicsSolver` detect with"""
+
+    # Velocity below this (in magnitude) for `steady_samples` samples in a row is steady
+    stable_thresh: float = STABLE_THRESH
+    steady_samples: int = SAMPLES_PER_SEC // 5
+    # Velocity rising by more than this twice in a row is a jump
+    jump_increase_threshold: float = JUMP_INCREASE_THRESHOLD
+    # A steady average lighter than this is an empty scale
+    tare_threshold: float = TARE_THRESHOLD
+
+
+DEFAULT_PARAMS = DetectorParams()
+
+
+def steady_force_pattern() -> t.Tuple:
+    # 20 samples either close to each other or very small
+    return (tare,) * SAMPLES_PER_SEC
+
+
+def velocity_patterns(params: DetectorParams = DEFAULT_PARAMS) -> t.Dict[str, t.Tuple]:
+    jump = rises_by(params.jump_increase_threshold)
+    return {
+        "steady_velocity": (mag_rel(operator.lt, params.stable_thresh),)
+        * params.steady_samples,
+        "positive_large": (jump, jump),
+    }
+
+
+def register_default_patterns(
+    force_matcher,
+    physics,
+    velocity_matcher,
+    draw_vline,
+    socket_rpc,
+    params: DetectorParams = DEFAULT_PARAMS,
+):
+    def on_jump():
+        draw_vline("green")
+        socket_rpc.send(VELOCITY_MESSAGES["positive_large"])
+
+    def on_steady():
+        # draw_vline("orange")
+        socket_rpc.send(VELOCITY_MESSAGES["steady_velocity"])
+
+    force_matcher.register_pattern(
+        "steady_1s",
+        steady_force_pattern(),
+        physics.calibrate_steady_state,
+    )
+    callbacks = {"steady_velocity": on_steady, "positive_large": on_jump}
+    for name, pattern in velocity_patterns(params).items():
+        velocity_matcher.register_pattern(name, pattern, callbacks[name])
@@ -1,27 +1,74 @@
 import typing as t
 import unittest
 from dataclasses import dataclass, field
+from functools import partial
 from operator import gt, lt
 
-from dino.util import extract_tail
-
-
-def get_second(ls: list):
-    return [i[1] for i in ls]
+from .automaton import PatternAutomaton
 
 
 @dataclass
 class PatternMatcher:
     patterns: t.Dict[str, t.Tuple[t.Tuple, t.Callable]] = field(default_factory=dict)
+    _automaton: t.Optional[PatternAutomaton] = field(default=None, repr=False)
+    _last_value: t.Optional[float] = field(default=None, repr=False)
+    # Automaton state from before the most recent sample, so that sample can be amended
+    _undo: t.Optional[t.Tuple] = field(default=None, repr=False)
 
     def register_pattern(self, name: str, pattern: t.Tuple, callback: t.Callable):
         self.patterns[name] = (pattern, callback)
-
-    def match(self, data: t.Union[t.Deque, t.List]):
+        # Recompiled lazily the next time a sample comes in
+        self._automaton = None
+
+    def compile(self) -> PatternAutomaton:
+        """Build the shared automaton for the registered patterns, carrying over the state of existing ones"""
+        previous = self._automaton
+        self._automaton = PatternAutomaton(self.patterns)
+        if previous is not None:
+            carried = dict(zip(previous.names, previous.prefixes))
+            self._automaton.prefixes = [
+                carried.get(name, 0) for name in self._automaton.names
+            ]
+        return self._automaton
+
+    def receive_item(self, last_item: t.Tuple[int, float]):
+        """Incrementally match one new sample, equivalent to calling `match` on the buffer after every append"""
+        for name in self.step(last_item[1]):
+            self.patterns[name][1]()
+
+    def step(self, value: float) -> t.List[str]:
+        """`receive_item` without the callbacks: returns the names of the patterns that match, for the caller to fire"""
+        automaton = self._automaton or self.compile()
+        self._undo = (self._last_value, list(automaton.prefixes))
+        return [automaton.names[p] for p in self._advance(automaton, value)]
+
+    def amend_last_item(self, last_item: t.Tuple[int, float]):
+        """Re-evaluate after the most recently received sample was overwritten in place (eg `zero_velocity`).
+
+        Callbacks aren't re-run, just like `match` only ever looked at the buffer when something was appended.
+        """
+        if self._undo is None or self._automaton is None:
+            return
+        self._last_value, prefixes = self._undo
+        self._automaton.prefixes = list(prefixes)
+        self._advance(self._automaton, last_item[1])
+
+    def _advance(self, automaton: PatternAutomaton, value) -> t.List[int]:
+        old, self._last_value = self._last_value, value
+        if old is None:
+            return []
+        return automaton.step(value, old)
+
+    def reset(self):
+        self._last_value = None
+        self._undo = None
+        if self._automaton is not None:
+            self._automaton.reset()
+
+    def match(self, data: t.Sequence[float]):
+        """Check the values at the end of `data` (eg `Buffer.values`) against every registered pattern"""
         for pattern, callback in self.patterns.values():
-            if self._match_pattern(
-                get_second(extract_tail(data, len(pattern) + 1)), pattern
-            ):
+            if self._match_pattern(data[-(len(pattern) + 1) :], pattern):
                 callback()
 
     @staticmethod
@@ -68,6 +115,48 @@ class TestPatternMatcher(unittest.TestCase):
         self.matcher.match([20, 30, 40])
         self.assertFalse(self.matched)
 
+    def test_streaming_agrees_with_match(self):
+        data = [0, 10, 20, 30, 40, 30, 20, 30, 40, 50, 40, 40, 45, 50, 20]
+        self.matcher.register_pattern("steady", (lt,) * 3, lambda: None)
+
+        expected, streamed = [], []
+        reference = PatternMatcher()
+        for name, (pattern, _) in self.matcher.patterns.items():
+            reference.register_pattern(name, pattern, partial(expected.append, name))
+        for name, (pattern, _) in list(self.matcher.patterns.items()):
+            self.matcher.register_pattern(name, pattern, partial(streamed.append, name))
+
+        for i, value in enumerate(data):
+            expected.append(i)
+            streamed.append(i)
+            reference.match(data[: i + 1])
+            self.matcher.receive_item((i, value))
+
+        self.assertEqual(streamed, expected)
+
+    def test_shared_comparators(self):
+        calls = []
+
+        def counting_gt(a, b):
+            calls.append((a, b))
+            return a > b
+
+        matcher = PatternMatcher()
+        matcher.register_pattern("a", (counting_gt,) * 3, lambda: None)
+        matcher.register_pattern("b", (counting_gt, lt), lambda: None)
+        for i, value in enumerate([1, 2, 3, 4]):
+            matcher.receive_item((i, value))
+        self.assertEqual(len(calls), 3)
+
+    def test_amend_last_item(self):
+        self.matcher.receive_item((0, 20))
+        self.matcher.receive_item((1, 30))
+        self.matcher.receive_item((2, 40))
+        # Rewriting 40 -> 20 means 30 -> 20 -> 30 no longer matches up, up, down
+        self.matcher.amend_last_item((2, 20))
+        self.matcher.receive_item((3, 30))
+        self.assertFalse(self.matched)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,6 +1,8 @@
-from functools import partial, reduce
+from functools import lru_cache, partial, reduce
 import operator
 
+import numpy as np
+
 DUCK_DECREASE_THRESHOLD = 2
 
 JUMP_INCREASE_THRESHOLD = 6
@@ -72,10 +74,13 @@ lt_neg_10p = partial(_chain, [partial(lt_thresh, 0.1), negative])
 lt_neg_20p = partial(_chain, [partial(lt_thresh, 0.2), negative])
 
 
+# Cached so that equal arguments hand back the same comparator, which the pattern automaton then only evaluates once
+@lru_cache(maxsize=None)
 def mag_rel(op, mag):
     return lambda a, _: op(abs(a), mag)
 
 
+@lru_cache(maxsize=None)
 def abs_rel(op, val):
     return lambda a, _: op(a, val)
 
@@ -88,5 +93,40 @@ def peak_up(a, b):
     return a > (b + JUMP_INCREASE_THRESHOLD)
 
 
+@lru_cache(maxsize=None)
+def rises_by(threshold):
+    return lambda a, b: a > (b + threshold)
+
+
 def peak_down(a, b):
     return a < (b - DUCK_DECREASE_THRESHOLD)
+
+
+# Array versions of comparators that branch on their inputs, used when replaying a whole trace at once. Each one must
+# agree elementwise with its scalar counterpart.
+def eq_thresh_batch(threshold: float, a, b):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(b == 0, a < 100 * threshold, np.abs(a - b) / b < threshold)
+
+
+def tare_batch(a, b):
+    return eq_thresh_batch(0.05, a, b) | ((np.abs(a) < 1) & (np.abs(b) < 1))
+
+
+_BATCH_COMPARATORS = {
+    tare: tare_batch,
+}
+
+
+def compare_batch(comparator, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Evaluate `comparator` over whole arrays of pairs, returning a boolean array"""
+    if comparator in _BATCH_COMPARATORS:
+        return _BATCH_COMPARATORS[comparator](a, b)
+    try:
+        # Most comparators are plain arithmetic and broadcast as-is
+        result = np.asarray(comparator(a, b), dtype=bool)
+        if result.shape == a.shape:
+            return result
+    except (TypeError, ValueError):
+        pass
+    return np.frompyfunc(comparator, 2, 1)(a, b).astype(bool)
@@ -1,50 +1,90 @@
+import typing as t
+import unittest
 from functools import partial
 
+import numpy as np
+
 from dino.buffer import Buffer
+from dino.integrator import Integrator
 from dino.openscale_serial.openscale_reader import SAMPLES_PER_SEC
-from dino.util import extract_tail
+from dino.rolling import RollingStats
+from dino.state_machine.types import Load
 
 TARE_THRESHOLD = 15.0
+# Standing still on the scale wobbles by a few tenths of a pound; an empty scale by a few hundredths
+STEADY_STD = 1.0
 
 
 class PhysicsSolver:
-    def __init__(self, buffer: Buffer):
+    def __init__(
+        self, buffer: Buffer, attach=True, leak_tau=None, tare_threshold=TARE_THRESHOLD
+    ):
+        # History for plotting and pattern matching; the integration itself runs on the integrator's scalar state
         self.position = Buffer()
         self.velocity = Buffer()
         self.force = buffer
+        self.integrator = Integrator(leak_tau)
+        self.tare_threshold = tare_threshold
+        # Registered before anything else on the buffer, so it's up to date by the time any other callback runs
+        self.force_stats = RollingStats(SAMPLES_PER_SEC).attach(buffer)
 
         self.tare_weight = None
         self.steady_weight = None
+        # Called with the new tare weight whenever the scale is (re-)tared
+        self.tare_listeners: t.List[t.Callable[[float], None]] = []
 
-        self.force.register_callback(
-            partial(Buffer.call_with_last_item, self.receive_force_data)
-        )
+        # A Pipeline feeds us itself rather than having the buffer call back
+        if attach:
+            self.force.register_callback(
+                partial(Buffer.call_with_last_item, self.receive_force_data)
+            )
 
     @property
     def last_second_average(self):
-        return (
-            sum(i[1] for i in extract_tail(self.force.buffer, SAMPLES_PER_SEC))
-            / SAMPLES_PER_SEC
-        )
+        return self.force_stats.mean
+
+    @property
+    def load(self) -> Load:
+        """Steady and empty, steady under load, or neither, from the spread of the last second of force.
+
+        The pairwise `tare` pattern in `steady_force_pattern` decides when to calibrate; this decides whether the
+        scale is steady enough to re-tare at the last second's average.
+        """
+        stats = self.force_stats
+        # Compared as variances, so `replay` makes the same call from `rolling` bit-for-bit
+        if not stats.is_full or stats.variance > STEADY_STD**2:
+            return Load.UNSTEADY
+        # The same test `calibrate_steady_state` uses to decide whether to re-tare
+        return Load.EMPTY if abs(stats.mean) < self.tare_threshold else Load.LOADED
 
     def calibrate_steady_state(self):
         self.zero_velocity()
         if self.tare_weight is None:
             maybe_tare = self.last_second_average
-            if abs(maybe_tare) > TARE_THRESHOLD:
+            if abs(maybe_tare) > self.tare_threshold:
                 raise RuntimeError(
                     f"Scale hasn't been tared, but we're reading {maybe_tare} lbs on average"
                 )
             print("Tared at", maybe_tare)
-            self.tare_weight = maybe_tare
+            self._set_tare(maybe_tare)
         else:
             last_average = self.last_second_average
-            if abs(last_average) < TARE_THRESHOLD:
-                self.tare_weight = last_average
+            if abs(last_average) < self.tare_threshold:
+                # A second that still has someone stepping off in it can average under the threshold too, but it
+                # isn't the empty scale's weight
+                if self.load is Load.EMPTY:
+                    self._set_tare(last_average)
                 self.steady_weight = None
+                # Nothing is integrated until the next loaded steady state, which then starts from rest
+                self.integrator.reset()
             else:
                 self.steady_weight = self.correct_for_tare(last_average)
 
+    def _set_tare(self, tare: float):
+        self.tare_weight = tare
+        for listener in self.tare_listeners:
+            listener(tare)
+
     def correct_for_tare(self, force: float):
         if self.tare_weight is None:
             return force
@@ -56,30 +96,58 @@ class PhysicsSolver:
         return self.correct_for_tare(force) - self.steady_weight
 
     def receive_force_data(self, last_item):
-        def add_entry(old_entry, new_entry):
-            ts_new, new = new_entry
-            ts_old, old = old_entry
-            delta_t = (ts_new - ts_old) / 1000
-            return ts_new, old + new * delta_t
-
         if self.steady_weight is not None:
             ts, y = last_item
-
-            if self.velocity.is_empty():
-                last_velocity = (ts, 0)
-            else:
-                last_velocity = self.velocity.last_item
-            if self.position.is_empty():
-                last_position = (ts, 0)
-            else:
-                last_position = self.position.last_item
-
-            self.velocity.append(
-                *add_entry(last_velocity, (ts, self.deviation_from_steady(y)))
-            )
-            self.position.append(*add_entry(last_position, self.velocity.last_item))
+            velocity, position = self.integrator.step(ts, self.deviation_from_steady(y))
+            self.velocity.append(ts, velocity)
+            self.position.append(ts, position)
 
     def zero_velocity(self):
+        self.integrator.zero_velocity()
         if not self.velocity.is_empty():
-            (ts, _) = self.velocity.last_item
-            self.velocity.buffer[-1] = (ts, 0)
+            ts, _ = self.velocity.last_item
+            self.velocity.amend_last(ts, 0)
+
+
+class TestPhysicsSolver(unittest.TestCase):
+    def test_load(self):
+        buffer = Buffer()
+        physics = PhysicsSolver(buffer)
+        rng = np.random.default_rng(0)
+        readings = [
+            (rng.normal(-4, 0.01, SAMPLES_PER_SEC), Load.EMPTY),
+            (rng.normal(150, 0.3, SAMPLES_PER_SEC), Load.LOADED),
+            (np.linspace(150, 250, SAMPLES_PER_SEC), Load.UNSTEADY),
+        ]
+        ts = 0
+        for values, expected in readings:
+            for value in values.tolist():
+                buffer.append(ts, value)
+                ts += 50
+            self.assertEqual(physics.load, expected)
+
+    def test_retare_only_when_steady(self):
+        buffer = Buffer()
+        physics = PhysicsSolver(buffer)
+        tares = []
+        physics.tare_listeners.append(tares.append)
+        rng = np.random.default_rng(0)
+        ts = 0
+        for values in (
+            rng.normal(-4, 0.01, SAMPLES_PER_SEC),
+            rng.normal(150, 0.3, SAMPLES_PER_SEC),
+            # Stepping off: the last second averages under the threshold, but mostly because of the step
+            np.concatenate(([150.0, 73.0], rng.normal(-4, 0.01, SAMPLES_PER_SEC - 2))),
+            rng.normal(-4.5, 0.01, SAMPLES_PER_SEC),
+        ):
+            for value in values.tolist():
+                buffer.append(ts, value)
+                ts += 50
+            physics.calibrate_steady_state()
+        self.assertEqual(len(tares), 2)
+        np.testing.assert_allclose(tares, [-4, -4.5], atol=0.01)
+        self.assertIsNone(physics.steady_weight)
+
+
+if __name__ == "__main__":
+    unittest.main()
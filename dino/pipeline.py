@@ -0,0 +1,493 @@
+"""Sample processing as a fixed sequence of named stages, each of which handles a whole batch of samples at a time.
+
+The default topology mirrors what used to be wired together with `Buffer.register_callback`:
+
+    ingest -> smooth -> tare -> integrate -> match -> emit
+
+and produces exactly the same events, in the same order, regardless of how the samples are batched.
+"""
+
+import typing as t
+import unittest
+from dataclasses import dataclass, field
+from pathlib import Path
+from time import monotonic, perf_counter_ns
+
+import numpy as np
+
+from dino.buffer import Buffer
+from dino.latency import LatencyRecorder
+from dino.pattern_matching import PatternMatcher
+from dino.pattern_matching.defaults import (
+    DEFAULT_PARAMS,
+    DetectorParams,
+    register_default_patterns,
+)
+from dino.physics import PhysicsSolver
+from dino.recording import RecordingWriter
+from dino.session import EVENT_NAMES, SessionWriter
+from dino.shared_feed import DEFAULT_CAPACITY, SharedFeedWriter
+from dino.smoother import Filter
+
+Item = t.Tuple[int, float]
+
+
+@dataclass
+class Batch:
+    """Samples on their way through the pipeline. Each stage reads what earlier stages filled in"""
+
+    timestamps: np.ndarray
+    force: np.ndarray
+    # When each sample came off the wire (`time.monotonic()`); only tracked when measuring latency
+    read_times: t.Optional[np.ndarray] = None
+    # Names of the force patterns that matched at each sample (tare)
+    force_matches: t.List[t.List[str]] = field(default_factory=list)
+    # Force corrected by the tare in effect when each sample arrived (integrate)
+    tared: t.List[Item] = field(default_factory=list)
+    # Velocity samples in the order they were appended, and whether each was an amendment of the one before (integrate)
+    velocity: t.List[t.Tuple[bool, Item]] = field(default_factory=list)
+    position: t.List[Item] = field(default_factory=list)
+    # (timestamp, pattern name) for every velocity pattern that matched (match)
+    events: t.List[t.Tuple[int, str]] = field(default_factory=list)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+
+@dataclass
+class StageStats:
+    calls: int = 0
+    samples: int = 0
+    total_ns: int = 0
+    max_ns: int = 0
+
+    def record(self, elapsed_ns: int, samples: int):
+        self.calls += 1
+        self.samples += samples
+        self.total_ns += elapsed_ns
+        self.max_ns = max(self.max_ns, elapsed_ns)
+
+    def __str__(self):
+        per_sample = self.total_ns / self.samples / 1e3 if self.samples else 0.0
+        return (
+            f"{self.calls} batches, {self.samples} samples, {self.total_ns / 1e6:.1f} ms total, "
+            f"{per_sample:.2f} us/sample, {self.max_ns / 1e3:.0f} us worst batch"
+        )
+
+
+class Pipeline:
+    """Runs every batch through its stages in the order they were added, timing each one"""
+
+    def __init__(self):
+        self.stages: t.Dict[str, t.Callable[[Batch], None]] = {}
+        self.stats: t.Dict[str, StageStats] = {}
+        # The batch currently being processed, and the timestamp of the sample the current stage is working on. Lets
+        # callbacks fired from inside a stage (eg drawing a line at a jump) know where they are
+        self.batch: t.Optional[Batch] = None
+        self.now: t.Optional[int] = None
+        # Set to a `LatencyRecorder` to record how long after being read each sample clears each stage
+        self.latency: t.Optional[LatencyRecorder] = None
+
+    def add_stage(self, name: str, stage: t.Callable[[Batch], None]) -> "Pipeline":
+        if name in self.stages:
+            raise ValueError(f"Duplicate stage: {name}")
+        self.stages[name] = stage
+        self.stats[name] = StageStats()
+        return self
+
+    def process(
+        self,
+        timestamps: np.ndarray,
+        values: np.ndarray,
+        read_times: t.Optional[np.ndarray] = None,
+    ) -> Batch:
+        batch = Batch(
+            np.asarray(timestamps, dtype=np.int64),
+            np.asarray(values, dtype=np.float64),
+        )
+        latency = self.latency
+        if latency is not None:
+            # Samples that didn't come from the serial port are timed from when they got here
+            batch.read_times = (
+                np.full(len(batch), monotonic()) if read_times is None else read_times
+            )
+        self.batch = batch
+        for name, stage in self.stages.items():
+            start = perf_counter_ns()
+            stage(batch)
+            self.stats[name].record(perf_counter_ns() - start, len(batch))
+            if latency is not None:
+                latency.record_batch(name, batch.read_times)
+        self.batch = None
+        return batch
+
+    def process_item(self, ts: int, value: float) -> Batch:
+        """For sources that deliver one sample at a time"""
+        return self.process(np.array([ts]), np.array([value]))
+
+    def report(self) -> str:
+        width = max(map(len, self.stats), default=0)
+        return "\n".join(
+            f"{name:<{width}}  {stats}" for name, stats in self.stats.items()
+        )
+
+
+class DinoPipeline(Pipeline):
+    """The standard topology: tare the scale, integrate force into velocity and position, and match jumps"""
+
+    def __init__(
+        self,
+        socket_rpc,
+        draw_vline: t.Callable[[int, str], None] = lambda ts, color: None,
+        smoother: t.Optional[Filter] = None,
+        params: DetectorParams = DEFAULT_PARAMS,
+    ):
+        super().__init__()
+        self.buffer = Buffer()
+        self.physics = PhysicsSolver(
+            self.buffer, attach=False, tare_threshold=params.tare_threshold
+        )
+        self.force_matcher = PatternMatcher()
+        self.velocity_matcher = PatternMatcher()
+        self.smoother = smoother
+        # Timestamps of the samples the smoother is holding back
+        self._held = np.zeros(0, dtype=np.int64)
+        self.raw_sinks: t.List[t.Callable[[np.ndarray, np.ndarray], None]] = []
+        # Called with (timestamp, pattern name) for every velocity event, after its own callback
+        self.event_listeners: t.List[t.Callable[[int, str], None]] = []
+        register_default_patterns(
+            self.force_matcher,
+            self.physics,
+            self.velocity_matcher,
+            lambda color: draw_vline(self.now, color),
+            socket_rpc,
+            params,
+        )
+
+        # Integration appends to (and zero_velocity amends) these; the match stage picks the log up from the batch
+        self.physics.velocity.register_callback(
+            lambda b: self.batch.velocity.append((False, b.last_item))
+        )
+        self.physics.velocity.register_amend_callback(
+            lambda b: self.batch.velocity.append((True, b.last_item))
+        )
+        self.physics.position.register_callback(
+            lambda b: self.batch.position.append(b.last_item)
+        )
+
+        self.add_stage("ingest", self.ingest)
+        self.add_stage("smooth", self.smooth)
+        self.add_stage("tare", self.tare)
+        self.add_stage("integrate", self.integrate)
+        self.add_stage("match", self.match)
+        self.add_stage("emit", self.emit)
+
+    def ingest(self, batch: Batch):
+        """Hand the raw samples to anything that wants them before they're filtered (eg `RecordingWriter.write_batch`)"""
+        for sink in self.raw_sinks:
+            sink(batch.timestamps, batch.force)
+
+    def smooth(self, batch: Batch):
+        """Filter the force. A filter that looks ahead holds the last few samples back until the ones after them
+        arrive, so the batch comes out shorter at first; from then on each sample leaves with the arrival (read time)
+        of the one `lookahead` after it"""
+        if self.smoother is None:
+            return
+        batch.force = self.smoother(batch.force)
+        emitted = len(batch.force)
+        if self.smoother.lookahead:
+            timestamps = np.concatenate((self._held, batch.timestamps))
+            batch.timestamps, self._held = timestamps[:emitted], timestamps[emitted:]
+            if batch.read_times is not None:
+                batch.read_times = batch.read_times[len(batch.read_times) - emitted :]
+
+    def tare(self, batch: Batch):
+        """Look for a second of steady force. The calibration itself happens in order during integration"""
+        step = self.force_matcher.step
+        batch.force_matches = [step(value) for value in batch.force.tolist()]
+
+    def integrate(self, batch: Batch):
+        physics, buffer = self.physics, self.buffer
+        callbacks = self.force_matcher.patterns
+        for ts, y, matches in zip(
+            batch.timestamps.tolist(), batch.force.tolist(), batch.force_matches
+        ):
+            self.now = ts
+            buffer.append(ts, y)
+            batch.tared.append((ts, physics.correct_for_tare(y)))
+            physics.receive_force_data((ts, y))
+            # Recalibrating reads the last second of the force buffer, so it has to see exactly the samples up to here
+            for name in matches:
+                callbacks[name][1]()
+
+    def match(self, batch: Batch):
+        matcher = self.velocity_matcher
+        for amended, item in batch.velocity:
+            if amended:
+                matcher.amend_last_item(item)
+            else:
+                batch.events.extend((item[0], name) for name in matcher.step(item[1]))
+
+    def emit(self, batch: Batch):
+        callbacks = self.velocity_matcher.patterns
+        for ts, name in batch.events:
+            self.now = ts
+            callbacks[name][1]()
+            for listener in self.event_listeners:
+                listener(ts, name)
+            if self.latency is not None:
+                index = np.searchsorted(batch.timestamps, ts)
+                self.latency.record(f"send {name}", batch.read_times[index])
+
+
+def connect_plotter(pipeline: DinoPipeline, plotter, n_integrals=1):
+    """Have the emit stage forward every batch to the plotter's series"""
+    force = plotter.get_differentiable_series("Force")
+    velocity = (
+        plotter.get_differentiable_series("Velocity") if n_integrals >= 1 else None
+    )
+    position = (
+        plotter.get_differentiable_series("Position") if n_integrals >= 2 else None
+    )
+    emit = pipeline.stages["emit"]
+
+    def emit_and_plot(batch: Batch):
+        emit(batch)
+        for item in batch.tared:
+            force.append_item(item)
+        if velocity is not None:
+            for amended, item in batch.velocity:
+                # The plot keeps whatever was first drawn, as it always has
+                if not amended:
+                    velocity.append_item(item)
+        if position is not None:
+            for item in batch.position:
+                position.append_item(item)
+        if len(pipeline.buffer):
+            plotter.set_min_x(pipeline.buffer[0][0])
+
+    pipeline.stages["emit"] = emit_and_plot
+
+
+def connect_feed(
+    pipeline: DinoPipeline, prefix: str, capacity=DEFAULT_CAPACITY
+) -> t.Dict[str, SharedFeedWriter]:
+    """Publish the tared force, velocity and position to shared memory as `{prefix}-force` etc., after each batch.
+
+    Returns the writers, which the caller should `close` when done.
+    """
+    writers = {
+        series: SharedFeedWriter(f"{prefix}-{series}", capacity)
+        for series in ("force", "velocity", "position")
+    }
+
+    def publish(batch: Batch):
+        for series, items in (("force", batch.tared), ("position", batch.position)):
+            if items:
+                writers[series].extend(*zip(*items))
+        velocity = writers["velocity"]
+        for amended, item in batch.velocity:
+            if amended:
+                velocity.amend_last(*item)
+            else:
+                velocity.append(*item)
+
+    pipeline.add_stage("publish", publish)
+    return writers
+
+
+def connect_recorder(pipeline: DinoPipeline, writer: SessionWriter) -> SessionWriter:
+    """Record every raw sample, and the velocity, position and events derived from them, with `writer`.
+
+    The caller should `close` the writer when done.
+    """
+    codes = {name: code for code, name in enumerate(EVENT_NAMES)}
+    pipeline.raw_sinks.append(
+        lambda timestamps, force: writer.write(
+            "force", timestamps.tolist(), force.tolist()
+        )
+    )
+
+    def record(batch: Batch):
+        timestamps, values = [], []
+        for amended, (ts, value) in batch.velocity:
+            if not amended:
+                timestamps.append(ts)
+                values.append(value)
+            elif values:
+                timestamps[-1], values[-1] = ts, value
+            else:
+                writer.amend_last("velocity", ts, value)
+        writer.write("velocity", timestamps, values)
+        if batch.position:
+            writer.write("position", *zip(*batch.position))
+        if batch.events:
+            writer.write(
+                "events",
+                [ts for ts, _ in batch.events],
+                [codes[name] for _, name in batch.events],
+            )
+
+    pipeline.add_stage("record", record)
+    return writer
+
+
+def connect_recording(
+    pipeline: DinoPipeline, writer: RecordingWriter
+) -> RecordingWriter:
+    """Write every raw sample to a binary recording, with the tare the scale ends up at in its header.
+
+    The caller should `close` the writer when done.
+    """
+    pipeline.raw_sinks.append(writer.write_batch)
+    pipeline.physics.tare_listeners.append(writer.set_tare)
+    return writer
+
+
+class TestPipeline(unittest.TestCase):
+    def test_matches_callbacks(self):
+        from dino.replay import load_trace, replay_streaming
+
+        rng = np.random.default_rng(0)
+        for trace in ("eric.txt", "michelle.txt"):
+            timestamps, force = load_trace(trace)
+            expected = replay_streaming(timestamps, force)
+            for sizes in ("ones", "random"):
+                with self.subTest(trace=trace, sizes=sizes):
+                    messages = []
+
+                    class _Recorder:
+                        @staticmethod
+                        def send(message):
+                            messages.append((pipeline.now, message))
+
+                    pipeline = DinoPipeline(_Recorder)
+                    if sizes == "ones":
+                        bounds = np.arange(len(timestamps) + 1)
+                    else:
+                        bounds = np.unique(
+                            np.r_[
+                                0, rng.integers(0, len(timestamps), 50), len(timestamps)
+                            ]
+                        )
+                    for start, end in zip(bounds[:-1], bounds[1:]):
+                        pipeline.process(timestamps[start:end], force[start:end])
+                    self.assertEqual(messages, expected)
+                    self.assertEqual(
+                        pipeline.stats["integrate"].samples, len(timestamps)
+                    )
+
+    def test_smoother(self):
+        from dino.replay import load_trace
+        from dino.smoother import MedianFilter
+        from dino.socket_rpc import NullSender
+
+        timestamps, force = load_trace("michelle.txt")
+        pipeline = DinoPipeline(NullSender, smoother=MedianFilter(5))
+        pipeline.latency = LatencyRecorder()
+        for start in range(0, len(timestamps), 100):
+            pipeline.process(
+                timestamps[start : start + 100], force[start : start + 100]
+            )
+        # Everything but the two samples still held back, each at its own timestamp
+        kept = len(pipeline.buffer)
+        self.assertEqual(
+            pipeline.buffer.timestamps.tolist(), timestamps[:-2][-kept:].tolist()
+        )
+        self.assertEqual(
+            pipeline.buffer.values.tolist(),
+            MedianFilter(5).filter(force)[-kept:].tolist(),
+        )
+
+    def test_stage_order_and_stats(self):
+        seen = []
+        pipeline = Pipeline()
+        pipeline.add_stage("a", lambda batch: seen.append(("a", len(batch))))
+        pipeline.add_stage("b", lambda batch: seen.append(("b", len(batch))))
+        pipeline.process(np.arange(3), np.zeros(3))
+        pipeline.process_item(3, 0.0)
+        self.assertEqual(seen, [("a", 3), ("b", 3), ("a", 1), ("b", 1)])
+        self.assertEqual(pipeline.stats["b"].calls, 2)
+        self.assertEqual(pipeline.stats["b"].samples, 4)
+        with self.assertRaises(ValueError):
+            pipeline.add_stage("a", lambda batch: None)
+
+    def test_feed(self):
+        from dino.replay import load_trace
+        from dino.shared_feed import SharedFeedReader
+        from dino.socket_rpc import NullSender
+
+        timestamps, force = load_trace("eric.txt")
+        pipeline = DinoPipeline(NullSender)
+        writers = connect_feed(pipeline, f"dino-test-{id(self)}")
+        try:
+            reader = SharedFeedReader(writers["velocity"].name)
+            for start in range(0, len(timestamps), 64):
+                pipeline.process(
+                    timestamps[start : start + 64], force[start : start + 64]
+                )
+            # The published velocity is the live one, amendments (zero-velocity updates) and all
+            velocity = pipeline.physics.velocity
+            self.assertEqual(
+                reader.tail(len(velocity))[1].tolist(), velocity.values.tolist()
+            )
+            reader.close()
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+    def test_recorder(self):
+        import tempfile
+
+        from dino.replay import load_trace, replay
+        from dino.session import read_stream
+        from dino.socket_rpc import NullSender
+
+        timestamps, force = load_trace("eric.txt")
+        expected = replay(timestamps, force)
+        with tempfile.TemporaryDirectory() as d:
+            pipeline = DinoPipeline(NullSender)
+            writer = connect_recorder(
+                pipeline, SessionWriter(d, block_samples=100)
+            ).start()
+            for start in range(0, len(timestamps), 64):
+                pipeline.process(
+                    timestamps[start : start + 64], force[start : start + 64]
+                )
+            writer.close()
+            self.assertEqual(read_stream(d, "force")[1].tolist(), force.tolist())
+            # Velocity as it ended up, after zero_velocity amendments
+            self.assertEqual(
+                read_stream(d, "velocity")[1].tolist(), expected.velocity.tolist()
+            )
+            events_ts, codes = read_stream(d, "events")
+            self.assertEqual(
+                list(zip(events_ts.tolist(), [EVENT_NAMES[c] for c in codes])),
+                expected.events,
+            )
+
+    def test_recording(self):
+        import tempfile
+
+        from dino.recording import Recording
+        from dino.replay import load_trace
+        from dino.socket_rpc import NullSender
+
+        timestamps, force = load_trace("eric.txt")
+        with tempfile.TemporaryDirectory() as d:
+            path = Path(d) / "eric.dinorec"
+            pipeline = DinoPipeline(NullSender)
+            writer = connect_recording(pipeline, RecordingWriter(open(path, "wb")))
+            for start in range(0, len(timestamps), 64):
+                pipeline.process(
+                    timestamps[start : start + 64], force[start : start + 64]
+                )
+            writer.close()
+            recording = Recording(path)
+            self.assertEqual(recording.values.tolist(), force.tolist())
+            self.assertEqual(recording.header.tare, pipeline.physics.tare_weight)
+            recording.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,206 @@
+"""Several scales at once: one independent pipeline, state machine and event channel per player, on one event loop.
+
+Player `i` gets their events on UDP port `PORT + i` (counting from the sender's port), so a single game instance keeps
+listening where it always has for player 0.
+"""
+
+import asyncio
+import typing as t
+import unittest
+from dataclasses import dataclass, field
+
+from dino.latency import LatencyRecorder
+from dino.pattern_matching.defaults import VELOCITY_EVENTS
+from dino.pipeline import Batch, DinoPipeline
+from dino.runtime import run_all
+from dino.smoother import make_filter
+from dino.socket_rpc import AsyncUDPSender, EventSender
+from dino.state_machine import DinoStateMachine
+
+
+@dataclass
+class Player:
+    name: str
+    # Anything with an async `batches()`, eg `SerialSource` or `SimulatedSource`
+    source: t.Any
+    pipeline: DinoPipeline
+    events: EventSender
+    state_machine: DinoStateMachine = field(default_factory=DinoStateMachine)
+    # What stopped this player's feed early, if anything did
+    error: t.Optional[BaseException] = None
+
+    def __post_init__(self):
+        self.pipeline.event_listeners.append(
+            lambda ts, name: self.state_machine.receive_event(VELOCITY_EVENTS[name], ts)
+        )
+        # States time out between events too
+        self.pipeline.add_stage("state", self.advance)
+
+    def advance(self, batch: Batch):
+        if len(batch.timestamps):
+            self.state_machine.advance(int(batch.timestamps[-1]))
+
+
+def make_players(
+    sources: t.Sequence,
+    sender: AsyncUDPSender,
+    ports: t.Sequence[int] = None,
+    latency=False,
+    debug=False,
+    smoother: t.Optional[str] = None,
+    **event_args,
+) -> t.List[Player]:
+    """One player per source, each sending through `sender` to their own port (`sender`'s port + i by default).
+
+    `debug` logs every player's state transitions, `smoother` names a filter (see `make_filter`) for each player's
+    force, and `event_args` go to each player's `EventSender`.
+    """
+    ports = ports or [sender.address[1] + i for i in range(len(sources))]
+    players = []
+    for i, (source, port) in enumerate(zip(sources, ports)):
+        events = EventSender(sender.channel(port), **event_args)
+        pipeline = DinoPipeline(
+            events, smoother=make_filter(smoother) if smoother else None
+        )
+        events.clock = lambda pipeline=pipeline: pipeline.now
+        if latency:
+            pipeline.latency = LatencyRecorder()
+        players.append(
+            Player(
+                f"player {i + 1}",
+                source,
+                pipeline,
+                events,
+                DinoStateMachine(debug=debug),
+            )
+        )
+    return players
+
+
+async def run_players(players: t.Sequence[Player], sender: AsyncUDPSender = None):
+    """Run every player's source through their pipeline until all the sources run dry (or we're cancelled).
+
+    One player's feed failing doesn't stop anyone else's; the error is kept on that player.
+    """
+    failures = await run_all(
+        [(player.source, player.pipeline) for player in players], sender=sender
+    )
+    for index, error in failures.items():
+        players[index].error = error
+
+
+class TestPlayers(unittest.TestCase):
+    def test_players_are_independent(self):
+        import socket
+
+        from dino.replay import load_trace, replay, replay_streaming
+        from dino.runtime import SimulatedSource
+        from dino.socket_rpc import decode_event
+
+        traces = [load_trace(name) for name in ("eric.txt", "michelle.txt")]
+        received = [[] for _ in traces]
+        seen = [[] for _ in traces]
+
+        class _Receiver(asyncio.DatagramProtocol):
+            def __init__(self, player):
+                self.player = player
+
+            def datagram_received(self, data, addr):
+                packet = decode_event(data)
+                received[self.player].append((packet.source_ts, packet.kind))
+
+        async def session():
+            loop = asyncio.get_running_loop()
+            transports, ports = [], []
+            for i in range(len(traces)):
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+                sock.bind(("127.0.0.1", 0))
+                transport, _ = await loop.create_datagram_endpoint(
+                    lambda i=i: _Receiver(i), sock=sock
+                )
+                transports.append(transport)
+                ports.append(sock.getsockname()[1])
+
+            sender = AsyncUDPSender()
+            sources = [
+                SimulatedSource(*trace, speed=0, max_batch=8) for trace in traces
+            ]
+            players = make_players(sources, sender, ports, latency=True)
+            for player, events in zip(players, seen):
+                player.pipeline.event_listeners.append(
+                    lambda _ts, name, events=events: events.append(name)
+                )
+            await run_players(players, sender)
+            await asyncio.sleep(0.05)
+            for transport in transports:
+                transport.close()
+            return players
+
+        players = asyncio.run(session())
+        for i, trace in enumerate(traces):
+            expected = replay_streaming(*trace)
+            self.assertEqual(received[i], expected)
+            self.assertEqual(players[i].pipeline.stats["emit"].samples, len(trace[0]))
+            self.assertIn("send positive_large", players[i].pipeline.latency.histograms)
+            # Each player's listeners only ever saw their own events
+            self.assertEqual(len(seen[i]), len(expected))
+            self.assertIsNot(players[0].state_machine, players[1].state_machine)
+            # And their state machine ended up where the same events, fed all at once, take it
+            result, machine = replay(*trace), DinoStateMachine()
+            machine.feed(result.velocity_events, result.event_timestamps)
+            machine.advance(int(trace[0][-1]))
+            self.assertEqual(
+                players[i].state_machine.current_state, machine.current_state
+            )
+
+    def test_one_failure_stops_one_player(self):
+        import socket
+
+        from dino.replay import load_trace, replay_streaming
+        from dino.runtime import SimulatedSource
+        from dino.socket_rpc import EventReceiver
+
+        # Loaded at the start, so that player's scale never tares
+        traces = [load_trace(name) for name in ("eric2.txt", "eric.txt")]
+        received = [[] for _ in traces]
+
+        async def session():
+            loop = asyncio.get_running_loop()
+            transports, receivers, ports = [], [], []
+            for events in received:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+                sock.bind(("127.0.0.1", 0))
+                transport, receiver = await loop.create_datagram_endpoint(
+                    lambda events=events: EventReceiver(
+                        lambda packet: events.append((packet.source_ts, packet.kind))
+                    ),
+                    sock=sock,
+                )
+                transports.append(transport)
+                receivers.append(receiver)
+                ports.append(sock.getsockname()[1])
+
+            sender = AsyncUDPSender()
+            sources = [
+                SimulatedSource(*trace, speed=0, max_batch=8) for trace in traces
+            ]
+            players = make_players(sources, sender, ports)
+            await run_players(players, sender)
+            await asyncio.sleep(0.05)
+            for transport in transports:
+                transport.close()
+            return players, receivers
+
+        players, receivers = asyncio.run(session())
+        self.assertIsInstance(players[0].error, RuntimeError)
+        self.assertIsNone(players[1].error)
+        self.assertEqual(received[0], [])
+        self.assertEqual(received[1], replay_streaming(*traces[1]))
+        self.assertEqual(receivers[1].lost, 0)
+        self.assertEqual(players[1].pipeline.stats["emit"].samples, len(traces[1][0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,14 +1,13 @@
 import platform
 import typing as t
-from collections import deque
+from functools import partial
 
 import matplotlib
 import matplotlib.animation as animation
 import matplotlib.pyplot as plt
 from matplotlib.backend_tools import ToolToggleBase
-from numpy import diff
-
-from dino.buffer import BUFFER_MINUTES
+from dino.buffer import Buffer, BUFFER_MINUTES
+from dino.decimation import DEFAULT_MAX_POINTS, DecimatedSeries
 from dino.openscale_serial.openscale_reader import SAMPLES_PER_SEC
 
 if (platform_name := platform.system().lower()) == "windows":
@@ -51,6 +50,54 @@ class PauseTool(ToolToggleBase):
         resume()
 
 
+class BlitAnimation:
+    """Redraws only the plotter's animated artists on top of a cached background.
+
+    Stands in for `FuncAnimation` (including `pause`/`resume`). The background, with the axes, ticks and legend, is
+    only re-rendered when the plotter asks for a full draw because its limits or artists changed.
+    """
+
+    def __init__(self, plotter: "Plotter", interval: t.Optional[int]):
+        self.plotter = plotter
+        self.canvas = plotter.figure.canvas
+        self.background = None
+        self.canvas.mpl_connect("draw_event", self._on_draw)
+        # Without an interval, whoever made us calls `step` (eg the asyncio runtime)
+        self.timer = None
+        if interval is not None:
+            self.timer = self.canvas.new_timer(interval=interval)
+            self.timer.add_callback(self.step)
+            self.timer.start()
+
+    def _on_draw(self, _event):
+        self.background = self.canvas.copy_from_bbox(self.plotter.figure.bbox)
+        self._draw_artists()
+
+    def _draw_artists(self):
+        for artist in self.plotter.animated_artists():
+            self.plotter.plot.draw_artist(artist)
+
+    def step(self):
+        if self.plotter._update_artists():
+            # Limits or legend changed, so the cached background is stale
+            self.canvas.draw_idle()
+            return
+        if self.background is None:
+            return
+        self.canvas.restore_region(self.background)
+        self._draw_artists()
+        self.canvas.blit(self.plotter.figure.bbox)
+        self.canvas.flush_events()
+
+    def pause(self):
+        if self.timer is not None:
+            self.timer.stop()
+
+    def resume(self):
+        if self.timer is not None:
+            self.timer.start()
+
+
 def on_press(event):
     if event.key == " ":
         if not paused:
@@ -60,14 +107,25 @@ def on_press(event):
 
 
 class Plotter:
-    def __init__(self, n_derivates=1):
+    def __init__(
+        self, n_derivates=1, blit=False, fps=25, max_points=DEFAULT_MAX_POINTS
+    ):
         self.figure = plt.figure()
         self.plot = self.figure.add_subplot(1, 1, 1)
-        self.series: t.Dict[str, t.Deque[t.Tuple]] = {}
+        self.series: t.Dict[str, Buffer] = {}
+        # What actually gets drawn: each series and its derivatives, decimated to about `max_points` points
+        self.decimated: t.Dict[str, DecimatedSeries] = {}
+        self.max_points = max_points
         self.n_derivatives = n_derivates
         self.vertical_lines = []
         self.min_x = 0
 
+        # Blitting state: one Line2D per series (and derivative), created once and updated with set_data
+        self.blit = blit
+        self.fps = fps
+        self.lines: t.Dict[str, t.List[matplotlib.lines.Line2D]] = {}
+        self.vline_artists = []
+
         if platform_name == "windows":
             try:
                 tm = self.figure.canvas.manager.toolmanager
@@ -80,27 +138,24 @@ class Plotter:
         elif platform_name == "darwin":
             self.figure.canvas.mpl_connect("key_press_event", on_press)
 
+        if self.blit:
+            self._format_plot()
+
     def _draw(self, _i):
         """Called once per interval to update the displayed graph"""
         self.plot.clear()
-        for label, data in self.series.items():
-            xs = [i[0] for i in data if i[0] >= self.min_x]
-            ys = [i[1] for i in data if i[0] >= self.min_x]
-
-            self.plot.plot(xs, ys, label=label)
-
-            derivatives = []
-            for nth in range(self.n_derivatives):
-                derivatives.append(diff(ys, nth + 1))
-                self.plot.plot(
-                    xs[nth + 1 :], derivatives[nth], label=label + "_prime" * (nth + 1)
-                )
+        for label, data in self.decimated.items():
+            for nth in range(self.n_derivatives + 1):
+                xs, ys = data.window(self.min_x, nth)
+                self.plot.plot(xs, ys, label=label + "_prime" * nth)
 
+        self._drop_old_vertical_lines()
         for x, color in self.vertical_lines:
-            if x >= self.min_x:
-                self._render_vertical_line(x, color)
+            self._render_vertical_line(x, color)
+
+        self._format_plot()
 
-        # Format plot
+    def _format_plot(self):
         plt.xticks(rotation=45, ha="right")
         plt.subplots_adjust(bottom=0.30)
         plt.title("Openscale reading")
@@ -108,15 +163,117 @@ class Plotter:
         if self.series:
             self.plot.legend()
 
-    def animate(self, interval=1000):
+    def _update_artists(self) -> bool:
+        """Point the blitted artists at the latest data. Returns True if the background needs a full redraw"""
+        relayout = False
+        x_max, y_min, y_max = None, None, None
+
+        for label, data in self.decimated.items():
+            if label not in self.lines:
+                self.lines[label] = [
+                    self.plot.plot([], [], label=label + "_prime" * nth, animated=True)[
+                        0
+                    ]
+                    for nth in range(self.n_derivatives + 1)
+                ]
+                relayout = True
+
+            for nth, line in enumerate(self.lines[label]):
+                xs, y = data.window(self.min_x, nth)
+                line.set_data(xs, y)
+                if len(y):
+                    y_min = min(y.min(), y_min) if y_min is not None else y.min()
+                    y_max = max(y.max(), y_max) if y_max is not None else y.max()
+                    x_max = max(xs[-1], x_max) if x_max is not None else xs[-1]
+
+        for x, color in self.vertical_lines[len(self.vline_artists) :]:
+            self.vline_artists.append(
+                (
+                    x,
+                    self.plot.vlines(
+                        x=x, ymin=-50, ymax=50, colors=color, animated=True
+                    ),
+                )
+            )
+        self._drop_old_vertical_lines()
+
+        if x_max is None:
+            return relayout
+
+        # Only move the axes in steps, leaving headroom, so most frames can be blitted
+        left, right = self.plot.get_xlim()
+        if x_max > right or self.min_x < left:
+            span = max(x_max - self.min_x, 1000)
+            self.plot.set_xlim(self.min_x, x_max + span / 4)
+            relayout = True
+        bottom, top = self.plot.get_ylim()
+        if y_min < bottom or y_max > top:
+            margin = max((y_max - y_min) / 10, 1)
+            self.plot.set_ylim(y_min - margin, y_max + margin)
+            relayout = True
+
+        if relayout:
+            self.plot.legend()
+        return relayout
+
+    def _drop_old_vertical_lines(self):
+        """Forget the vertical lines (and their artists) that have scrolled out of the window, so a frame only
+        handles the ones still on screen however long the session runs"""
+        # Lines are added as time goes on, so the old ones are all at the start
+        expired = 0
+        for x, _ in self.vertical_lines:
+            if x >= self.min_x:
+                break
+            expired += 1
+        for _, artist in self.vline_artists[:expired]:
+            artist.remove()
+        del self.vline_artists[:expired]
+        del self.vertical_lines[:expired]
+
+    def animated_artists(self) -> t.Iterator[matplotlib.artist.Artist]:
+        for lines in self.lines.values():
+            yield from lines
+        for _, artist in self.vline_artists:
+            yield artist
+
+    def animate(self, interval=None):
         global ANIMATION
-        ANIMATION = animation.FuncAnimation(self.figure, self._draw, interval=interval)
+        if self.blit:
+            ANIMATION = BlitAnimation(self, interval or 1000 // self.fps)
+        else:
+            ANIMATION = animation.FuncAnimation(
+                self.figure, self._draw, interval=interval or 1000
+            )
         plt.show()
 
-    def get_differentiable_series(self, key: str) -> t.Deque[t.Tuple]:
-        return self.series.setdefault(
-            key, deque(maxlen=SAMPLES_PER_SEC * 60 * BUFFER_MINUTES)
-        )
+    def draw_frame(self):
+        """Draw one frame without blocking, for driving the plot from an event loop instead of `animate`"""
+        global ANIMATION
+        if paused:
+            return
+        if self.blit:
+            if ANIMATION is None:
+                ANIMATION = BlitAnimation(self, interval=None)
+            ANIMATION.step()
+        else:
+            self._draw(None)
+            self.figure.canvas.draw_idle()
+
+    @property
+    def is_open(self) -> bool:
+        return plt.fignum_exists(self.figure.number)
+
+    def get_differentiable_series(self, key: str) -> Buffer:
+        if key not in self.series:
+            series = Buffer(maxlen=SAMPLES_PER_SEC * 60 * BUFFER_MINUTES)
+            decimated = DecimatedSeries(
+                self.n_derivatives, BUFFER_MINUTES * 60 * 1000, self.max_points
+            )
+            series.register_callback(
+                partial(Buffer.call_with_last_item, decimated.receive_item)
+            )
+            self.series[key], self.decimated[key] = series, decimated
+        return self.series[key]
 
     def stop(self):
         plt.close(self.figure)
@@ -0,0 +1,246 @@
+"""The plot, drawn by a child process so that redrawing never holds up reading and processing the scale.
+
+`RemotePlotter` stands in for `Plotter` in the acquisition process: `connect_plotter` and `DinoPipeline`'s vertical
+lines use it just the same. What they hand it is collected and, once a frame, sent down a pipe to the real `Plotter`,
+which runs its own event loop in the child. The child acknowledges every message; while it has a couple outstanding
+(eg it is busy redrawing), new samples pile up in the parent rather than blocking it on a full pipe, up to a plot's
+worth, after which the oldest are dropped and counted.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import signal
+import typing as t
+import unittest
+from collections import deque
+from unittest import mock
+
+import numpy as np
+
+from dino.buffer import BUFFER_MINUTES
+from dino.decimation import DEFAULT_MAX_POINTS
+from dino.openscale_serial.openscale_reader import SAMPLES_PER_SEC
+
+# Messages the child can be behind by before the parent holds on to new data instead of sending it
+MAX_IN_FLIGHT = 2
+# More than this many samples per series (or vertical lines) waiting to be sent would scroll off the plot anyway
+MAX_PENDING = SAMPLES_PER_SEC * 60 * BUFFER_MINUTES
+
+
+class _RemoteSeries:
+    def __init__(self):
+        self.pending: t.Deque[t.Tuple[int, float]] = deque(maxlen=MAX_PENDING)
+        # Samples pushed out of `pending` by newer ones before they could be sent
+        self.dropped = 0
+
+    def append_item(self, item: t.Tuple[int, float]):
+        if len(self.pending) == MAX_PENDING:
+            self.dropped += 1
+        self.pending.append(item)
+
+
+class RemotePlotter:
+    def __init__(
+        self, n_derivates=1, blit=False, fps=25, max_points=DEFAULT_MAX_POINTS
+    ):
+        self.fps = fps
+        self.plotter_args = dict(
+            n_derivates=n_derivates, blit=blit, fps=fps, max_points=max_points
+        )
+        self.series: t.Dict[str, _RemoteSeries] = {}
+        self.vertical_lines: t.Deque[t.Tuple[int, str]] = deque(maxlen=MAX_PENDING)
+        self.min_x: t.Optional[int] = None
+        self.sent = 0
+        self.acknowledged = 0
+        # What the child had plotted when it was stopped
+        self.summary: t.Optional[dict] = None
+        context = multiprocessing.get_context("spawn")
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=_plot_in_child,
+            args=(child_connection, self.plotter_args),
+            name="dino plotter",
+            daemon=True,
+        )
+
+    def start(self) -> "RemotePlotter":
+        self.process.start()
+        return self
+
+    @property
+    def is_open(self) -> bool:
+        return self.process.is_alive()
+
+    def get_differentiable_series(self, key: str) -> _RemoteSeries:
+        return self.series.setdefault(key, _RemoteSeries())
+
+    def draw_vertical_line(self, x, color="red"):
+        self.vertical_lines.append((x, color))
+
+    def set_min_x(self, new):
+        self.min_x = new
+
+    @property
+    def stats(self) -> t.Dict[str, int]:
+        return {
+            "sent": self.sent,
+            "acknowledged": self.acknowledged,
+            "dropped": sum(remote.dropped for remote in self.series.values()),
+        }
+
+    def flush(self) -> bool:
+        """Send whatever has been collected, unless the child is too far behind. Never blocks on the child"""
+        while self.connection.poll():
+            self.connection.recv()
+            self.acknowledged += 1
+        if self.sent - self.acknowledged >= MAX_IN_FLIGHT:
+            return False
+        series = {}
+        for key, remote in self.series.items():
+            if remote.pending:
+                items = remote.pending
+                series[key] = (
+                    np.fromiter((ts for ts, _ in items), np.int64, len(items)),
+                    np.fromiter((y for _, y in items), np.float64, len(items)),
+                )
+                items.clear()
+        if not series and not self.vertical_lines and self.min_x is None:
+            return True
+        self.connection.send((series, list(self.vertical_lines), self.min_x))
+        self.vertical_lines.clear()
+        self.min_x = None
+        self.sent += 1
+        return True
+
+    async def forward_forever(self):
+        """Send the child what's new once a frame, until its window is closed"""
+        while self.is_open:
+            self.flush()
+            await asyncio.sleep(1 / self.fps)
+
+    def stop(self, timeout=5.0):
+        if self.is_open:
+            try:
+                self.connection.send(None)
+                # Everything before the stop message gets acknowledged first
+                while True:
+                    if not self.connection.poll(timeout):
+                        break
+                    reply = self.connection.recv()
+                    if isinstance(reply, dict):
+                        self.summary = reply
+                        break
+                    self.acknowledged += 1
+            except (BrokenPipeError, EOFError, OSError):
+                pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.connection.close()
+
+
+def _plot_in_child(connection, plotter_args: dict):
+    # Ctrl+C in the terminal reaches us too; let the parent decide when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_child(connection, plotter_args))
+
+
+async def _child(connection, plotter_args: dict):
+    from dino.plot import Plotter
+    from dino.runtime import plot_forever
+
+    plotter = Plotter(**plotter_args)
+    plot = asyncio.create_task(plot_forever(plotter))
+    try:
+        while not plot.done():
+            while connection.poll():
+                message = connection.recv()
+                if message is None:
+                    connection.send(
+                        {
+                            "series": {
+                                key: len(buffer)
+                                for key, buffer in plotter.series.items()
+                            },
+                            "vertical_lines": len(plotter.vertical_lines),
+                        }
+                    )
+                    return
+                series, vertical_lines, min_x = message
+                for key, (timestamps, values) in series.items():
+                    buffer = plotter.get_differentiable_series(key)
+                    for ts, y in zip(timestamps.tolist(), values.tolist()):
+                        buffer.append(ts, y)
+                for x, color in vertical_lines:
+                    plotter.draw_vertical_line(x, color)
+                if min_x is not None:
+                    plotter.set_min_x(min_x)
+                connection.send(True)
+            await asyncio.sleep(1 / plotter.fps)
+    except (EOFError, BrokenPipeError):
+        # The parent went away
+        pass
+    finally:
+        plot.cancel()
+        plotter.stop()
+
+
+class TestRemotePlotter(unittest.TestCase):
+    def test_forwards_batches_and_lines(self):
+        from dino.pipeline import DinoPipeline, connect_plotter
+        from dino.replay import load_trace
+        from dino.socket_rpc import NullSender
+
+        timestamps, force = load_trace("eric.txt")
+
+        # No window: the child inherits the environment when it's spawned
+        with mock.patch.dict(os.environ, {"MPLBACKEND": "Agg"}):
+            plotter = RemotePlotter(fps=50).start()
+        pipeline = DinoPipeline(NullSender, plotter.draw_vertical_line)
+        connect_plotter(pipeline, plotter)
+        jumps = []
+        pipeline.event_listeners.append(
+            lambda ts, name: jumps.append(ts) if name == "positive_large" else None
+        )
+
+        async def session():
+            forward = asyncio.create_task(plotter.forward_forever())
+            for start in range(0, len(timestamps), 100):
+                pipeline.process(
+                    timestamps[start : start + 100], force[start : start + 100]
+                )
+                await asyncio.sleep(0.01)
+            while plotter.sent == 0 or plotter.acknowledged < plotter.sent:
+                await asyncio.sleep(0.02)
+            plotter.flush()
+            forward.cancel()
+
+        try:
+            asyncio.run(asyncio.wait_for(session(), 60))
+        finally:
+            plotter.stop()
+        self.assertFalse(plotter.is_open)
+        self.assertEqual(plotter.summary["series"]["Force"], len(timestamps))
+        self.assertEqual(plotter.summary["vertical_lines"], len(jumps))
+
+    def test_pending_is_bounded(self):
+        plotter = RemotePlotter()
+        # As if the child had fallen behind, so nothing gets sent
+        plotter.sent = MAX_IN_FLIGHT
+        series = plotter.get_differentiable_series("Force")
+        for ts in range(MAX_PENDING + 10):
+            series.append_item((ts, 0.0))
+            plotter.draw_vertical_line(ts)
+        try:
+            self.assertFalse(plotter.flush())
+        finally:
+            plotter.connection.close()
+        self.assertEqual(len(series.pending), MAX_PENDING)
+        self.assertEqual(series.pending[0], (10, 0.0))
+        self.assertEqual(len(plotter.vertical_lines), MAX_PENDING)
+        self.assertEqual(plotter.stats["dropped"], 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,237 @@
+"""Compact binary recordings of scale samples.
+
+A recording is a fixed 64-byte little-endian header followed by fixed-width records of `<i8` timestamp (ms) and `<f8`
+value, so it can be memory-mapped and handed out as arrays without parsing anything.
+
+    python -m dino.recording data/*.txt
+"""
+
+import argparse
+import math
+import struct
+import tempfile
+import typing as t
+import unittest
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+
+from dino.buffer import Buffer
+from dino.openscale_serial.openscale_reader import SAMPLES_PER_SEC
+
+MAGIC = b"DINOREC\0"
+VERSION = 1
+SUFFIX = ".dinorec"
+
+# magic, version, header size, sample rate, tare (NaN if unknown), units
+_HEADER = struct.Struct("<8sHHfd16s")
+HEADER_SIZE = 64
+
+RECORD = np.dtype([("ts", "<i8"), ("value", "<f8")])
+
+
+@dataclass
+class Header:
+    sample_rate: float = SAMPLES_PER_SEC
+    units: str = "lbs"
+    tare: t.Optional[float] = None
+
+    def pack(self) -> bytes:
+        packed = _HEADER.pack(
+            MAGIC,
+            VERSION,
+            HEADER_SIZE,
+            self.sample_rate,
+            math.nan if self.tare is None else self.tare,
+            self.units.encode("ascii"),
+        )
+        return packed.ljust(HEADER_SIZE, b"\0")
+
+    @classmethod
+    def unpack(cls, raw: bytes, name="recording") -> "Header":
+        """The header at the start of `raw`, which came from the file `name` (for errors)"""
+        if len(raw) < HEADER_SIZE:
+            raise ValueError(
+                f"{name} is too short for a recording header ({len(raw)} of {HEADER_SIZE} bytes)"
+            )
+        magic, version, header_size, sample_rate, tare, units = _HEADER.unpack_from(raw)
+        if magic != MAGIC:
+            raise ValueError(f"{name} is not a dino recording")
+        if version != VERSION or header_size != HEADER_SIZE:
+            raise ValueError(f"{name} has unsupported recording version {version}")
+        return cls(
+            sample_rate=sample_rate,
+            units=units.rstrip(b"\0").decode("ascii"),
+            tare=None if math.isnan(tare) else tare,
+        )
+
+
+class RecordingWriter:
+    """Append samples to a recording, a chunk of records at a time"""
+
+    def __init__(self, file: t.BinaryIO, header: Header = None, chunk_size=1024):
+        self.file = file
+        self.header = header or Header()
+        self.file.write(self.header.pack())
+        self._chunk = np.empty(chunk_size, dtype=RECORD)
+        self._pending = 0
+
+    def attach(self, buffer: Buffer) -> "RecordingWriter":
+        """Record every sample appended to `buffer` from now on"""
+        buffer.register_callback(partial(Buffer.call_with_last_item, self.write_item))
+        return self
+
+    def write_item(self, item: t.Tuple[int, float]):
+        self._chunk[self._pending] = item
+        self._pending += 1
+        if self._pending == len(self._chunk):
+            self.flush()
+
+    def write_batch(self, timestamps: np.ndarray, values: np.ndarray):
+        self.flush()
+        records = np.empty(len(timestamps), dtype=RECORD)
+        records["ts"] = timestamps
+        records["value"] = values
+        self.file.write(records.tobytes())
+
+    def set_tare(self, tare: float):
+        # Written back into the header when the recording is closed
+        self.header.tare = tare
+
+    def flush(self):
+        if self._pending:
+            self.file.write(self._chunk[: self._pending].tobytes())
+            self._pending = 0
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        if self.file.seekable():
+            self.file.seek(0)
+            self.file.write(self.header.pack())
+        self.file.close()
+
+
+class Recording:
+    """A memory-mapped recording. `timestamps` and `values` are zero-copy views of the file"""
+
+    def __init__(self, path: t.Union[str, Path]):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self.header = Header.unpack(f.read(HEADER_SIZE), self.path)
+        # Ignore a partially written trailing record
+        count = (self.path.stat().st_size - HEADER_SIZE) // RECORD.itemsize
+        self.records = (
+            np.memmap(
+                self.path, dtype=RECORD, mode="r", offset=HEADER_SIZE, shape=(count,)
+            )
+            if count
+            else np.empty(0, dtype=RECORD)
+        )
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self.records["ts"]
+
+    @property
+    def values(self) -> np.ndarray:
+        return self.records["value"]
+
+    def __len__(self):
+        return len(self.records)
+
+    def close(self):
+        self.records = np.empty(0, dtype=RECORD)
+
+
+def is_recording(path: t.Union[str, Path]) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def load_text(file: t.TextIO) -> t.Tuple[np.ndarray, np.ndarray]:
+    """Parse a `Buffer.dump` text file into timestamp and value arrays in one pass"""
+    text = file.read().translate(str.maketrans("(),", "   "))
+    pairs = np.array(text.split(), dtype=np.float64).reshape(-1, 2)
+    return pairs[:, 0].astype(np.int64), pairs[:, 1].copy()
+
+
+def load_samples(path: t.Union[str, Path]) -> t.Tuple[np.ndarray, np.ndarray]:
+    """Timestamps and values from a recording, a text dump or the raw force of the latest run of a recorded session
+    (a directory)"""
+    if Path(path).is_dir():
+        from dino.session import SessionReader
+
+        return SessionReader(path).range("force")
+    if is_recording(path):
+        recording = Recording(path)
+        return recording.timestamps, recording.values
+    with open(path, "r") as f:
+        return load_text(f)
+
+
+def convert(source: t.Union[str, Path], destination: t.Union[str, Path] = None) -> Path:
+    """Convert a `Buffer.dump` text file into a recording next to it"""
+    source = Path(source)
+    destination = Path(destination or source.with_suffix(SUFFIX))
+    with open(source, "r") as f:
+        timestamps, values = load_text(f)
+    writer = RecordingWriter(open(destination, "wb"))
+    writer.write_batch(timestamps, values)
+    writer.close()
+    return destination
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert text dumps into binary recordings"
+    )
+    parser.add_argument("sources", type=Path, nargs="+", help="Text dumps to convert")
+    args = parser.parse_args()
+
+    for source in args.sources:
+        destination = convert(source)
+        print(source, "->", destination)
+
+
+class TestRecording(unittest.TestCase):
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = Path(d) / f"trace{SUFFIX}"
+            writer = RecordingWriter(open(path, "wb"), chunk_size=3)
+            for i in range(10):
+                writer.write_item((i * 50, i / 4))
+            writer.set_tare(-4.1)
+            writer.close()
+
+            recording = Recording(path)
+            self.assertEqual(recording.header.tare, -4.1)
+            self.assertEqual(recording.header.units, "lbs")
+            self.assertEqual(recording.timestamps.tolist(), [i * 50 for i in range(10)])
+            self.assertEqual(recording.values.tolist(), [i / 4 for i in range(10)])
+            recording.close()
+
+            # Cut off inside the header, or never written at all
+            for size in (HEADER_SIZE - 1, 0):
+                path.write_bytes(path.read_bytes()[:size])
+                with self.subTest(size=size), self.assertRaisesRegex(
+                    ValueError, path.name
+                ):
+                    Recording(path)
+
+    def test_convert(self):
+        source = Path(__file__).parent.parent / "data" / "eric.txt"
+        with tempfile.TemporaryDirectory() as d:
+            destination = convert(source, Path(d) / f"eric{SUFFIX}")
+            timestamps, values = load_samples(destination)
+            with open(source) as f:
+                expected_timestamps, expected_values = load_text(f)
+            np.testing.assert_array_equal(timestamps, expected_timestamps)
+            np.testing.assert_array_equal(values, expected_values)
+            del timestamps, values
+
+
+if __name__ == "__main__":
+    main()
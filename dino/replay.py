@@ -0,0 +1,279 @@
+"""Replay a whole recorded trace at once.
+
+`replay` reproduces what the live pipeline in `dino.__main__` (buffer -> physics -> pattern matchers) would do with a
+trace, but as a handful of vectorized passes over NumPy arrays instead of one Python callback chain per sample.
+`replay_streaming` runs the same trace through the real streaming objects without sleeping, and is the reference
+`replay` is tested against.
+"""
+import typing as t
+import unittest
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+
+from dino.buffer import Buffer
+from dino.integrator import Integrator
+from dino.openscale_serial.openscale_reader import SAMPLES_PER_SEC
+from dino.pattern_matching import PatternMatcher
+from dino.pattern_matching.defaults import (
+    DEFAULT_PARAMS,
+    DetectorParams,
+    VELOCITY_EVENTS,
+    VELOCITY_MESSAGES,
+    register_default_patterns,
+    steady_force_pattern,
+    velocity_patterns,
+)
+from dino.pattern_matching.patterns import compare_batch
+from dino.physics import STEADY_STD, PhysicsSolver
+from dino.recording import load_samples
+from dino.rolling import rolling
+from dino.state_machine.state_machine import event_codes
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+
+
+def load_trace(name: str) -> t.Tuple[np.ndarray, np.ndarray]:
+    """Timestamps and force of one of the traces in `DATA_DIR`, for tests"""
+    return load_samples(DATA_DIR / name)
+
+
+@dataclass
+class ReplayResult:
+    timestamps: np.ndarray
+    force: np.ndarray
+    # Samples at which the force pattern fired and the physics recalibrated
+    calibrations: np.ndarray
+    velocity_timestamps: np.ndarray
+    velocity: np.ndarray
+    position: np.ndarray
+    # Velocity pattern matches, in the order the live pipeline would have fired them
+    event_timestamps: np.ndarray
+    # Index into `event_names`
+    event_kinds: np.ndarray
+    event_names: t.List[str]
+
+    @property
+    def events(self) -> t.List[t.Tuple[int, str]]:
+        """(timestamp, velocity pattern name) pairs"""
+        return [
+            (ts, self.event_names[kind])
+            for ts, kind in zip(
+                self.event_timestamps.tolist(), self.event_kinds.tolist()
+            )
+        ]
+
+    @property
+    def messages(self) -> t.List[t.Tuple[int, bytes]]:
+        """The events as the (timestamp, message) pairs `SocketSender` would have sent"""
+        return [(ts, VELOCITY_MESSAGES[name]) for ts, name in self.events]
+
+    @property
+    def velocity_events(self) -> np.ndarray:
+        """The events as the codes `DinoStateMachine.feed` takes"""
+        codes = event_codes(VELOCITY_EVENTS[name] for name in self.event_names)
+        return codes[self.event_kinds]
+
+
+def match_batch(
+    pattern: t.Tuple, values: np.ndarray, last_values: np.ndarray = None
+) -> np.ndarray:
+    """Which samples of `values` a `PatternMatcher` would fire `pattern` on, as a boolean mask.
+
+    `last_values` is what each sample was when it was appended, if it was later amended in place; the newest pair of
+    each window is compared against it, and every older pair against the amended `values`.
+    """
+    fired = np.zeros(len(values), dtype=bool)
+    length = len(pattern)
+    n_pairs = len(values) - 1
+    if n_pairs < length:
+        return fired
+    if last_values is None:
+        last_values = values
+
+    outcomes = {}
+    window = np.ones(n_pairs - length + 1, dtype=bool)
+    for j, comparator in enumerate(pattern[:-1]):
+        if comparator not in outcomes:
+            outcomes[comparator] = compare_batch(comparator, values[1:], values[:-1])
+        window &= outcomes[comparator][j : n_pairs - length + 1 + j]
+    window &= compare_batch(pattern[-1], last_values[length:], values[length - 1 : -1])
+
+    fired[length:] = window
+    return fired
+
+
+def replay(
+    timestamps: np.ndarray,
+    force: np.ndarray,
+    force_pattern: t.Tuple = None,
+    patterns: t.Dict[str, t.Tuple] = None,
+    leak_tau: t.Optional[float] = None,
+    params: DetectorParams = DEFAULT_PARAMS,
+) -> ReplayResult:
+    """Run tare calibration, integration and pattern detection over a whole trace.
+
+    Defaults to the patterns from `register_default_patterns` with `params`. Raises the same `RuntimeError` as
+    `PhysicsSolver.calibrate_steady_state` if the trace starts out loaded.
+    """
+    force_pattern = force_pattern or steady_force_pattern()
+    patterns = patterns or velocity_patterns(params)
+    n = len(force)
+
+    # Tare: the force pattern only looks at the raw force, so every calibration point is known up front
+    calibrations = np.flatnonzero(match_batch(force_pattern, force))
+    # The same running means and variances `last_second_average` and `load` read, so the tare comes out identical
+    means, variances = rolling(force, SAMPLES_PER_SEC)
+    averages = means[calibrations]
+
+    if len(calibrations) and abs(averages[0]) > params.tare_threshold:
+        raise RuntimeError(
+            f"Scale hasn't been tared, but we're reading {averages[0]} lbs on average"
+        )
+    # The first calibration always sets the tare; after that, light readings end a loaded stretch, and re-tare if
+    # the last second was steady too
+    is_light = np.abs(averages) < params.tare_threshold
+    is_light[:1] = True
+    is_tare = (
+        is_light
+        & (calibrations >= SAMPLES_PER_SEC - 1)
+        & (variances[calibrations] <= STEADY_STD**2)
+    )
+    is_tare[:1] = True
+    last_tare = np.maximum.accumulate(
+        np.where(is_tare, np.arange(len(calibrations)), 0)
+    )
+    tare_weight = averages[last_tare]
+    steady_weight = np.where(is_light, np.nan, averages - tare_weight)
+
+    # Each sample is integrated with the calibration from before it, since physics runs before the force matcher
+    is_calibration = np.zeros(n, dtype=np.int64)
+    is_calibration[calibrations] = 1
+    since = np.cumsum(is_calibration) - is_calibration - 1
+    calibrated = since >= 0
+    sample_steady = np.where(
+        calibrated, steady_weight[np.maximum(since, 0)], np.nan
+    )
+    sample_tare = np.where(calibrated, tare_weight[np.maximum(since, 0)], 0.0)
+    integrated = np.flatnonzero(~np.isnan(sample_steady))
+
+    # Integrate, starting from rest at the beginning of every loaded stretch (re-taring resets the integrator), and
+    # zeroing whichever velocity sample was newest whenever a calibration fired
+    v_ts = timestamps[integrated]
+    deviation = (force[integrated] - sample_tare[integrated]) - sample_steady[
+        integrated
+    ]
+    starts = np.flatnonzero(np.diff(integrated, prepend=-2) != 1)
+    amended = np.searchsorted(integrated, calibrations, side="right") - 1
+    amended = amended[amended >= 0]
+    amended = amended[np.diff(amended, prepend=-1) != 0]
+    velocity_at_append, velocity, position = Integrator(leak_tau).integrate(
+        v_ts, deviation, starts, amended
+    )
+
+    fired = {
+        name: match_batch(pattern, velocity, velocity_at_append)
+        for name, pattern in patterns.items()
+    }
+    # Within a sample, patterns fire in registration order
+    names = list(fired)
+    rows, kinds = np.nonzero(
+        np.stack([fired[name] for name in names], axis=1)
+        if names
+        else np.zeros((len(v_ts), 0), dtype=bool)
+    )
+
+    return ReplayResult(
+        timestamps=timestamps,
+        force=force,
+        calibrations=calibrations,
+        velocity_timestamps=v_ts,
+        velocity=velocity,
+        position=position,
+        event_timestamps=v_ts[rows],
+        event_kinds=kinds,
+        event_names=names,
+    )
+
+
+def replay_streaming(
+    timestamps: t.Iterable[int],
+    force: t.Iterable[float],
+    leak_tau: t.Optional[float] = None,
+    params: DetectorParams = DEFAULT_PARAMS,
+) -> t.List[t.Tuple[int, bytes]]:
+    """Feed a trace through the live objects, without sleeping, and collect the messages they'd send"""
+    buffer = Buffer()
+    physics = PhysicsSolver(
+        buffer, leak_tau=leak_tau, tare_threshold=params.tare_threshold
+    )
+    force_matcher, velocity_matcher = PatternMatcher(), PatternMatcher()
+    messages = []
+
+    class _Recorder:
+        @staticmethod
+        def send(message):
+            messages.append((buffer.last_item[0], message))
+
+    register_default_patterns(
+        force_matcher,
+        physics,
+        velocity_matcher,
+        lambda _color: None,
+        _Recorder,
+        params,
+    )
+    buffer.register_callback(
+        partial(Buffer.call_with_last_item, force_matcher.receive_item)
+    )
+    physics.velocity.register_callback(
+        partial(Buffer.call_with_last_item, velocity_matcher.receive_item)
+    )
+    physics.velocity.register_amend_callback(
+        partial(Buffer.call_with_last_item, velocity_matcher.amend_last_item)
+    )
+
+    for ts, y in zip(timestamps, force):
+        buffer.append(int(ts), float(y))
+    return messages
+
+
+class TestReplay(unittest.TestCase):
+    def test_matches_streaming(self):
+        for trace in ("eric.txt", "michelle.txt"):
+            with self.subTest(trace=trace):
+                timestamps, force = load_trace(trace)
+                for leak_tau in (None, 2.0):
+                    expected = replay_streaming(timestamps, force, leak_tau)
+                    self.assertTrue(expected)
+                    self.assertEqual(
+                        replay(timestamps, force, leak_tau=leak_tau).messages,
+                        expected,
+                    )
+
+    def test_params(self):
+        timestamps, force = load_trace("michelle.txt")
+        params = DetectorParams(
+            stable_thresh=2.5, steady_samples=3, jump_increase_threshold=3
+        )
+        expected = replay_streaming(timestamps, force, params=params)
+        self.assertNotEqual(expected, replay_streaming(timestamps, force))
+        self.assertEqual(replay(timestamps, force, params=params).messages, expected)
+        with self.assertRaises(RuntimeError):
+            replay(timestamps, force, params=DetectorParams(tare_threshold=1))
+
+    def test_loaded_at_start(self):
+        timestamps, force = load_trace("eric2.txt")
+        with self.assertRaises(RuntimeError):
+            replay(timestamps, force)
+
+    def test_match_batch(self):
+        values = np.array([0, 10, 20, 30, 40, 30, 20, 20], dtype=np.float64)
+        fired = match_batch((np.greater, np.greater, np.less), values)
+        self.assertEqual(np.flatnonzero(fired).tolist(), [5])
+
+
+if __name__ == "__main__":
+    unittest.main()
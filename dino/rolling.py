@@ -0,0 +1,149 @@
+"""Statistics over the last `window` samples, updated in O(1) per sample instead of rescanning the window."""
+
+import typing as t
+import unittest
+from collections import deque
+from functools import partial
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from dino.buffer import Buffer
+
+
+class RollingStats:
+    """Mean, variance, min and max of the most recent `window` values.
+
+    Mean and variance come from running sums of the values' offsets from the first value seen, which keeps the
+    sum of squares small (and the variance accurate) however heavy the scale is. Min and max come from monotonic
+    queues, so each is amortized O(1) too. `rolling` computes the same means and variances over a whole trace at once.
+    """
+
+    def __init__(self, window: int):
+        self.window = window
+        self.clear()
+
+    def clear(self):
+        self.count = 0
+        self._reference: t.Optional[float] = None
+        # Offsets from the reference of the values currently in the window, oldest first
+        self._offsets = [0.0] * self.window
+        self._next = 0
+        self._sum = 0.0
+        self._sum_sq = 0.0
+        self._index = 0
+        # (index, value) candidates for the min/max, values increasing/decreasing from the front
+        self._min: t.Deque[t.Tuple[int, float]] = deque()
+        self._max: t.Deque[t.Tuple[int, float]] = deque()
+
+    def attach(self, buffer: Buffer) -> "RollingStats":
+        """Keep up with everything appended to `buffer` from now on"""
+        buffer.register_callback(partial(Buffer.call_with_last_item, self.receive_item))
+        return self
+
+    def receive_item(self, last_item: t.Tuple[int, float]):
+        self.append(last_item[1])
+
+    def append(self, value: float):
+        if self._reference is None:
+            self._reference = value
+        offset = value - self._reference
+        old = self._offsets[self._next] if self.count == self.window else 0.0
+        self._offsets[self._next] = offset
+        self._next = (self._next + 1) % self.window
+        self.count = min(self.count + 1, self.window)
+        self._sum += offset - old
+        self._sum_sq += offset * offset - old * old
+
+        index, self._index = self._index, self._index + 1
+        for queue, beaten in ((self._min, value.__le__), (self._max, value.__ge__)):
+            while queue and beaten(queue[-1][1]):
+                queue.pop()
+            queue.append((index, value))
+            if queue[0][0] <= index - self.window:
+                queue.popleft()
+
+    @property
+    def is_full(self) -> bool:
+        return self.count == self.window
+
+    @property
+    def mean(self) -> float:
+        if not self.count:
+            return 0.0
+        return self._reference + self._sum / self.count
+
+    @property
+    def variance(self) -> float:
+        """Population variance"""
+        if not self.count:
+            return 0.0
+        mean_offset = self._sum / self.count
+        return max(self._sum_sq / self.count - mean_offset * mean_offset, 0.0)
+
+    @property
+    def std(self) -> float:
+        return self.variance**0.5
+
+    @property
+    def min(self) -> t.Optional[float]:
+        return self._min[0][1] if self._min else None
+
+    @property
+    def max(self) -> t.Optional[float]:
+        return self._max[0][1] if self._max else None
+
+
+def rolling(values: np.ndarray, window: int) -> t.Tuple[np.ndarray, np.ndarray]:
+    """The `RollingStats` mean and variance after each of `values` is appended, bit-for-bit"""
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return np.zeros(0), np.zeros(0)
+    offsets = values - values[0]
+    old = np.zeros(len(values))
+    old[window:] = offsets[:-window]
+    # np.cumsum adds strictly left to right, just like the running sums
+    sums = np.cumsum(offsets - old)
+    sums_sq = np.cumsum(offsets * offsets - old * old)
+    counts = np.minimum(np.arange(1, len(values) + 1), window)
+    mean_offsets = sums / counts
+    mean = values[0] + mean_offsets
+    variance = np.maximum(sums_sq / counts - mean_offsets * mean_offsets, 0.0)
+    return mean, variance
+
+
+def rolling_min_max(values: np.ndarray, window: int) -> t.Tuple[np.ndarray, np.ndarray]:
+    """The `RollingStats` min and max after each of `values` is appended"""
+    padded = np.concatenate((np.full(window - 1, np.nan), values))
+    windows = sliding_window_view(padded, window)
+    return np.nanmin(windows, axis=1), np.nanmax(windows, axis=1)
+
+
+class TestRollingStats(unittest.TestCase):
+    def test_matches_recomputing(self):
+        rng = np.random.default_rng(0)
+        values = np.concatenate((rng.normal(-4, 0.01, 100), rng.normal(150, 0.5, 300)))
+        stats = RollingStats(20)
+        mean, variance = rolling(values, 20)
+        low, high = rolling_min_max(values, 20)
+        for i, value in enumerate(values.tolist()):
+            stats.append(value)
+            window = values[max(0, i - 19) : i + 1]
+            self.assertAlmostEqual(stats.mean, window.mean(), places=9)
+            self.assertAlmostEqual(stats.variance, window.var(), places=9)
+            self.assertEqual((stats.min, stats.max), (window.min(), window.max()))
+            self.assertEqual((stats.mean, stats.variance), (mean[i], variance[i]))
+            self.assertEqual((stats.min, stats.max), (low[i], high[i]))
+
+    def test_attach(self):
+        buffer = Buffer()
+        stats = RollingStats(3).attach(buffer)
+        for i, value in enumerate([1.0, 2.0, 3.0, 10.0]):
+            buffer.append(i, value)
+        self.assertTrue(stats.is_full)
+        self.assertEqual(stats.mean, 5.0)
+        self.assertEqual((stats.min, stats.max), (2.0, 10.0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,404 @@
+"""Single-threaded asyncio runtime.
+
+One event loop reads the scale (or a recording), runs the pipeline, sends events to the game and, optionally, redraws
+the plot. Nothing is shared between threads, samples are processed in the order the loop schedules them, and stopping
+is just cancelling the tasks.
+"""
+
+import asyncio
+import logging
+import os
+import signal
+import typing as t
+import unittest
+from time import monotonic
+
+import numpy as np
+from serial import serial_for_url
+
+from dino.openscale_serial.ingest import LATE_AFTER, SampleQueue
+from dino.openscale_serial.openscale_reader import (
+    DEFAULT_BAUD,
+    DEFAULT_PORT,
+    OpenScaleReader,
+)
+from dino.pipeline import Pipeline
+from dino.plot_process import RemotePlotter
+from dino.socket_rpc import AsyncUDPSender
+
+logger = logging.getLogger(__name__)
+
+# (timestamps, values, read times) as handed to `Pipeline.process`
+SampleBatch = t.Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+class SerialSource:
+    """Batches of readings from the OpenScale, read without blocking the event loop.
+
+    A reader task parses readings off the port into a bounded `SampleQueue` as they arrive, and `batches` hands them
+    on as fast as the consumer takes them. When the consumer falls behind, readings wait in the queue (and are counted
+    late once they've waited `late_after`), and what doesn't fit is dropped rather than holding up the port.
+    """
+
+    def __init__(
+        self,
+        port=DEFAULT_PORT,
+        baud=DEFAULT_BAUD,
+        limit=None,
+        capacity=4096,
+        late_after=LATE_AFTER,
+        max_batch=256,
+    ):
+        self.port = port
+        self.baud = baud
+        self.limit = limit
+        self.lines = 0
+        self.max_batch = max_batch
+        # Set to a `LatencyRecorder` to time how long parsing takes after the bytes arrive
+        self.latency = None
+        self.queue = SampleQueue(capacity, late_after)
+        self._read_time = 0.0
+        self.reader = OpenScaleReader(
+            batch_callback=lambda ts, weights: self.queue.put_batch(
+                ts, weights, self._read_time
+            )
+        )
+
+    async def batches(self) -> t.AsyncIterator[SampleBatch]:
+        available = asyncio.Event()
+        reader = asyncio.create_task(
+            self._read_forever(available), name=f"read {self.port}"
+        )
+        try:
+            while True:
+                if len(self.queue):
+                    yield self.queue.drain(self.max_batch)
+                elif reader.done():
+                    # Surface errors from the port once everything read before them has been handed on
+                    reader.result()
+                    return
+                else:
+                    available.clear()
+                    await available.wait()
+        finally:
+            reader.cancel()
+            await asyncio.gather(reader, return_exceptions=True)
+
+    async def _read_forever(self, available: asyncio.Event):
+        """Read and parse into the queue until `limit` lines, setting `available` whenever readings are queued"""
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        try:
+            with serial_for_url(self.port, self.baud, timeout=0) as ser:
+                try:
+                    fd = ser.fileno()
+                    loop.add_reader(fd, ready.set)
+                except (AttributeError, NotImplementedError):
+                    # Not a file descriptor (eg on Windows, or a loop:// URL): poll on a worker thread instead
+                    fd = None
+                    ser.timeout = 0.1
+                try:
+                    while self.limit is None or self.lines <= self.limit:
+                        if fd is not None:
+                            await ready.wait()
+                            ready.clear()
+                            chunk = ser.read(ser.in_waiting or 1)
+                        else:
+                            chunk = await asyncio.to_thread(
+                                lambda: ser.read(ser.in_waiting or 1)
+                            )
+                        if not chunk:
+                            continue
+                        self._read_time = monotonic()
+                        readings = self.reader.readings
+                        self.lines += self.reader.feed(chunk)
+                        if self.latency is not None:
+                            self.latency.record(
+                                "parse",
+                                self._read_time,
+                                self.reader.readings - readings,
+                            )
+                        available.set()
+                finally:
+                    if fd is not None:
+                        loop.remove_reader(fd)
+        finally:
+            # Wake `batches` to finish up, or to raise whatever stopped us
+            available.set()
+
+    @property
+    def stats(self) -> t.Dict[str, int]:
+        return {
+            "lines": self.lines,
+            "malformed": self.reader.malformed,
+            "queued": len(self.queue),
+            "dropped": self.queue.dropped,
+            "late": self.queue.late,
+        }
+
+
+class SimulatedSource:
+    """Batches from a recorded trace, released on the schedule the scale originally produced them.
+
+    `speed` scales time (0 replays as fast as possible). Each sample's read time is the moment it was due, so latency
+    measurements include any scheduling jitter.
+    """
+
+    def __init__(self, timestamps, values, speed=1.0, max_batch=256):
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.speed = speed
+        self.max_batch = max_batch
+
+    async def batches(self) -> t.AsyncIterator[SampleBatch]:
+        timestamps, n = self.timestamps, len(self.timestamps)
+        if not n:
+            return
+        start = monotonic()
+        # Sample times in seconds from the start of the replay
+        offsets = (timestamps - timestamps[0]) / 1000 / (self.speed or np.inf)
+        i = 0
+        while i < n:
+            delay = start + offsets[i] - monotonic()
+            # Always yield to the loop, even when running behind
+            await asyncio.sleep(max(delay, 0))
+            due = int(np.searchsorted(offsets, monotonic() - start, side="right"))
+            end = min(max(due, i + 1), i + self.max_batch, n)
+            yield timestamps[i:end], self.values[i:end], start + offsets[i:end]
+            i = end
+
+
+async def consume(source, pipeline: Pipeline):
+    async for timestamps, values, read_times in source.batches():
+        pipeline.process(timestamps, values, read_times)
+        # Give every other feed a turn between batches, so one busy scale can't hold up the rest
+        await asyncio.sleep(0)
+
+
+async def plot_forever(plotter):
+    """Redraw until the window is closed. Blitted plots update every frame; full redraws stay at once a second"""
+    import matplotlib.pyplot as plt
+
+    plt.show(block=False)
+    redraw_every = 1 if plotter.blit else plotter.fps
+    frame = 0
+    while plotter.is_open:
+        if frame % redraw_every == 0:
+            plotter.draw_frame()
+        plotter.figure.canvas.flush_events()
+        frame += 1
+        await asyncio.sleep(1 / plotter.fps)
+
+
+async def run(source, pipeline: Pipeline, plotter=None, sender: AsyncUDPSender = None):
+    """Feed `source` through `pipeline` until the source runs dry or, when plotting, the window is closed.
+
+    Errors from the pipeline (eg the scale not having been tared) propagate; cancelling this coroutine, or SIGTERM,
+    stops everything cleanly.
+    """
+    await run_all([(source, pipeline)], plotter, sender, propagate=True)
+
+
+async def run_all(
+    feeds: t.Sequence[t.Tuple[t.Any, Pipeline]],
+    plotter=None,
+    sender: AsyncUDPSender = None,
+    propagate=False,
+) -> t.Dict[int, BaseException]:
+    """`run` for several independent (source, pipeline) feeds at once, each consumed by its own task.
+
+    A feed that fails (eg an untared scale, or an unplugged serial port) is logged and left stopped while the others
+    carry on, unless `propagate` is set. Returns the error each failed feed stopped with, by index into `feeds`.
+    """
+    if sender is not None:
+        await sender.start()
+    current = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, current.cancel)
+    except (AttributeError, NotImplementedError, RuntimeError):
+        # No SIGTERM handling on Windows, or when we're not on the main thread
+        pass
+
+    consumers = [
+        asyncio.create_task(consume(source, pipeline), name=f"consume {i}")
+        for i, (source, pipeline) in enumerate(feeds)
+    ]
+    tasks = list(consumers)
+    failures: t.Dict[int, BaseException] = {}
+    if isinstance(plotter, RemotePlotter):
+        tasks.append(asyncio.create_task(plotter.forward_forever(), name="plot"))
+    elif plotter is not None:
+        tasks.append(asyncio.create_task(plot_forever(plotter), name="plot"))
+    try:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task not in consumers or propagate:
+                    # Surface pipeline (or plotting) errors
+                    task.result()
+                elif not task.cancelled() and task.exception() is not None:
+                    index = consumers.index(task)
+                    failures[index] = task.exception()
+                    logger.error(
+                        "Feed %d stopped: %s",
+                        index,
+                        failures[index],
+                        exc_info=failures[index],
+                    )
+            if plotter is not None and tasks[-1] in done:
+                # Closing the window ends the session; otherwise it stays up after the sources run dry
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            loop.remove_signal_handler(signal.SIGTERM)
+        except (AttributeError, NotImplementedError, RuntimeError):
+            pass
+        if sender is not None:
+            sender.close()
+    return failures
+
+
+class TestRuntime(unittest.TestCase):
+    def test_simulated_matches_callbacks(self):
+        import socket
+
+        from dino.pipeline import DinoPipeline
+        from dino.replay import load_trace, replay_streaming
+
+        timestamps, force = load_trace("eric.txt")
+        received = []
+
+        class _Receiver(asyncio.DatagramProtocol):
+            def datagram_received(self, data, addr):
+                received.append(data)
+
+        async def session():
+            # Roomy enough that nothing is lost while the whole trace is pushed through at once
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+            sock.bind(("127.0.0.1", 0))
+            transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                _Receiver, sock=sock
+            )
+            sender = AsyncUDPSender(*transport.get_extra_info("sockname"))
+            pipeline = DinoPipeline(sender)
+            await run(
+                SimulatedSource(timestamps, force, speed=0),
+                pipeline,
+                sender=sender,
+            )
+            await asyncio.sleep(0.05)
+            transport.close()
+
+        asyncio.run(session())
+        expected = [message for _, message in replay_streaming(timestamps, force)]
+        self.assertEqual(received, expected)
+
+    def test_cancellation(self):
+        closed = []
+
+        class _Source:
+            async def batches(self):
+                try:
+                    while True:
+                        await asyncio.sleep(1)
+                        yield np.zeros(0), np.zeros(0), np.zeros(0)
+                finally:
+                    closed.append(True)
+
+        async def session():
+            task = asyncio.create_task(run(_Source(), Pipeline()))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(session())
+        self.assertEqual(closed, [True])
+
+    @unittest.skipUnless(os.name == "posix", "needs a pseudo-terminal")
+    def test_serial_source(self):
+        from dino.openscale_serial.fake_scale import FakeOpenScale
+
+        scale = FakeOpenScale()
+        source = SerialSource(port=scale.port)
+        timestamps, values = np.arange(0, 5000, 50), np.linspace(-1, 1, 100)
+
+        async def collect():
+            received = []
+            batches = source.batches()
+            # Let the source open the port before the scale starts talking
+            pending = asyncio.ensure_future(batches.__anext__())
+            await asyncio.sleep(0.05)
+            scale.play(timestamps, values)
+            received.append(await pending)
+            while sum(len(ts) for ts, _, _ in received) < len(timestamps):
+                received.append(await asyncio.wait_for(batches.__anext__(), 5))
+            await batches.aclose()
+            return received
+
+        try:
+            received = asyncio.run(collect())
+        finally:
+            scale.close()
+        self.assertEqual(
+            np.concatenate([b[0] for b in received]).tolist(), timestamps.tolist()
+        )
+        np.testing.assert_allclose(
+            np.concatenate([b[1] for b in received]), values, atol=0.005
+        )
+        self.assertEqual(source.stats["dropped"], 0)
+
+    @unittest.skipUnless(os.name == "posix", "needs a pseudo-terminal")
+    def test_serial_source_falls_behind(self):
+        from dino.openscale_serial.fake_scale import FakeOpenScale
+
+        scale = FakeOpenScale()
+        source = SerialSource(port=scale.port, capacity=40)
+        timestamps, values = np.arange(0, 5000, 50), np.zeros(100)
+
+        async def collect():
+            received = 0
+            batches = source.batches()
+            pending = asyncio.ensure_future(batches.__anext__())
+            await asyncio.sleep(0.05)
+            scale.play(timestamps[:50], values[:50])
+            received += len((await pending)[0])
+            scale.play(timestamps[50:], values[50:], splash=b"")
+            # A slow consumer: the port is still read in the meantime, into the queue until it's full
+            await asyncio.sleep(0.3)
+            while received + source.stats["dropped"] < len(timestamps):
+                received += len((await asyncio.wait_for(batches.__anext__(), 5))[0])
+            await batches.aclose()
+            return received
+
+        try:
+            received = asyncio.run(collect())
+        finally:
+            scale.close()
+        self.assertGreater(source.stats["dropped"], 0)
+        self.assertGreaterEqual(source.stats["late"], 40)
+        self.assertEqual(received + source.stats["dropped"], len(timestamps))
+
+    def test_realtime_pacing(self):
+        source = SimulatedSource(np.arange(0, 500, 50), np.zeros(10))
+
+        async def collect():
+            start = monotonic()
+            sizes = [len(ts) async for ts, _, _ in source.batches()]
+            return sizes, monotonic() - start
+
+        sizes, elapsed = asyncio.run(collect())
+        self.assertEqual(sum(sizes), 10)
+        self.assertGreaterEqual(elapsed, 0.45)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,772 @@
+"""Whole sessions on disk: every raw sample plus the velocity, position and events derived from it.
+
+A session is a directory of numbered segment files (`00000.dinoseg`, `00001.dinoseg`, ...); a new segment is started
+once the current one reaches `max_bytes` or spans `max_seconds` of samples, so no single file grows without bound.
+Each segment starts with a small header and JSON metadata, followed by blocks. A block holds up to `block_samples`
+samples of one stream, as a zlib-compressed column of timestamp steps and a column of values, behind a fixed-size
+header with the block's time range and the min, max and sum of its values, so a segment can be summarised from its
+headers alone.
+
+Every `SessionWriter.start` into a directory, and every time the scale's clock goes back (it was rebooted), begins a
+new run with its own number in the segment metadata. Runs can overlap in time, so they're read one at a time. A clock
+going back mid-batch splits the batch between the two runs.
+
+`SessionWriter.write` only copies samples into pending lists; full blocks, and any stream's partial block once it has
+waited `max_delay`, go through a bounded queue to a background thread that compresses and writes them. When that queue
+is full the pipeline either waits (the default) or drops the block, and `RecorderStats` says how often and for how
+long. Live sessions should drop: waiting holds up the event loop, and with it every player.
+
+`SessionReader` reads a session back without loading all of it: it indexes the block headers, then only decompresses
+the blocks a query touches.
+"""
+
+import json
+import queue
+import struct
+import tempfile
+import threading
+import time
+import typing as t
+import unittest
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from dino.openscale_serial.openscale_reader import SAMPLES_PER_SEC
+from dino.pattern_matching.defaults import VELOCITY_MESSAGES
+
+MAGIC = b"DINOSEG\0"
+VERSION = 1
+SUFFIX = ".dinoseg"
+
+# magic, version, length of the JSON metadata that follows
+FILE_HEADER = struct.Struct("<8sHI")
+# stream, samples, compressed size, first ts, last ts, min, max, sum, crc32 of the compressed payload
+BLOCK_HEADER = struct.Struct("<BIIqqdddI")
+
+# Stream name -> dtype of its values. Events are stored as indices into `EVENT_NAMES`
+STREAMS = {
+    "force": np.dtype("<f8"),
+    "velocity": np.dtype("<f8"),
+    "position": np.dtype("<f8"),
+    "events": np.dtype("u1"),
+}
+STREAM_NAMES = list(STREAMS)
+EVENT_NAMES = list(VELOCITY_MESSAGES)
+# Streams whose newest sample can still be changed (`zero_velocity` amends the last velocity)
+AMENDABLE = {"velocity"}
+
+
+class BlockHeader(t.NamedTuple):
+    stream: str
+    count: int
+    size: int
+    first_ts: int
+    last_ts: int
+    min: float
+    max: float
+    sum: float
+    crc: int
+    # Where the compressed payload starts in its segment
+    offset: int
+
+
+def segment_path(directory: Path, index: int) -> Path:
+    return Path(directory) / f"{index:05d}{SUFFIX}"
+
+
+def encode_block(
+    stream: str, timestamps: np.ndarray, values: np.ndarray, level=1
+) -> bytes:
+    timestamps = np.asarray(timestamps, dtype="<i8")
+    values = np.asarray(values, dtype=STREAMS[stream])
+    # Timestamps as steps from the first (in the header), which are nearly all the same and compress to almost nothing
+    steps = np.diff(timestamps, prepend=timestamps[0])
+    payload = zlib.compress(steps.tobytes() + values.tobytes(), level)
+    return (
+        BLOCK_HEADER.pack(
+            STREAM_NAMES.index(stream),
+            len(timestamps),
+            len(payload),
+            timestamps[0],
+            timestamps[-1],
+            values.min(),
+            values.max(),
+            values.sum(dtype=np.float64),
+            zlib.crc32(payload),
+        )
+        + payload
+    )
+
+
+def decode_block(
+    header: BlockHeader, payload: bytes
+) -> t.Tuple[np.ndarray, np.ndarray]:
+    if zlib.crc32(payload) != header.crc:
+        raise ValueError(f"Corrupt {header.stream} block at byte {header.offset}")
+    raw = zlib.decompress(payload)
+    split = header.count * 8
+    steps = np.frombuffer(raw, dtype="<i8", count=header.count)
+    return (
+        header.first_ts + np.cumsum(steps),
+        np.frombuffer(raw, dtype=STREAMS[header.stream], offset=split),
+    )
+
+
+def read_metadata(file: t.BinaryIO) -> dict:
+    magic, version, length = FILE_HEADER.unpack(file.read(FILE_HEADER.size))
+    if magic != MAGIC:
+        raise ValueError("Not a dino session segment")
+    if version != VERSION:
+        raise ValueError(f"Unsupported segment version {version}")
+    return json.loads(file.read(length))
+
+
+def iter_headers(file: t.BinaryIO) -> t.Iterator[BlockHeader]:
+    """The header of every complete block in a segment, skipping over the payloads. `file` must be just past the
+    metadata. A block cut short by a crash is ignored, like a partial record in a recording
+    """
+    position = file.tell()
+    end = file.seek(0, 2)
+    while position + BLOCK_HEADER.size <= end:
+        file.seek(position)
+        stream, *fields = BLOCK_HEADER.unpack(file.read(BLOCK_HEADER.size))
+        header = BlockHeader(
+            STREAM_NAMES[stream], *fields, position + BLOCK_HEADER.size
+        )
+        position = header.offset + header.size
+        if position > end:
+            return
+        yield header
+
+
+def segments_by_run(directory: t.Union[str, Path]) -> t.Dict[int, t.List[Path]]:
+    """The segments of each run recorded into `directory`, in order. Segments written before runs were numbered are
+    run 0; ones cut off before their metadata was written are skipped"""
+    runs: t.Dict[int, t.List[Path]] = {}
+    for path in sorted(Path(directory).glob(f"*{SUFFIX}")):
+        with open(path, "rb") as f:
+            try:
+                metadata = read_metadata(f)
+            except (struct.error, json.JSONDecodeError):
+                continue
+        runs.setdefault(metadata.get("run", 0), []).append(path)
+    return runs
+
+
+def run_segments(directory: t.Union[str, Path], run: int = None) -> t.List[Path]:
+    """The segments of one run in `directory`, the latest if `run` is None"""
+    runs = segments_by_run(directory)
+    if not runs:
+        raise FileNotFoundError(f"No {SUFFIX} segments in {directory}")
+    if run is None:
+        run = max(runs)
+    if run not in runs:
+        raise ValueError(f"No run {run} in {directory}; there are runs {sorted(runs)}")
+    return runs[run]
+
+
+def read_stream(
+    directory: Path, stream: str, run: int = None
+) -> t.Tuple[np.ndarray, np.ndarray]:
+    """Every sample of `stream` in one run of a session (the latest by default), in order"""
+    timestamps, values = [np.zeros(0, dtype="<i8")], [np.zeros(0, STREAMS[stream])]
+    for path in run_segments(directory, run):
+        with open(path, "rb") as f:
+            read_metadata(f)
+            for header in list(iter_headers(f)):
+                if header.stream == stream:
+                    f.seek(header.offset)
+                    ts, v = decode_block(header, f.read(header.size))
+                    timestamps.append(ts)
+                    values.append(v)
+    return np.concatenate(timestamps), np.concatenate(values)
+
+
+@dataclass
+class RecorderStats:
+    samples: int = 0
+    blocks: int = 0
+    raw_bytes: int = 0
+    compressed_bytes: int = 0
+    segments: int = 0
+    # Most blocks ever waiting for the writer thread
+    queue_high_water: int = 0
+    # Times the pipeline had to wait for room in the queue, and for how long in total
+    stalls: int = 0
+    stalled_seconds: float = 0.0
+    dropped_samples: int = 0
+
+    def __str__(self):
+        ratio = self.raw_bytes / self.compressed_bytes if self.compressed_bytes else 0
+        return (
+            f"{self.samples} samples in {self.blocks} blocks over {self.segments} segments, "
+            f"{self.compressed_bytes / 1024:.0f} kB ({ratio:.1f}x compression), "
+            f"queue high water {self.queue_high_water}, {self.stalls} stalls "
+            f"({self.stalled_seconds * 1e3:.1f} ms), {self.dropped_samples} samples dropped"
+        )
+
+
+class SessionWriter:
+    """Streams samples into rotating, compressed segment files from a background thread"""
+
+    def __init__(
+        self,
+        directory: t.Union[str, Path],
+        max_bytes=64 * 1024 * 1024,
+        max_seconds: t.Optional[float] = 3600,
+        block_samples=1024,
+        max_delay=5.0,
+        queue_blocks=64,
+        drop=False,
+        level=1,
+    ):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.block_samples = block_samples
+        # A block is written once it's full or its oldest sample has waited this long (in seconds), whichever is first
+        self.max_delay = max_delay
+        # Drop blocks rather than wait when the queue is full
+        self.drop = drop
+        self.level = level
+        self.stats = RecorderStats()
+
+        self._queue: queue.Queue = queue.Queue(queue_blocks)
+        self._pending = {stream: ([], []) for stream in STREAMS}
+        self._since: t.Dict[str, float] = {}
+        self._thread: t.Optional[threading.Thread] = None
+        self._error: t.Optional[BaseException] = None
+        self._file: t.Optional[t.BinaryIO] = None
+        self._segment = -1
+        self._segment_start: t.Optional[int] = None
+        # The run the open segment belongs to
+        self._file_run: t.Optional[int] = None
+        # The run force is being written to, and each stream's. The others are written a pipeline stage behind force,
+        # so they follow it into a new run when their own clock goes back, or at the next force at the latest
+        self.run = 0
+        self._runs = {stream: 0 for stream in STREAMS}
+        # The newest timestamp written to each stream, to notice the scale's clock going back
+        self._last_ts: t.Dict[str, int] = {}
+        self.metadata = {
+            "streams": STREAM_NAMES,
+            "events": EVENT_NAMES,
+            "sample_rate": SAMPLES_PER_SEC,
+            "units": "lbs",
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        }
+
+    def start(self) -> "SessionWriter":
+        self.directory.mkdir(parents=True, exist_ok=True)
+        existing = sorted(self.directory.glob(f"*{SUFFIX}"))
+        if existing:
+            # Carry on after an earlier run into the same directory, as a run of our own
+            self._segment = int(existing[-1].stem)
+            self.run = max(segments_by_run(self.directory), default=-1) + 1
+            self._runs = {stream: self.run for stream in STREAMS}
+        self._thread = threading.Thread(
+            target=self._write_forever, name="session-writer", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def write(self, stream: str, timestamps: t.Sequence[int], values: t.Sequence):
+        if stream == "force" and len(timestamps):
+            # Everything the other streams wrote since the last force came from samples before it
+            for other, run in self._runs.items():
+                if run < self.run:
+                    self._start_run(other, self.run)
+        start = 0
+        for end in self._run_starts(stream, timestamps):
+            self._extend(stream, timestamps[start:end], values[start:end])
+            self._start_run(stream, self.run + 1 if stream == "force" else self.run)
+            start = end
+        self._extend(stream, timestamps[start:], values[start:])
+        self._submit_stale()
+
+    def _run_starts(self, stream: str, timestamps: t.Sequence[int]) -> t.List[int]:
+        """Where in `timestamps` the clock goes back, and so a new run starts"""
+        if not len(timestamps):
+            return []
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        last = self._last_ts.get(stream, timestamps[0])
+        self._last_ts[stream] = int(timestamps[-1])
+        return np.flatnonzero(np.diff(timestamps, prepend=last) < 0).tolist()
+
+    def _extend(self, stream: str, timestamps: t.Sequence[int], values: t.Sequence):
+        if not len(timestamps):
+            return
+        pending_ts, pending_values = self._pending[stream]
+        if not pending_ts:
+            self._since[stream] = time.monotonic()
+        pending_ts.extend(timestamps)
+        pending_values.extend(values)
+        if len(pending_ts) > self.block_samples:
+            self._submit(stream)
+
+    def _submit_stale(self):
+        """Queue what every stream has pending once it has waited `max_delay`, so quiet streams (eg events) reach
+        the disk too, not just the one being written"""
+        now = time.monotonic()
+        for stream, since in self._since.items():
+            if now - since > self.max_delay and self._pending[stream][0]:
+                self._submit(stream, partial=True)
+
+    def _start_run(self, stream: str, run: int):
+        """Everything from here on in `stream` is part of `run`: what's pending goes out under the old one"""
+        self._submit(stream, everything=True)
+        self._runs[stream] = run
+        if stream == "force":
+            self.run = run
+
+    def amend_last(self, stream: str, ts: int, value: float):
+        """Replace the newest sample of an `AMENDABLE` stream"""
+        pending_ts, pending_values = self._pending[stream]
+        if not pending_ts:
+            # Already gone out with the end of a run
+            return
+        pending_ts[-1], pending_values[-1] = ts, value
+
+    def flush(self):
+        for stream in STREAMS:
+            self._submit(stream, everything=True)
+
+    def close(self):
+        if self._thread is None:
+            return
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        if self._error is not None:
+            raise self._error
+
+    def _submit(self, stream: str, partial=False, everything=False):
+        """Queue every full block of `stream`, then any partial block left if `partial`. Keeps back the newest sample
+        of an `AMENDABLE` stream unless it's `everything`"""
+        pending_ts, pending_values = self._pending[stream]
+        keep = 0 if everything or stream not in AMENDABLE else 1
+        smallest = 1 if partial or everything else self.block_samples
+        while len(pending_ts) - keep >= smallest:
+            count = min(len(pending_ts) - keep, self.block_samples)
+            block = (
+                stream,
+                self._runs[stream],
+                pending_ts[:count],
+                pending_values[:count],
+            )
+            del pending_ts[:count], pending_values[:count]
+            self._put(block)
+        self._since[stream] = time.monotonic()
+
+    def _put(self, block):
+        if self._error is not None:
+            raise self._error
+        try:
+            self._queue.put_nowait(block)
+        except queue.Full:
+            if self.drop:
+                self.stats.dropped_samples += len(block[2])
+                return
+            start = time.perf_counter()
+            self._queue.put(block)
+            self.stats.stalls += 1
+            self.stats.stalled_seconds += time.perf_counter() - start
+        self.stats.queue_high_water = max(
+            self.stats.queue_high_water, self._queue.qsize()
+        )
+
+    def _rotate(self):
+        if self._file is not None:
+            self._file.close()
+        self._segment += 1
+        self._file = open(segment_path(self.directory, self._segment), "wb")
+        metadata = json.dumps(
+            {**self.metadata, "segment": self._segment, "run": self._file_run}
+        ).encode()
+        self._file.write(FILE_HEADER.pack(MAGIC, VERSION, len(metadata)) + metadata)
+        self._segment_start = None
+        self.stats.segments += 1
+
+    def _write_forever(self):
+        try:
+            while True:
+                block = self._queue.get()
+                if block is None:
+                    break
+                stream, run, timestamps, values = block
+                encoded = encode_block(stream, timestamps, values, self.level)
+                if (
+                    self._file is None
+                    or run != self._file_run
+                    or self._file.tell() + len(encoded) > self.max_bytes
+                    or (
+                        self.max_seconds is not None
+                        and self._segment_start is not None
+                        and timestamps[-1] - self._segment_start
+                        > self.max_seconds * 1000
+                    )
+                ):
+                    self._file_run = run
+                    self._rotate()
+                if self._segment_start is None:
+                    self._segment_start = timestamps[0]
+                self._file.write(encoded)
+                self._file.flush()
+                stats = self.stats
+                stats.samples += len(timestamps)
+                stats.blocks += 1
+                stats.raw_bytes += len(timestamps) * (8 + STREAMS[stream].itemsize)
+                stats.compressed_bytes += len(encoded)
+        except BaseException as e:
+            # Raised from the pipeline's next write, or from close
+            self._error = e
+        finally:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class Downsampled(t.NamedTuple):
+    """Per-bucket summaries of a stream. Empty buckets have a count of 0 and NaN for everything else"""
+
+    # Start of each bucket (ms)
+    timestamps: np.ndarray
+    min: np.ndarray
+    max: np.ndarray
+    mean: np.ndarray
+    count: np.ndarray
+
+
+class _BlockIndex:
+    """Every block of one stream, ordered by first timestamp, as parallel arrays"""
+
+    def __init__(self, headers: t.List[t.Tuple[int, BlockHeader]]):
+        headers = sorted(headers, key=lambda item: item[1].first_ts)
+        self.segments = np.array([segment for segment, _ in headers], dtype=np.int64)
+        self.headers = [header for _, header in headers]
+        columns = list(zip(*self.headers)) or [()] * len(BlockHeader._fields)
+        field = dict(zip(BlockHeader._fields, columns))
+        self.first_ts = np.array(field["first_ts"], dtype=np.int64)
+        self.last_ts = np.array(field["last_ts"], dtype=np.int64)
+        self.count = np.array(field["count"], dtype=np.int64)
+        self.min = np.array(field["min"], dtype=np.float64)
+        self.max = np.array(field["max"], dtype=np.float64)
+        self.sum = np.array(field["sum"], dtype=np.float64)
+        # Sorted by where blocks start, a block can still end after a later one does; the latest end so far is sorted
+        self.ends_by = (
+            np.maximum.accumulate(self.last_ts) if len(headers) else self.last_ts
+        )
+
+    def __len__(self):
+        return len(self.headers)
+
+    def overlapping(self, start: int, end: int) -> range:
+        """Blocks that might hold samples in [start, end)"""
+        return range(
+            int(np.searchsorted(self.ends_by, start, side="left")),
+            int(np.searchsorted(self.first_ts, end, side="left")),
+        )
+
+
+class SessionReader:
+    """Time-range queries over one run of a recorded session (the latest by default). Opening one reads only the
+    segment and block headers.
+
+    Timestamps are the scale's (ms), and every range is half-open: `start <= ts < end`, with None for unbounded.
+    """
+
+    def __init__(self, directory: t.Union[str, Path], run: int = None, cache_blocks=64):
+        self.directory = Path(directory)
+        self.runs = sorted(segments_by_run(self.directory))
+        self.run = self.runs[-1] if run is None and self.runs else run
+        self.segments = run_segments(self.directory, self.run)
+        self.metadata: t.List[dict] = []
+        headers = {stream: [] for stream in STREAMS}
+        for segment, path in enumerate(self.segments):
+            with open(path, "rb") as f:
+                self.metadata.append(read_metadata(f))
+                for header in iter_headers(f):
+                    headers[header.stream].append((segment, header))
+        self.index = {stream: _BlockIndex(headers[stream]) for stream in STREAMS}
+        self.event_names = self.metadata[0]["events"]
+        # Most recently decoded blocks, and how many blocks have been decoded in all
+        self._cache: t.OrderedDict[t.Tuple[str, int], t.Tuple[np.ndarray, np.ndarray]]
+        self._cache = OrderedDict()
+        self.cache_blocks = cache_blocks
+        self.decoded = 0
+
+    def time_range(self, stream="force") -> t.Tuple[int, int]:
+        """First and last timestamp of `stream`"""
+        index = self.index[stream]
+        if not len(index):
+            raise ValueError(f"No {stream} recorded")
+        return int(index.first_ts[0]), int(index.last_ts[-1])
+
+    def __len__(self):
+        """Samples of force"""
+        return int(self.index["force"].count.sum())
+
+    def close(self):
+        self._cache.clear()
+
+    def _block(self, stream: str, i: int) -> t.Tuple[np.ndarray, np.ndarray]:
+        key = (stream, i)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        index = self.index[stream]
+        header = index.headers[i]
+        with open(self.segments[index.segments[i]], "rb") as f:
+            f.seek(header.offset)
+            block = decode_block(header, f.read(header.size))
+        self.decoded += 1
+        self._cache[key] = block
+        if len(self._cache) > self.cache_blocks:
+            self._cache.popitem(last=False)
+        return block
+
+    @staticmethod
+    def _bounds(start, end) -> t.Tuple[int, int]:
+        return (
+            np.iinfo(np.int64).min if start is None else int(start),
+            np.iinfo(np.int64).max if end is None else int(end),
+        )
+
+    def iter_range(
+        self, stream: str, start: int = None, end: int = None
+    ) -> t.Iterator[t.Tuple[np.ndarray, np.ndarray]]:
+        """`stream` in [start, end), a block at a time"""
+        start, end = self._bounds(start, end)
+        for i in self.index[stream].overlapping(start, end):
+            timestamps, values = self._block(stream, i)
+            inside = (timestamps >= start) & (timestamps < end)
+            if inside.all():
+                yield timestamps, values
+            elif inside.any():
+                yield timestamps[inside], values[inside]
+
+    def range(
+        self, stream: str, start: int = None, end: int = None
+    ) -> t.Tuple[np.ndarray, np.ndarray]:
+        """Timestamps and values of `stream` in [start, end)"""
+        chunks = list(self.iter_range(stream, start, end))
+        if not chunks:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=STREAMS[stream])
+        return tuple(np.concatenate(column) for column in zip(*chunks))
+
+    def events(
+        self, start: int = None, end: int = None, names: t.Collection[str] = None
+    ) -> t.List[t.Tuple[int, str]]:
+        """(timestamp, pattern name) of every event in [start, end), optionally only those named in `names`"""
+        timestamps, codes = self.range("events", start, end)
+        events = [
+            (ts, self.event_names[code])
+            for ts, code in zip(timestamps.tolist(), codes.tolist())
+        ]
+        return events if names is None else [e for e in events if e[1] in names]
+
+    def jumps(self, start: int = None, end: int = None) -> t.List[int]:
+        """When the jump pattern fired in [start, end)"""
+        return [ts for ts, _ in self.events(start, end, {"positive_large"})]
+
+    def downsample(
+        self, stream: str, buckets: int, start: int = None, end: int = None
+    ) -> Downsampled:
+        """Min, max, mean and count of `stream` over `buckets` equal slices of [start, end) (the whole stream by
+        default).
+
+        Blocks that fall entirely inside one bucket contribute their header summaries without being decompressed, so
+        only the blocks straddling bucket edges (at most about one per bucket) are read.
+        """
+        if start is None or end is None:
+            first, last = self.time_range(stream)
+            start = first if start is None else start
+            end = last + 1 if end is None else end
+        edges = np.linspace(start, end, buckets + 1)
+        low = np.full(buckets, np.inf)
+        high = np.full(buckets, -np.inf)
+        total = np.zeros(buckets)
+        count = np.zeros(buckets, dtype=np.int64)
+
+        index = self.index[stream]
+        blocks = index.overlapping(start, end)
+        selected = np.arange(blocks.start, blocks.stop)
+        first_bucket = np.searchsorted(edges, index.first_ts[selected], "right") - 1
+        last_bucket = np.searchsorted(edges, index.last_ts[selected], "right") - 1
+        whole = (
+            (first_bucket == last_bucket)
+            & (index.first_ts[selected] >= start)
+            & (index.last_ts[selected] < end)
+        )
+        summarised, buckets_of = selected[whole], first_bucket[whole]
+        np.minimum.at(low, buckets_of, index.min[summarised])
+        np.maximum.at(high, buckets_of, index.max[summarised])
+        np.add.at(total, buckets_of, index.sum[summarised])
+        np.add.at(count, buckets_of, index.count[summarised])
+
+        for i in selected[~whole].tolist():
+            timestamps, values = self._block(stream, i)
+            inside = (timestamps >= start) & (timestamps < end)
+            values = values[inside].astype(np.float64)
+            buckets_of = np.searchsorted(edges, timestamps[inside], "right") - 1
+            # The last edge is `end` itself, which `inside` has already excluded; guard against rounding in linspace
+            buckets_of = np.minimum(buckets_of, buckets - 1)
+            np.minimum.at(low, buckets_of, values)
+            np.maximum.at(high, buckets_of, values)
+            np.add.at(total, buckets_of, values)
+            np.add.at(count, buckets_of, 1)
+
+        empty = count == 0
+        low[empty] = high[empty] = np.nan
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(empty, np.nan, total / count)
+        return Downsampled(edges[:-1], low, high, mean, count)
+
+
+class TestSession(unittest.TestCase):
+    def test_round_trip_and_rotation(self):
+        rng = np.random.default_rng(0)
+        timestamps = np.arange(0, 50 * 5000, 50)
+        force = np.round(rng.normal(150, 2, len(timestamps)), 2)
+        with tempfile.TemporaryDirectory() as d:
+            writer = SessionWriter(d, max_bytes=16 * 1024, block_samples=500).start()
+            for start in range(0, len(timestamps), 37):
+                end = start + 37
+                writer.write("force", timestamps[start:end], force[start:end])
+                writer.write("velocity", timestamps[start:end], force[start:end] / 10)
+                # The velocity appended last is zeroed
+                writer.amend_last("velocity", int(timestamps[start:end][-1]), 0.0)
+            writer.write("events", [100, 250], [0, 1])
+            writer.close()
+
+            self.assertGreater(writer.stats.segments, 1)
+            self.assertEqual(writer.stats.dropped_samples, 0)
+            ts, values = read_stream(d, "force")
+            self.assertEqual(ts.tolist(), timestamps.tolist())
+            self.assertEqual(values.tolist(), force.tolist())
+            velocity = force / 10
+            velocity[36::37] = 0
+            velocity[-1] = 0
+            self.assertEqual(read_stream(d, "velocity")[1].tolist(), velocity.tolist())
+            self.assertEqual(read_stream(d, "events")[1].tolist(), [0, 1])
+
+            # A segment cut off mid-block still reads up to the last whole block
+            last = sorted(Path(d).glob(f"*{SUFFIX}"))[-1]
+            last.write_bytes(last.read_bytes()[:-10])
+            remaining = sum(len(read_stream(d, stream)[0]) for stream in STREAMS)
+            self.assertLess(remaining, writer.stats.samples)
+
+    def test_backpressure(self):
+        with tempfile.TemporaryDirectory() as d:
+            writer = SessionWriter(d, block_samples=10, queue_blocks=1, drop=True)
+            # Not started, so nothing drains the queue
+            for start in range(0, 50, 10):
+                writer.write("force", range(start, start + 11), [0.0] * 11)
+            self.assertGreater(writer.stats.dropped_samples, 0)
+            self.assertEqual(writer.stats.queue_high_water, 1)
+
+    def test_quiet_streams_are_flushed(self):
+        with tempfile.TemporaryDirectory() as d:
+            writer = SessionWriter(d, block_samples=100, max_delay=0.05)
+            writer.write("events", [0], [1])
+            time.sleep(0.1)
+            # Writing force is enough to send off the events that have been waiting
+            writer.write("force", [50], [0.0])
+            self.assertEqual(writer._pending["events"], ([], []))
+            self.assertEqual(writer._queue.qsize(), 1)
+
+    def test_runs(self):
+        timestamps = np.arange(0, 50_000, 50)
+        with tempfile.TemporaryDirectory() as d:
+            for run in range(2):
+                writer = SessionWriter(d, block_samples=64).start()
+                writer.write("force", timestamps, np.full(len(timestamps), run))
+                writer.close()
+            # The scale rebooted partway through the third
+            writer = SessionWriter(d, block_samples=64).start()
+            for run in (2, 3):
+                writer.write("force", timestamps, np.full(len(timestamps), run))
+            writer.close()
+
+            self.assertEqual(sorted(segments_by_run(d)), [0, 1, 2, 3])
+            for run in (0, 1, 2, 3):
+                reader = SessionReader(d, run)
+                ts, values = reader.range("force")
+                self.assertEqual(ts.tolist(), timestamps.tolist())
+                self.assertEqual(set(values.tolist()), {run})
+                self.assertEqual(read_stream(d, "force", run)[0].tolist(), ts.tolist())
+            self.assertEqual(SessionReader(d).run, 3)
+            with self.assertRaises(ValueError):
+                SessionReader(d, 4)
+
+    def test_reset_mid_batch(self):
+        timestamps = np.concatenate((np.arange(0, 5000, 50),) * 2)
+        with tempfile.TemporaryDirectory() as d:
+            writer = SessionWriter(d, block_samples=64).start()
+            # The scale reboots 20 samples into a batch; velocity follows a stage behind force, as from the pipeline
+            runs = (np.arange(len(timestamps)) >= 100).astype(float)
+            for start in range(0, len(timestamps), 30):
+                batch = slice(start, start + 30)
+                writer.write("force", timestamps[batch], runs[batch])
+                writer.write("velocity", timestamps[batch], runs[batch])
+            writer.close()
+
+            self.assertEqual(sorted(segments_by_run(d)), [0, 1])
+            for run in (0, 1):
+                reader = SessionReader(d, run)
+                for stream in ("force", "velocity"):
+                    ts, values = reader.range(stream)
+                    self.assertEqual(ts.tolist(), timestamps[:100].tolist())
+                    self.assertEqual(set(values.tolist()), {run})
+                    self.assertEqual(len(reader.range(stream, 1000, 2000)[0]), 20)
+
+    def test_reader(self):
+        rng = np.random.default_rng(1)
+        timestamps = np.arange(0, 50 * 20000, 50)
+        force = rng.normal(150, 20, len(timestamps))
+        with tempfile.TemporaryDirectory() as d:
+            writer = SessionWriter(d, max_bytes=64 * 1024, block_samples=256).start()
+            for start in range(0, len(timestamps), 100):
+                end = start + 100
+                writer.write("force", timestamps[start:end], force[start:end])
+            jumps = [(int(ts), 1) for ts in timestamps[::997]]
+            writer.write("events", *zip(*jumps))
+            writer.close()
+            self.assertGreater(writer.stats.segments, 2)
+
+            reader = SessionReader(d)
+            self.assertEqual(len(reader), len(timestamps))
+            self.assertEqual(reader.time_range(), (0, int(timestamps[-1])))
+            ts, values = reader.range("force", 123_456, 345_678)
+            inside = (timestamps >= 123_456) & (timestamps < 345_678)
+            self.assertEqual(ts.tolist(), timestamps[inside].tolist())
+            self.assertEqual(values.tolist(), force[inside].tolist())
+            # Only the blocks that overlap the range were decoded
+            self.assertLessEqual(reader.decoded, inside.sum() // 256 + 2)
+            self.assertEqual(
+                reader.jumps(100_000, 200_000),
+                [ts for ts, _ in jumps if 100_000 <= ts < 200_000],
+            )
+
+            reader = SessionReader(d)
+            summary = reader.downsample("force", 40)
+            self.assertLessEqual(reader.decoded, 41)
+            buckets = np.array_split(force, 40)
+            self.assertEqual(summary.min.tolist(), [b.min() for b in buckets])
+            self.assertEqual(summary.max.tolist(), [b.max() for b in buckets])
+            self.assertEqual(summary.count.tolist(), [len(b) for b in buckets])
+            np.testing.assert_allclose(summary.mean, [b.mean() for b in buckets])
+
+            window = reader.downsample("force", 7, 10_000, 10_350)
+            self.assertEqual(window.count.tolist(), [1] * 7)
+            self.assertEqual(window.max.tolist(), force[200:207].tolist())
+            empty = reader.downsample("force", 2, -1000, -500)
+            self.assertTrue(np.isnan(empty.min).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
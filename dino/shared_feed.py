@@ -0,0 +1,338 @@
+"""Live series published to shared memory, for other processes (plotters, recorders, dashboards) to read.
+
+Each series is one `multiprocessing.shared_memory` segment: a small int64 header followed by mirrored timestamp and
+value rings laid out like `Buffer`'s, so the newest samples are always contiguous. There is one writer, which never
+waits for readers. Readers use the header's seqlock counter to tell whether what they read was torn by a concurrent
+write and, if so, read it again.
+"""
+
+import os
+import subprocess
+import sys
+import time
+import typing as t
+import unittest
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from dino.buffer import Buffer
+from dino.openscale_serial.openscale_reader import SAMPLES_PER_SEC
+
+MAGIC = 0x44494E4F  # "DINO"
+VERSION = 2
+# Header slots
+_MAGIC, _VERSION, _CAPACITY, _SEQ, _WRITTEN, _WRITER_PID = range(6)
+HEADER_LEN = 8
+DEFAULT_CAPACITY = SAMPLES_PER_SEC * 60
+
+# Segments written from this process, which the resource tracker should go on cleaning up
+_written_here: t.Set[str] = set()
+
+
+def _nbytes(capacity: int) -> int:
+    return 8 * (HEADER_LEN + 4 * capacity)
+
+
+def _process_alive(pid: int) -> bool:
+    if os.name != "posix":
+        # os.kill would terminate it. Nothing to clean up there anyway: a segment goes when its last handle closes
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _untrack(shm: shared_memory.SharedMemory):
+    """Stop this process's resource tracker unlinking `shm` when we exit.
+
+    Depends on CPython internals: there's no public way to opt out of tracking before Python 3.13, and `_name` is
+    the name the segment was registered with (with the leading slash on POSIX).
+    """
+    resource_tracker.unregister(shm._name, "shared_memory")
+
+
+def _unlink_if_stale(name: str):
+    """Remove a segment left behind by a writer that died without closing it. A segment that might still be in use
+    (its writer is alive, or it isn't a dino feed we can tell the writer of) is left alone
+    """
+    existing = shared_memory.SharedMemory(name)
+    try:
+        header = np.ndarray(HEADER_LEN, dtype=np.int64, buffer=existing.buf)
+        valid = header[_MAGIC] == MAGIC and header[_VERSION] == VERSION
+        pid = int(header[_WRITER_PID])
+        del header
+        if not valid or not pid:
+            raise FileExistsError(f"{name} already exists and isn't a dino feed")
+        if _process_alive(pid):
+            raise FileExistsError(f"{name} is already being written by process {pid}")
+    except FileExistsError:
+        existing.close()
+        if name not in _written_here:
+            _untrack(existing)
+        raise
+    existing.close()
+    existing.unlink()
+
+
+def _layout(buf, capacity: int) -> t.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    header = np.ndarray(HEADER_LEN, dtype=np.int64, buffer=buf)
+    timestamps = np.ndarray(
+        2 * capacity, dtype=np.int64, buffer=buf, offset=8 * HEADER_LEN
+    )
+    values = np.ndarray(
+        2 * capacity,
+        dtype=np.float64,
+        buffer=buf,
+        offset=8 * (HEADER_LEN + 2 * capacity),
+    )
+    return header, timestamps, values
+
+
+class SharedFeedWriter:
+    """Publishes one series under `name`, replacing any stale segment a crashed writer left behind.
+
+    Raises `FileExistsError` if another writer is still publishing under `name`.
+    """
+
+    def __init__(self, name: str, capacity=DEFAULT_CAPACITY):
+        self.name = name
+        self.capacity = capacity
+        try:
+            self.shm = shared_memory.SharedMemory(
+                name, create=True, size=_nbytes(capacity)
+            )
+        except FileExistsError:
+            _unlink_if_stale(name)
+            self.shm = shared_memory.SharedMemory(
+                name, create=True, size=_nbytes(capacity)
+            )
+        _written_here.add(name)
+        self._header, self._timestamps, self._values = _layout(self.shm.buf, capacity)
+        self._header[:] = 0
+        self._header[_CAPACITY] = capacity
+        self._header[_VERSION] = VERSION
+        self._header[_WRITER_PID] = os.getpid()
+        # Last, so a reader that sees the magic number sees a valid header
+        self._header[_MAGIC] = MAGIC
+        self.written = 0
+
+    def attach(self, buffer: Buffer) -> "SharedFeedWriter":
+        """Publish everything appended to (or amended in) `buffer` from now on"""
+        buffer.register_callback(lambda b: self.append(*b.last_item))
+        buffer.register_amend_callback(lambda b: self.amend_last(*b.last_item))
+        return self
+
+    def append(self, ts: int, value: float):
+        header, capacity = self._header, self.capacity
+        head = self.written % capacity
+        header[_SEQ] += 1
+        self._timestamps[head] = self._timestamps[head + capacity] = ts
+        self._values[head] = self._values[head + capacity] = value
+        self.written += 1
+        header[_WRITTEN] = self.written
+        header[_SEQ] += 1
+
+    def extend(self, timestamps: np.ndarray, values: np.ndarray):
+        """`append` each of the samples, with one seqlock round for all of them"""
+        n = len(timestamps)
+        if not n:
+            return
+        capacity = self.capacity
+        # Anything more than a whole ring's worth would be overwritten straight away
+        keep = min(n, capacity)
+        slots = (self.written + n - keep + np.arange(keep)) % capacity
+        header = self._header
+        header[_SEQ] += 1
+        for offset in (0, capacity):
+            self._timestamps[slots + offset] = timestamps[n - keep :]
+            self._values[slots + offset] = values[n - keep :]
+        self.written += n
+        header[_WRITTEN] = self.written
+        header[_SEQ] += 1
+
+    def amend_last(self, ts: int, value: float):
+        if not self.written:
+            return
+        head = (self.written - 1) % self.capacity
+        self._header[_SEQ] += 1
+        self._timestamps[head] = self._timestamps[head + self.capacity] = ts
+        self._values[head] = self._values[head + self.capacity] = value
+        self._header[_SEQ] += 1
+
+    def close(self):
+        del self._header, self._timestamps, self._values
+        self.shm.close()
+        self.shm.unlink()
+        _written_here.discard(self.name)
+
+
+class SharedFeedReader:
+    """Reads a series some `SharedFeedWriter`, probably in another process, publishes under `name`"""
+
+    def __init__(self, name: str, retries=1000):
+        self.name = name
+        self.retries = retries
+        self.shm = shared_memory.SharedMemory(name)
+        # Only the writer gets to unlink the segment, whichever process exits first
+        if name not in _written_here:
+            _untrack(self.shm)
+        header = np.ndarray(HEADER_LEN, dtype=np.int64, buffer=self.shm.buf)
+        if header[_MAGIC] != MAGIC or header[_VERSION] != VERSION:
+            raise ValueError(f"{name} is not a version {VERSION} dino feed")
+        self.capacity = int(header[_CAPACITY])
+        self._header, self._timestamps, self._values = _layout(
+            self.shm.buf, self.capacity
+        )
+        # How many samples had been written when `read_new` last returned
+        self.read = max(0, self.written - self.capacity)
+        # Samples the writer overwrote before `read_new` got to them
+        self.missed = 0
+
+    @property
+    def written(self) -> int:
+        return int(self._header[_WRITTEN])
+
+    def _consistent(self, read: t.Callable[[int], t.Any]):
+        """`read(written)` again and again until no write overlapped it"""
+        header = self._header
+        for _ in range(self.retries):
+            seq = int(header[_SEQ])
+            if seq & 1:
+                # A write is under way
+                time.sleep(0)
+                continue
+            result = read(int(header[_WRITTEN]))
+            if int(header[_SEQ]) == seq:
+                return result
+        raise TimeoutError(f"{self.name} kept changing while being read")
+
+    def _copy(self, written: int, n: int) -> t.Tuple[np.ndarray, np.ndarray]:
+        end = written % self.capacity + self.capacity
+        return (
+            self._timestamps[end - n : end].copy(),
+            self._values[end - n : end].copy(),
+        )
+
+    def tail(self, n: int) -> t.Tuple[np.ndarray, np.ndarray]:
+        """Copies of the timestamps and values of the last `n` samples"""
+        return self._consistent(
+            lambda written: self._copy(written, min(max(n, 0), written, self.capacity))
+        )
+
+    def read_new(self) -> t.Tuple[np.ndarray, np.ndarray]:
+        """Copies of the samples written since the last call (everything still in the ring, the first time)"""
+
+        def read(written):
+            n = written - self.read
+            return written, n, self._copy(written, min(n, self.capacity))
+
+        written, n, (timestamps, values) = self._consistent(read)
+        self.missed += n - len(timestamps)
+        self.read = written
+        return timestamps, values
+
+    def views(self) -> t.Tuple[int, np.ndarray, np.ndarray]:
+        """Zero-copy views of every sample in the ring, and the seqlock counter to pass to `unchanged_since`.
+
+        Nothing stops the writer scribbling over the views while they're being used: check `unchanged_since`
+        afterwards, and throw away whatever was computed from them if it's False.
+        """
+
+        def read(written):
+            n = min(written, self.capacity)
+            end = written % self.capacity + self.capacity
+            return (
+                int(self._header[_SEQ]),
+                self._timestamps[end - n : end],
+                self._values[end - n : end],
+            )
+
+        return self._consistent(read)
+
+    def unchanged_since(self, seq: int) -> bool:
+        return int(self._header[_SEQ]) == seq
+
+    def close(self):
+        del self._header, self._timestamps, self._values
+        self.shm.close()
+
+
+class TestSharedFeed(unittest.TestCase):
+    def setUp(self):
+        self.writer = SharedFeedWriter(f"dino-test-{id(self)}", capacity=4)
+        self.reader = SharedFeedReader(self.writer.name)
+
+    def tearDown(self):
+        self.reader.close()
+        self.writer.close()
+
+    def test_read_new_and_wraparound(self):
+        self.writer.append(0, 1.0)
+        self.writer.append(50, 2.0)
+        self.assertEqual(self.reader.read_new()[1].tolist(), [1.0, 2.0])
+        self.writer.extend(np.arange(100, 400, 50), np.arange(3.0, 9.0))
+        timestamps, values = self.reader.read_new()
+        # Only the last 4 of the 6 new ones were still there
+        self.assertEqual(timestamps.tolist(), [200, 250, 300, 350])
+        self.assertEqual(self.reader.missed, 2)
+        self.assertEqual(self.reader.read_new()[0].tolist(), [])
+
+    def test_attach_follows_amendments(self):
+        buffer = Buffer()
+        self.writer.attach(buffer)
+        buffer.append(0, 5.0)
+        buffer.append(50, 6.0)
+        buffer.amend_last(50, 0.0)
+        self.assertEqual(self.reader.tail(10)[1].tolist(), [5.0, 0.0])
+        seq, _timestamps, values = self.reader.views()
+        self.assertEqual(values.tolist(), [5.0, 0.0])
+        self.assertTrue(self.reader.unchanged_since(seq))
+        buffer.append(100, 7.0)
+        self.assertFalse(self.reader.unchanged_since(seq))
+        del values, _timestamps
+
+    def test_one_writer_per_feed(self):
+        with self.assertRaises(FileExistsError):
+            SharedFeedWriter(self.writer.name, capacity=4)
+        self.assertEqual(self.reader.written, 0)
+
+        # A writer that died without closing leaves its segment behind
+        dead = subprocess.Popen([sys.executable, "-c", "pass"])
+        dead.wait()
+        name = f"dino-test-stale-{id(self)}"
+        stale = shared_memory.SharedMemory(name, create=True, size=_nbytes(4))
+        header = _layout(stale.buf, 4)[0]
+        header[:] = [MAGIC, VERSION, 4, 0, 0, dead.pid, 0, 0]
+        del header
+        stale.close()
+        writer = SharedFeedWriter(name, capacity=4)
+        writer.append(0, 1.0)
+        reader = SharedFeedReader(name)
+        self.assertEqual(reader.tail(1)[1].tolist(), [1.0])
+        reader.close()
+        writer.close()
+
+    def test_other_process(self):
+        self.writer.extend(np.array([0, 50, 100]), np.array([1.5, 2.5, 3.5]))
+        script = (
+            "from dino.shared_feed import SharedFeedReader;"
+            f"reader = SharedFeedReader({self.writer.name!r});"
+            "print(reader.tail(2)[1].tolist()); reader.close()"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", script], check=True, capture_output=True, text=True
+        ).stdout
+        self.assertEqual(output.strip(), "[2.5, 3.5]")
+        # The reader exiting didn't take the segment with it
+        reader = SharedFeedReader(self.writer.name)
+        self.assertEqual(reader.written, 3)
+        reader.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
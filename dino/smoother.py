@@ -1,44 +1,380 @@
+"""Filters for the force, between the serial reader and the buffer.
+
+Every filter works two ways: streaming, one sample at a time with `step` (or a batch at a time, carrying its state
+across batches, by calling it), and all at once over a whole trace with `filter`. Both give bit-for-bit the same
+output. Some filters need to see `lookahead` samples past the one they're filtering, so they hold that many back;
+`latency` is how far behind the input the output is, in samples, including that.
+"""
+
+import copy
+import math
 import typing as t
+import unittest
+from bisect import insort
+from collections import deque
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from dino.openscale_serial.openscale_reader import SAMPLES_PER_SEC
 
 SAME_FACTOR = 3
 SPIKE_FACTOR = 40
 
 
-def _check_for_spike(beginning, middle, end):
-    _, y_begin = beginning
-    _, y_end = end
-    _, y_middle = middle
+class Filter:
+    lookahead = 0
+
+    def reset(self):
+        raise NotImplementedError
+
+    def step(self, value: float) -> t.Optional[float]:
+        """Filter one more sample. Returns the filtered value of the sample `lookahead` before it, if there is one"""
+        raise NotImplementedError
+
+    def __call__(self, values: np.ndarray) -> np.ndarray:
+        """`step` through a batch, returning every output it produces"""
+        step = self.step
+        outputs = [
+            step(value) for value in np.asarray(values, dtype=np.float64).tolist()
+        ]
+        if self.lookahead:
+            outputs = [y for y in outputs if y is not None]
+        return np.array(outputs, dtype=np.float64)
+
+    def filter(self, values: np.ndarray) -> np.ndarray:
+        """Filter a whole trace from scratch (leaving this filter's own state alone).
+
+        Recursive filters have no vectorized form that rounds the same way, so by default this runs the recurrence
+        on a fresh copy of the filter.
+        """
+        fresh = copy.copy(self)
+        fresh.reset()
+        return fresh(values)
+
+    @property
+    def latency(self) -> float:
+        return float(self.lookahead)
+
+    def __str__(self):
+        return (
+            f"{type(self).__name__}: {self.lookahead} samples held back, "
+            f"{self.latency:.1f} samples latency"
+        )
+
+
+def _ema_latency(alpha: float) -> float:
+    # Group delay of y += alpha * (x - y) for slowly changing input
+    return (1 - alpha) / alpha
+
+
+class SpikeFilter(Filter):
+    """Replaces a sample that sticks out by more than `spike` from neighbours within `same` of each other"""
+
+    lookahead = 1
+
+    def __init__(self, same=SAME_FACTOR, spike=SPIKE_FACTOR):
+        self.same = same
+        self.spike = spike
+        self.reset()
+
+    def reset(self):
+        self.previous: t.Optional[float] = None
+        self.pending: t.Optional[float] = None
+        self.spikes = 0
+
+    def step(self, value: float) -> t.Optional[float]:
+        middle, self.pending = self.pending, value
+        if middle is None:
+            return None
+        previous = self.previous
+        if previous is not None and abs(value - previous) < self.same:
+            mean = (previous + value) / 2
+            if abs(middle - mean) > self.spike:
+                middle = mean
+                self.spikes += 1
+        self.previous = middle
+        return middle
+
+    def filter(self, values: np.ndarray) -> np.ndarray:
+        values = np.asarray(values, dtype=np.float64)
+        n = len(values)
+        if n < 2:
+            return np.zeros(0)
+        out = values[:-1].copy()
+        before, middle, after = values[:-2], values[1:-1], values[2:]
+        spiky = (np.abs(after - before) < self.same) & (
+            np.abs(middle - (before + after) / 2) > self.spike
+        )
+        # Only a replaced sample changes the test for the one after it, so just those need a second look
+        pending = (np.flatnonzero(spiky) + 1).tolist()[::-1]
+        recheck = None
+        while pending or recheck is not None:
+            if recheck is not None and (not pending or recheck <= pending[-1]):
+                i, recheck = recheck, None
+                if pending and pending[-1] == i:
+                    pending.pop()
+            else:
+                i = pending.pop()
+            previous, value = float(out[i - 1]), float(values[i + 1])
+            mean = (previous + value) / 2
+            if abs(value - previous) < self.same and abs(values[i] - mean) > self.spike:
+                out[i] = mean
+                if i + 1 < n - 1:
+                    recheck = i + 1
+        return out
+
+
+class MedianFilter(Filter):
+    """Median of the `window` samples centred on each one (fewer at the start of the trace)"""
+
+    def __init__(self, window=5):
+        if window < 1 or window % 2 == 0:
+            raise ValueError("The median window must be a positive odd number")
+        self.window = window
+        self.lookahead = window // 2
+        self.reset()
+
+    def reset(self):
+        self.recent: t.Deque[float] = deque(maxlen=self.window)
+        self.sorted: t.List[float] = []
+        self.count = 0
+
+    @staticmethod
+    def _median(values: t.List[float]) -> float:
+        middle = len(values) // 2
+        if len(values) % 2:
+            return values[middle]
+        return (values[middle - 1] + values[middle]) / 2
+
+    def step(self, value: float) -> t.Optional[float]:
+        if len(self.recent) == self.window:
+            self.sorted.remove(self.recent[0])
+        self.recent.append(value)
+        insort(self.sorted, value)
+        self.count += 1
+        if self.count <= self.lookahead:
+            return None
+        return self._median(self.sorted)
+
+    def filter(self, values: np.ndarray) -> np.ndarray:
+        values = np.asarray(values, dtype=np.float64)
+        n, half = len(values), self.lookahead
+        # Windows that are cut short by the start of the trace
+        start = [
+            self._median(sorted(values[: i + half + 1].tolist()))
+            for i in range(min(half, n - half))
+        ]
+        full = (
+            np.median(sliding_window_view(values, self.window), axis=1)
+            if n >= self.window
+            else np.zeros(0)
+        )
+        return np.concatenate((start, full))
+
+
+class EMAFilter(Filter):
+    """Exponential moving average"""
+
+    def __init__(self, alpha=0.5):
+        if not 0 < alpha <= 1:
+            raise ValueError("The EMA's alpha must be in (0, 1]")
+        self.alpha = alpha
+        self.reset()
 
-    y_mean = (y_begin + y_end) / 2
-    if abs(y_end - y_begin) < SAME_FACTOR:
-        return abs(y_middle - y_mean) > SPIKE_FACTOR
-    return False
+    def reset(self):
+        self.value: t.Optional[float] = None
 
-    # return abs(y_middle - y_mean) / y_mean > SPIKE_FACTOR
+    def step(self, value: float) -> float:
+        if self.value is None:
+            self.value = value
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+    @property
+    def latency(self) -> float:
+        return _ema_latency(self.alpha)
+
+
+class OneEuroFilter(Filter):
+    """The 1€ filter (Casiez et al.): an EMA whose cutoff rises with speed, so it smooths at rest but lags little
+    when the force changes quickly"""
+
+    def __init__(self, min_cutoff=1.0, beta=0.05, d_cutoff=1.0, rate=SAMPLES_PER_SEC):
+        if not (min_cutoff > 0 and d_cutoff > 0 and rate > 0):
+            raise ValueError("The 1€ filter's cutoffs and rate must be positive")
+        if not beta >= 0:
+            raise ValueError("The 1€ filter's beta can't be negative")
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.rate = rate
+        self.reset()
+
+    def reset(self):
+        self.value: t.Optional[float] = None
+        self.derivative = 0.0
+
+    def _alpha(self, cutoff: float) -> float:
+        tau = 1 / (2 * math.pi * cutoff)
+        return 1 / (1 + tau * self.rate)
+
+    def step(self, value: float) -> float:
+        if self.value is None:
+            self.value = value
+            return value
+        derivative = (value - self.value) * self.rate
+        self.derivative += self._alpha(self.d_cutoff) * (derivative - self.derivative)
+        cutoff = self.min_cutoff + self.beta * abs(self.derivative)
+        self.value += self._alpha(cutoff) * (value - self.value)
+        return self.value
+
+    @property
+    def latency(self) -> float:
+        """At rest; it shrinks as the force moves"""
+        return _ema_latency(self._alpha(self.min_cutoff))
+
+
+class KalmanFilter(Filter):
+    """Kalman filter for a level that drifts by `process_noise` (variance per sample) under `measurement_noise`"""
+
+    def __init__(self, process_noise=0.5, measurement_noise=1.0):
+        if not (process_noise > 0 and measurement_noise > 0):
+            raise ValueError("The Kalman filter's noise variances must be positive")
+        self.q = process_noise
+        self.r = measurement_noise
+        self.reset()
+
+    def reset(self):
+        self.value: t.Optional[float] = None
+        self.variance = self.r
+
+    def step(self, value: float) -> float:
+        if self.value is None:
+            self.value = value
+            return value
+        prior = self.variance + self.q
+        gain = prior / (prior + self.r)
+        self.value += gain * (value - self.value)
+        self.variance = (1 - gain) * prior
+        return self.value
+
+    @property
+    def latency(self) -> float:
+        """Once the gain has settled"""
+        prior = (self.q + math.sqrt(self.q * self.q + 4 * self.q * self.r)) / 2
+        return _ema_latency(prior / (prior + self.r))
+
+
+FILTERS = {
+    "spike": SpikeFilter,
+    "median": MedianFilter,
+    "ema": EMAFilter,
+    "one-euro": OneEuroFilter,
+    "kalman": KalmanFilter,
+}
+
+
+def make_filter(spec: str) -> Filter:
+    """A filter from a name and optional comma-separated parameters, eg `median`, `median:7` or `kalman:0.05,2`"""
+    name, _, parameters = spec.partition(":")
+    if name not in FILTERS:
+        raise ValueError(f"Unknown filter {name!r}; choose from {', '.join(FILTERS)}")
+    # The median's window is a whole number of samples; don't quietly round 7.5 down
+    parse = int if name == "median" else float
+    try:
+        arguments = [parse(p) for p in parameters.split(",")] if parameters else []
+        return FILTERS[name](*arguments)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Bad parameters for {name!r}: {parameters!r} ({e})")
 
 
 class Smoother:
+    """`SpikeFilter` with callbacks: each (ts, value) is passed on once the sample after it arrives"""
+
     def __init__(self):
-        self.buffered = (None, None)
+        self.filter = SpikeFilter()
+        self.held_ts = None
         self.callbacks = []
 
     def register_callback(self, cb: t.Callable):
         self.callbacks.append(cb)
 
-    def _call_all(self, *args):
-        for c in self.callbacks:
-            c(args)
-
     def receive_item(self, ts, value):
-        first_buffered, second_buffered = self.buffered
-        if first_buffered is None:
-            self.buffered = ((ts, value), None)
-        elif second_buffered is None:
-            self.buffered = (first_buffered, (ts, value))
-            self._call_all(*first_buffered)
-        else:
-            if _check_for_spike(first_buffered, second_buffered, (ts, value)):
-                print("Spike detected!:", first_buffered, second_buffered, (ts, value))
-                second_buffered = (second_buffered[0], (first_buffered[1] + value) / 2)
-            self.buffered = (second_buffered, (ts, value))
-            self._call_all(*second_buffered)
+        filtered = self.filter.step(value)
+        held_ts, self.held_ts = self.held_ts, ts
+        if filtered is not None:
+            for c in self.callbacks:
+                c((held_ts, filtered))
+
+
+class TestFilters(unittest.TestCase):
+    def setUp(self):
+        from dino.replay import load_trace
+
+        _, force = load_trace("michelle.txt")
+        force = force.copy()
+        # A few spikes, two of them back to back
+        force[[100, 400, 401, 1500]] += [60.0, -80.0, 75.0, 120.0]
+        self.force = force
+
+    def test_streaming_matches_batch(self):
+        rng = np.random.default_rng(0)
+        for spec in (
+            "spike",
+            "median:1",
+            "median",
+            "median:9",
+            "ema",
+            "one-euro",
+            "kalman",
+        ):
+            with self.subTest(filter=spec):
+                streaming = make_filter(spec)
+                pieces, start = [], 0
+                while start < len(self.force):
+                    end = start + int(rng.integers(1, 40))
+                    pieces.append(streaming(self.force[start:end]))
+                    start = end
+                batch = make_filter(spec).filter(self.force)
+                self.assertEqual(len(batch), len(self.force) - streaming.lookahead)
+                self.assertEqual(np.concatenate(pieces).tolist(), batch.tolist())
+
+    def test_make_filter(self):
+        self.assertEqual(make_filter("median:7").window, 7)
+        self.assertEqual(make_filter("kalman:0.05,2").r, 2.0)
+        for spec in (
+            "median:7.5",
+            "median:4",
+            "ema:x",
+            "ema:0.5,1",
+            "boxcar",
+            # Would divide by zero in `latency`, or diverge
+            "ema:0",
+            "ema:-1",
+            "ema:1.5",
+            "one-euro:0",
+            "one-euro:1,-1",
+            "kalman:0",
+            "kalman:0.5,0",
+            "kalman:nan",
+        ):
+            with self.subTest(spec=spec), self.assertRaises(ValueError):
+                make_filter(spec)
+
+    def test_spikes_are_removed(self):
+        spikes = SpikeFilter()
+        filtered = spikes.filter(self.force)
+        self.assertLess(abs(filtered[100] - self.force[99]), 1)
+        self.assertLess(abs(filtered[1500] - self.force[1499]), 1)
+        seen = []
+        smoother = Smoother()
+        smoother.register_callback(seen.append)
+        for i, value in enumerate(self.force.tolist()):
+            smoother.receive_item(i, value)
+        self.assertEqual(seen, list(enumerate(filtered.tolist())))
+
+
+if __name__ == "__main__":
+    unittest.main()
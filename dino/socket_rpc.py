@@ -1,8 +1,30 @@
+"""Sending events to the game over UDP.
+
+By default every event is one `EVENT_HEADER` datagram: the event's ASCII character first, so the game can keep
+reading just the first byte, then a version byte, a per-channel sequence number, the source (scale) timestamp in ms,
+the wall-clock time it was sent in ns, and how many redundant steady events were coalesced away just before it.
+`--legacy-events` sends the bare character instead, for game builds that predate this.
+"""
+
+import asyncio
 import socket
+import struct
+import time
+import typing as t
+import unittest
+
+from dino.latency import LatencyHistogram
 
 HOST = "127.0.0.1"
 PORT = 12345
 
+EVENT_VERSION = 1
+# kind, version, sequence number, source timestamp (ms), sent at (wall clock ns), coalesced
+EVENT_HEADER = struct.Struct("<cBIqqH")
+STEADY = b"s"
+# How many missing sequence numbers `EventReceiver` remembers, in case they turn up late
+MAX_MISSING = 1024
+
 
 class SocketSender:
     def __init__(self):
@@ -10,3 +32,233 @@ class SocketSender:
 
     def send(self, message):
         self.sock.sendto(message, (HOST, PORT))
+
+
+class NullSender:
+    """Sends nowhere, for running a pipeline with no game listening"""
+
+    @staticmethod
+    def send(message):
+        pass
+
+
+class AsyncUDPSender:
+    """`SocketSender` for the asyncio runtime. `send` hands the datagram to the event loop and never blocks"""
+
+    def __init__(self, host=HOST, port=PORT):
+        self.address = (host, port)
+        self.transport = None
+        # Messages sent before `start` or after `close` go nowhere, but get counted
+        self.dropped = 0
+
+    async def start(self) -> "AsyncUDPSender":
+        loop = asyncio.get_running_loop()
+        # Not connected to `address`, so channels can share the socket
+        self.transport, _ = await loop.create_datagram_endpoint(
+            asyncio.DatagramProtocol, family=socket.AF_INET
+        )
+        return self
+
+    def send(self, message, address=None):
+        if self.transport is None:
+            self.dropped += 1
+            return
+        self.transport.sendto(message, address or self.address)
+
+    def channel(self, port: int) -> "UDPChannel":
+        """A sender for one player's events, to their own port on the same host, through this socket"""
+        return UDPChannel(self, (self.address[0], port))
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *_exc):
+        self.close()
+
+
+class UDPChannel:
+    def __init__(self, sender: AsyncUDPSender, address):
+        self.sender = sender
+        self.address = address
+
+    def send(self, message):
+        self.sender.send(message, self.address)
+
+
+class EventPacket(t.NamedTuple):
+    kind: bytes
+    # None for a bare one-byte legacy event
+    seq: t.Optional[int] = None
+    source_ts: t.Optional[int] = None
+    sent_ns: t.Optional[int] = None
+    coalesced: int = 0
+
+
+def encode_event(
+    kind: bytes, seq: int, source_ts: int, sent_ns: int, coalesced=0
+) -> bytes:
+    return EVENT_HEADER.pack(
+        kind,
+        EVENT_VERSION,
+        seq & 0xFFFFFFFF,
+        source_ts,
+        sent_ns,
+        min(coalesced, 0xFFFF),
+    )
+
+
+def decode_event(data: bytes) -> EventPacket:
+    if len(data) >= EVENT_HEADER.size and data[1] == EVENT_VERSION:
+        kind, _version, *rest = EVENT_HEADER.unpack_from(data)
+        return EventPacket(kind, *rest)
+    return EventPacket(bytes(data[:1]))
+
+
+class EventSender:
+    """Encodes the one-byte events `register_default_patterns` sends and hands them to `transport`.
+
+    `clock` gives the source timestamp of the event being sent, eg `lambda: pipeline.now`. With `coalesce`, a
+    steady event straight after another steady event is dropped: the game is already steady, so it would do nothing.
+    The next event that does go out carries the count of the ones dropped.
+    """
+
+    def __init__(
+        self,
+        transport,
+        clock: t.Callable[[], int] = lambda: time.time_ns() // 10**6,
+        coalesce=False,
+        legacy=False,
+    ):
+        self.transport = transport
+        self.clock = clock
+        self.coalesce = coalesce
+        self.legacy = legacy
+        self.seq = 0
+        self.sent = 0
+        self.coalesced = 0
+        self._pending = 0
+        self._last: t.Optional[bytes] = None
+
+    def send(self, message: bytes):
+        if self.coalesce and message == STEADY and self._last == STEADY:
+            self.coalesced += 1
+            self._pending += 1
+            return
+        self._last = message
+        if self.legacy:
+            self.transport.send(message)
+        else:
+            self.transport.send(
+                encode_event(
+                    message, self.seq, self.clock(), time.time_ns(), self._pending
+                )
+            )
+            self.seq = (self.seq + 1) & 0xFFFFFFFF
+        self._pending = 0
+        self.sent += 1
+
+    def __str__(self):
+        return f"{self.sent} events sent, {self.coalesced} coalesced"
+
+
+class EventReceiver(asyncio.DatagramProtocol):
+    """Stand-in for the game's end of the socket: decodes events and keeps track of loss, reordering and delay.
+
+    Delay is from `sent_ns` to arrival, on the wall clock, so it is only meaningful on one machine.
+    """
+
+    def __init__(self, on_event: t.Callable[[EventPacket], None] = None):
+        self.on_event = on_event
+        self.packets = 0
+        # Events the sender reported, including the coalesced ones
+        self.events = 0
+        self.lost = 0
+        self.reordered = 0
+        self.duplicates = 0
+        self.delay = LatencyHistogram()
+        self._expected: t.Optional[int] = None
+        # Sequence numbers counted as lost that may yet turn up late, oldest first (a dict as an ordered set)
+        self._missing: t.Dict[int, None] = {}
+
+    def datagram_received(self, data, addr):
+        received_ns = time.time_ns()
+        packet = decode_event(data)
+        self.packets += 1
+        self.events += 1 + packet.coalesced
+        if packet.seq is not None:
+            self.delay.record(received_ns - packet.sent_ns)
+            self._track(packet.seq)
+        if self.on_event is not None:
+            self.on_event(packet)
+
+    def _track(self, seq: int):
+        if self._expected is None:
+            self._expected = seq
+        ahead = (seq - self._expected) & 0xFFFFFFFF
+        if ahead < 1 << 31:
+            # Anything skipped over is lost, until (unless) it turns up late
+            self.lost += ahead
+            for skipped in range(max(ahead - MAX_MISSING, 0), ahead):
+                self._missing[(self._expected + skipped) & 0xFFFFFFFF] = None
+            while len(self._missing) > MAX_MISSING:
+                del self._missing[next(iter(self._missing))]
+            self._expected = (seq + 1) & 0xFFFFFFFF
+        elif seq in self._missing:
+            del self._missing[seq]
+            self.reordered += 1
+            self.lost -= 1
+        else:
+            # Already seen (or given up on): a duplicate or a replay
+            self.duplicates += 1
+
+    def __str__(self):
+        return (
+            f"{self.packets} packets, {self.events} events, {self.lost} lost, {self.reordered} reordered, "
+            f"{self.duplicates} duplicates, "
+            f"delay p50 {self.delay.percentile(50) / 1e3:.0f}us p99 {self.delay.percentile(99) / 1e3:.0f}us"
+        )
+
+
+class TestEvents(unittest.TestCase):
+    def test_round_trip(self):
+        data = encode_event(b"j", 7, 123_456, 10**18, 3)
+        self.assertEqual(len(data), EVENT_HEADER.size)
+        # The game only looks at the first byte
+        self.assertEqual(data[:1], b"j")
+        self.assertEqual(decode_event(data), EventPacket(b"j", 7, 123_456, 10**18, 3))
+        self.assertEqual(decode_event(b"s"), EventPacket(b"s"))
+
+    def test_coalescing(self):
+        sent = []
+
+        class _Transport:
+            @staticmethod
+            def send(message):
+                sent.append(decode_event(message))
+
+        sender = EventSender(_Transport, clock=lambda: 0, coalesce=True)
+        for message in b"ssjsssjj":
+            sender.send(bytes([message]))
+        self.assertEqual(
+            [(packet.kind, packet.seq, packet.coalesced) for packet in sent],
+            [(b"s", 0, 0), (b"j", 1, 1), (b"s", 2, 0), (b"j", 3, 2), (b"j", 4, 0)],
+        )
+        self.assertEqual(sender.coalesced, 3)
+
+    def test_receiver_loss_and_reordering(self):
+        receiver = EventReceiver()
+        for seq in (0xFFFFFFFE, 0xFFFFFFFF, 1, 2, 0, 4):
+            receiver.datagram_received(encode_event(b"s", seq, 0, time.time_ns()), None)
+        # Across the wrap-around, 0 came late and 3 never did
+        self.assertEqual((receiver.lost, receiver.reordered), (1, 1))
+        self.assertEqual(receiver.delay.total, 6)
+        # Repeats of packets that already arrived don't make up for the lost one
+        for seq in (0, 2, 4, 1):
+            receiver.datagram_received(encode_event(b"s", seq, 0, time.time_ns()), None)
+        self.assertEqual((receiver.lost, receiver.reordered), (1, 1))
+        self.assertEqual(receiver.duplicates, 4)
@@ -1,67 +1,247 @@
+"""What the player is doing, driven by velocity events.
+
+The rules are data: `TRANSITIONS` says where each (state, event) pair goes and `TIMEOUTS` where a state goes once
+it has lasted long enough. `DinoStateMachine` compiles them into a dense table indexed by state and event codes, so
+handling an event is a couple of list lookups. `feed` runs a whole array of events (eg from a replay) through it.
+"""
+
+import logging
 import typing as t
+import unittest
+
+import numpy as np
 
 from dino.openscale_serial.openscale_reader import SAMPLES_PER_SEC
 from .types import State, Event
 
+logger = logging.getLogger(__name__)
+
+# Pairs not listed stay where they are
+TRANSITIONS = {
+    (State.UNCALIBRATED, Event.VELOCITY_STEADY): State.STEADY,
+    (State.STEADY, Event.VELOCITY_POSITIVE_SMALL): State.JUMPING,
+    (State.STEADY, Event.VELOCITY_POSITIVE_LARGE): State.JUMPING,
+    (State.STEADY, Event.VELOCITY_NEGATIVE): State.DUCKING,
+    (State.JUMPING, Event.VELOCITY_STEADY): State.STEADY,
+    (State.DUCKING, Event.VELOCITY_POSITIVE_SMALL): State.STEADY,
+    (State.DUCKING, Event.VELOCITY_POSITIVE_LARGE): State.JUMPING,
+}
+
+
+class Timeout(t.NamedTuple):
+    """Leave for `to` after `samples` ticks or `ms` milliseconds in the state, whichever comes first"""
+
+    to: State
+    samples: t.Optional[int] = None
+    ms: t.Optional[int] = None
+
+
+# A jump is over after a fifth of a second, whether or not the velocity has settled
+TIMEOUTS = {
+    State.JUMPING: Timeout(
+        State.STEADY, ms=1000 * (SAMPLES_PER_SEC // 5) // SAMPLES_PER_SEC
+    )
+}
+
+STATES = list(State)
+EVENTS = list(Event)
+_STATE_CODES = {state: code for code, state in enumerate(STATES)}
+_EVENT_CODES = {event: code for code, event in enumerate(EVENTS)}
+
+
+def event_codes(events: t.Iterable[Event]) -> np.ndarray:
+    """`events` as the integer codes `feed` takes"""
+    return np.fromiter((_EVENT_CODES[event] for event in events), dtype=np.int8)
+
 
 class DinoStateMachine:
-    def __init__(self):
-        self.current_state = State.UNCALIBRATED
-        self.allowed_transitions = {
-            State.UNCALIBRATED: {State.UNCALIBRATED, State.STEADY},
-            State.STEADY: {State.STEADY, State.DUCKING, State.JUMPING},
-            State.JUMPING: {State.JUMPING, State.STEADY},
-            State.DUCKING: {State.DUCKING, State.STEADY, State.JUMPING},
-        }
-        self.transition_callbacks = {}
+    def __init__(self, transitions=None, timeouts=None, debug=False):
+        transitions = TRANSITIONS if transitions is None else transitions
+        timeouts = TIMEOUTS if timeouts is None else timeouts
+        # Log every transition
+        self.debug = debug
+
+        # table[state][event] -> next state, all as codes
+        self.table = [[code] * len(EVENTS) for code in range(len(STATES))]
+        for (state, event), target in transitions.items():
+            self.table[_STATE_CODES[state]][_EVENT_CODES[event]] = _STATE_CODES[target]
+        self._timeouts: t.List[t.Optional[t.Tuple[int, float, float]]] = [None] * len(
+            STATES
+        )
+        for state, timeout in timeouts.items():
+            self._timeouts[_STATE_CODES[state]] = (
+                _STATE_CODES[timeout.to],
+                float("inf") if timeout.samples is None else timeout.samples,
+                float("inf") if timeout.ms is None else timeout.ms,
+            )
+
+        self.allowed_transitions = {state: {state} for state in STATES}
+        for (state, _event), target in transitions.items():
+            self.allowed_transitions[state].add(target)
+        for state, timeout in timeouts.items():
+            self.allowed_transitions[state].add(timeout.to)
+
+        # callbacks[from * len(STATES) + to]
+        self._callbacks: t.List[t.Optional[t.Callable]] = [None] * len(STATES) ** 2
+        self._state = _STATE_CODES[State.UNCALIBRATED]
         self.time_in_state = 0
+        # Timestamp (ms) at which the current state was entered, once we've been told the time
+        self.entered_at: t.Optional[int] = None
+
+    @property
+    def current_state(self) -> State:
+        return STATES[self._state]
+
+    @current_state.setter
+    def current_state(self, state: State):
+        self._state = _STATE_CODES[state]
+        self.time_in_state = 0
+        self.entered_at = None
 
     def register_callback(
         self, from_state: State, to_state: State, callback: t.Callable
     ):
-        self.transition_callbacks.setdefault(from_state, dict())[to_state] = callback
-
-    def receive_event(self, event: Event):
-        new_state = self.current_state
-
-        if self.current_state == State.UNCALIBRATED:
-            if event == event.VELOCITY_STEADY:
-                new_state = State.STEADY
-        elif self.current_state == State.STEADY:
-            if event in (Event.VELOCITY_POSITIVE_SMALL, Event.VELOCITY_POSITIVE_LARGE):
-                new_state = State.JUMPING
-            if event == Event.VELOCITY_NEGATIVE:
-                new_state = State.DUCKING
-        elif self.current_state == State.JUMPING:
-            if event == Event.VELOCITY_STEADY:
-                new_state = State.STEADY
-            # Revert to steady after time passes
-            if self.time_in_state >= SAMPLES_PER_SEC // 5:
-                new_state = State.STEADY
-        elif self.current_state == State.DUCKING:
-            if event == Event.VELOCITY_POSITIVE_SMALL:
-                new_state = State.STEADY
-            if event == Event.VELOCITY_POSITIVE_LARGE:
-                new_state = State.JUMPING
-
-        self.transition(new_state)
+        """Call `callback()` whenever the machine goes from `from_state` to `to_state` (which may be the same state)"""
+        self._callbacks[
+            _STATE_CODES[from_state] * len(STATES) + _STATE_CODES[to_state]
+        ] = callback
+
+    def receive_event(self, event: Event, ts: t.Optional[int] = None):
+        if ts is not None:
+            self.advance(ts)
+        self._go(self.table[self._state][_EVENT_CODES[event]], ts)
 
     def tick(self, *_args):
+        """One more sample in the current state"""
         self.time_in_state += 1
+        timeout = self._timeouts[self._state]
+        if timeout is not None and self.time_in_state >= timeout[1]:
+            self._go(timeout[0], None)
 
-    def transition(self, new_state: State):
-        if new_state in self.allowed_transitions.get(self.current_state, set()):
-            if new_state != self.current_state:
-                print(self.current_state, "-->", new_state)
-                self.time_in_state = 0
+    def advance(self, ts: int):
+        """The time is now `ts` (ms)"""
+        if self.entered_at is None:
+            self.entered_at = ts
+            return
+        timeout = self._timeouts[self._state]
+        if timeout is not None and ts - self.entered_at >= timeout[2]:
+            self._go(timeout[0], self.entered_at + timeout[2])
 
-            maybe_callback = self.transition_callbacks.get(self.current_state, {}).get(
-                new_state, None
-            )
-            self.current_state = new_state
-            if maybe_callback is not None:
-                maybe_callback()
-        else:
+    def transition(self, new_state: State):
+        if new_state not in self.allowed_transitions[self.current_state]:
             raise RuntimeError(
                 f"Transition from {self.current_state} to {new_state} is not allowed"
             )
+        self._go(_STATE_CODES[new_state], None)
+
+    def _go(self, target: int, ts: t.Optional[float]):
+        """Move to state `target`, entered at `ts` (or at the next `advance`, if None)"""
+        source = self._state
+        if target != source:
+            if self.debug:
+                logger.debug("%s --> %s", STATES[source], STATES[target])
+            self._state = target
+            self.time_in_state = 0
+            self.entered_at = ts
+        callback = self._callbacks[source * len(STATES) + target]
+        if callback is not None:
+            callback()
+
+    def feed(
+        self, events: t.Sequence[int], timestamps: t.Optional[t.Sequence[int]] = None
+    ) -> np.ndarray:
+        """`receive_event` for each of `events` (codes, see `event_codes`), at `timestamps` if given.
+
+        Returns the code of the state after each event.
+        """
+        events = np.asarray(events, dtype=np.int8).tolist()
+        codes = [0] * len(events)
+        if timestamps is not None or any(self._callbacks):
+            go, advance, table = self._go, self.advance, self.table
+            if timestamps is None:
+                for i, event in enumerate(events):
+                    go(table[self._state][event], None)
+                    codes[i] = self._state
+            else:
+                for i, (event, ts) in enumerate(
+                    zip(events, np.asarray(timestamps).tolist())
+                ):
+                    advance(ts)
+                    go(table[self._state][event], ts)
+                    codes[i] = self._state
+            return np.array(codes, dtype=np.int8)
+
+        # Nothing to call and no clock: just walk the table
+        table, state, changed = self.table, self._state, False
+        for i, event in enumerate(events):
+            target = table[state][event]
+            if target != state:
+                if self.debug:
+                    logger.debug("%s --> %s", STATES[state], STATES[target])
+                state, changed = target, True
+            codes[i] = state
+        if changed:
+            self._state, self.time_in_state, self.entered_at = state, 0, None
+        return np.array(codes, dtype=np.int8)
+
+
+class TestDinoStateMachine(unittest.TestCase):
+    def test_transitions_and_callbacks(self):
+        machine = DinoStateMachine()
+        jumps = []
+        machine.register_callback(State.STEADY, State.JUMPING, lambda: jumps.append(1))
+        machine.receive_event(Event.VELOCITY_POSITIVE_LARGE)
+        self.assertEqual(machine.current_state, State.UNCALIBRATED)
+        for event in (
+            Event.VELOCITY_STEADY,
+            Event.VELOCITY_NEGATIVE,
+            Event.VELOCITY_POSITIVE_LARGE,
+            Event.VELOCITY_STEADY,
+            Event.VELOCITY_POSITIVE_SMALL,
+        ):
+            machine.receive_event(event)
+        self.assertEqual(machine.current_state, State.JUMPING)
+        self.assertEqual(jumps, [1])
+        with self.assertRaises(RuntimeError):
+            machine.transition(State.DUCKING)
+
+    def test_timeouts(self):
+        samples = DinoStateMachine(
+            timeouts={State.JUMPING: Timeout(State.STEADY, samples=3)}
+        )
+        samples.current_state = State.STEADY
+        samples.receive_event(Event.VELOCITY_POSITIVE_LARGE)
+        for _ in range(2):
+            samples.tick()
+        self.assertEqual(samples.current_state, State.JUMPING)
+        samples.tick()
+        self.assertEqual(samples.current_state, State.STEADY)
+
+        ms = DinoStateMachine()
+        ms.current_state = State.STEADY
+        ms.receive_event(Event.VELOCITY_POSITIVE_LARGE, ts=1000)
+        ms.advance(1150)
+        self.assertEqual(ms.current_state, State.JUMPING)
+        # The jump is over by the time the next one comes, which starts a new jump
+        ms.receive_event(Event.VELOCITY_POSITIVE_LARGE, ts=1250)
+        self.assertEqual((ms.current_state, ms.entered_at), (State.JUMPING, 1250))
+
+    def test_feed_matches_receive_event(self):
+        rng = np.random.default_rng(0)
+        codes = rng.integers(0, len(EVENTS), 500)
+        timestamps = np.cumsum(rng.integers(0, 150, 500))
+        for stamps in (None, timestamps):
+            expected = DinoStateMachine()
+            states = []
+            for i, code in enumerate(codes.tolist()):
+                expected.receive_event(
+                    EVENTS[code], None if stamps is None else int(stamps[i])
+                )
+                states.append(_STATE_CODES[expected.current_state])
+            machine = DinoStateMachine()
+            self.assertEqual(machine.feed(codes, stamps).tolist(), states)
+            self.assertEqual(machine.current_state, expected.current_state)
+
+
+if __name__ == "__main__":
+    unittest.main()
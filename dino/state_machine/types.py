@@ -13,3 +13,11 @@ class Event(Enum):
     VELOCITY_POSITIVE_LARGE = auto()
     VELOCITY_NEGATIVE = auto()
     VELOCITY_STEADY = auto()
+
+
+class Load(Enum):
+    """What the last second of force looks like"""
+
+    UNSTEADY = auto()
+    EMPTY = auto()
+    LOADED = auto()
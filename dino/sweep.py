@@ -0,0 +1,217 @@
+"""Searching the detector thresholds for the ones that score best against annotated traces.
+
+Each candidate `DetectorParams` is run over every trace with `detect_offline` and scored with `score`. Candidates are
+spread over a `ProcessPoolExecutor`; the traces are loaded once, saved as `.npy` files and memory-mapped by every
+worker rather than pickled to each one.
+
+    python -m dino sweep data/*.txt --grid stable_thresh=0.5,1,2 --grid jump_increase_threshold=4,6,8
+    python -m dino sweep data/*.txt --random 200 --range tare_threshold=5:30 -j 8 -o sweep.json
+"""
+
+import dataclasses
+import itertools
+import os
+import tempfile
+import typing as t
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from dino.evaluation import DEFAULT_TOLERANCE, Score, detect_offline, score
+from dino.pattern_matching.defaults import DetectorParams
+
+PARAMETERS = {f.name: f.type for f in dataclasses.fields(DetectorParams)}
+# Where `random_search` draws from, unless told otherwise
+DEFAULT_RANGES = {
+    "stable_thresh": (0.25, 4.0),
+    "steady_samples": (2, 10),
+    "jump_increase_threshold": (2.0, 12.0),
+    "tare_threshold": (5.0, 30.0),
+}
+
+
+def _convert(name: str, value) -> t.Union[int, float]:
+    if name not in PARAMETERS:
+        raise ValueError(
+            f"Unknown parameter {name!r}; choose from {', '.join(PARAMETERS)}"
+        )
+    return int(round(float(value))) if PARAMETERS[name] is int else float(value)
+
+
+def grid(values: t.Dict[str, t.Sequence]) -> t.List[DetectorParams]:
+    """Every combination of `values` (parameter name -> values to try), with the other parameters at their defaults"""
+    names = list(values)
+    return [
+        DetectorParams(
+            **{name: _convert(name, v) for name, v in zip(names, combination)}
+        )
+        for combination in itertools.product(*(values[name] for name in names))
+    ]
+
+
+def random_search(
+    n: int, ranges: t.Dict[str, t.Tuple[float, float]] = None, seed=0
+) -> t.List[DetectorParams]:
+    """`n` candidates drawn uniformly from `ranges` (parameter name -> (low, high))"""
+    ranges = DEFAULT_RANGES if ranges is None else ranges
+    rng = np.random.default_rng(seed)
+    draws = {name: rng.uniform(low, high, n) for name, (low, high) in ranges.items()}
+    return [
+        DetectorParams(**{name: _convert(name, draws[name][i]) for name in ranges})
+        for i in range(n)
+    ]
+
+
+@dataclass
+class Trial:
+    params: DetectorParams
+    # Summed over all the traces
+    score: Score
+    # Traces the detectors gave up on (eg because the scale never tared); all their annotations count as missed
+    failed: t.List[str] = field(default_factory=list)
+
+    @property
+    def f1(self) -> float:
+        s = self.score
+        matched = 2 * s.true_positives
+        total = matched + s.false_positives + s.false_negatives
+        return matched / total if total else 0.0
+
+    @property
+    def mean_latency(self) -> t.Optional[float]:
+        """`Score.mean_latency`, in samples (negative if detections are early on average)"""
+        return self.score.mean_latency
+
+    def rank_key(self):
+        latency = self.mean_latency
+        return (
+            -self.f1,
+            # Early is no better than late
+            float("inf") if latency is None else abs(latency),
+            self.score.false_positives,
+        )
+
+    def as_dict(self) -> dict:
+        s = self.score
+        return {
+            "params": dataclasses.asdict(self.params),
+            "f1": self.f1,
+            "precision": s.precision,
+            "recall": s.recall,
+            "true_positives": s.true_positives,
+            "false_positives": s.false_positives,
+            "false_negatives": s.false_negatives,
+            "mean_latency_samples": self.mean_latency,
+            "failed": self.failed,
+        }
+
+
+# name -> (timestamps, force, annotations), set up in each worker by `_load_traces`
+_traces: t.Dict[str, t.Tuple[np.ndarray, np.ndarray, t.List[t.Tuple[int, str]]]] = {}
+_tolerance = DEFAULT_TOLERANCE
+
+
+def _load_traces(shared: t.List[t.Tuple[str, str, str, list]], tolerance: int):
+    global _tolerance
+    _tolerance = tolerance
+    _traces.clear()
+    for name, timestamps, force, annotations in shared:
+        _traces[name] = (
+            np.load(timestamps, mmap_mode="r"),
+            np.load(force, mmap_mode="r"),
+            annotations,
+        )
+
+
+def _evaluate(params: DetectorParams) -> Trial:
+    trial = Trial(params, Score())
+    total = trial.score
+    for name, (timestamps, force, annotations) in _traces.items():
+        try:
+            detected = detect_offline(timestamps, force, params)
+        except RuntimeError:
+            trial.failed.append(name)
+            total.false_negatives += len(annotations)
+            continue
+        result = score(detected, annotations, timestamps, _tolerance)
+        total.true_positives += result.true_positives
+        total.false_positives += result.false_positives
+        total.false_negatives += result.false_negatives
+        total.latencies.extend(result.latencies)
+    return trial
+
+
+def run_sweep(
+    traces: t.Dict[str, t.Tuple[np.ndarray, np.ndarray, t.List[t.Tuple[int, str]]]],
+    candidates: t.Sequence[DetectorParams],
+    workers: t.Optional[int] = None,
+    tolerance=DEFAULT_TOLERANCE,
+) -> t.List[Trial]:
+    """Score every candidate over `traces` (name -> (timestamps, force, annotations)), best first.
+
+    Runs in this process when `workers` is 1, and on every core when it's None.
+    """
+    with tempfile.TemporaryDirectory(prefix="dino-sweep-") as directory:
+        shared = []
+        for i, (name, (timestamps, force, annotations)) in enumerate(traces.items()):
+            paths = [
+                os.path.join(directory, f"{i}-{part}.npy") for part in ("ts", "force")
+            ]
+            np.save(paths[0], np.asarray(timestamps, dtype=np.int64))
+            np.save(paths[1], np.asarray(force, dtype=np.float64))
+            shared.append((name, *paths, list(annotations)))
+
+        if workers == 1:
+            _load_traces(shared, tolerance)
+            trials = [_evaluate(params) for params in candidates]
+        else:
+            workers = workers or os.cpu_count() or 1
+            chunksize = max(1, len(candidates) // (4 * workers))
+            with ProcessPoolExecutor(
+                workers, initializer=_load_traces, initargs=(shared, tolerance)
+            ) as pool:
+                trials = list(pool.map(_evaluate, candidates, chunksize=chunksize))
+    return sorted(trials, key=Trial.rank_key)
+
+
+class TestSweep(unittest.TestCase):
+    def test_candidates(self):
+        candidates = grid({"stable_thresh": [0.5, 1], "steady_samples": ["2", 4.0]})
+        self.assertEqual(len(candidates), 4)
+        self.assertEqual(
+            candidates[1], DetectorParams(stable_thresh=0.5, steady_samples=4)
+        )
+        drawn = random_search(10, {"steady_samples": (2, 10)})
+        self.assertTrue(all(2 <= c.steady_samples <= 10 for c in drawn))
+        self.assertEqual(drawn, random_search(10, {"steady_samples": (2, 10)}))
+        with self.assertRaises(ValueError):
+            grid({"no_such_threshold": [1]})
+
+    def test_run_sweep(self):
+        from dino.replay import load_trace
+
+        traces = {}
+        for name in ("eric.txt", "michelle.txt", "eric2.txt"):
+            timestamps, force = load_trace(name)
+            # Take what the defaults find as the truth, so they should come out on top
+            try:
+                annotations = detect_offline(timestamps, force)
+            except RuntimeError:
+                annotations = [(int(timestamps[100]), "jump")]
+            traces[name] = (timestamps, force, annotations)
+
+        candidates = grid({"jump_increase_threshold": [3, 6, 9]})
+        inline = run_sweep(traces, candidates, workers=1)
+        self.assertEqual(inline[0].params, DetectorParams())
+        self.assertEqual(inline[0].score.false_positives, 0)
+        self.assertEqual(inline[0].failed, ["eric2.txt"])
+        pooled = run_sweep(traces, candidates, workers=2)
+        self.assertEqual(
+            [trial.as_dict() for trial in pooled], [trial.as_dict() for trial in inline]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -21,6 +21,7 @@ setup(
         "console_scripts": [
             "scaleplot=dino.__main__:main",
             "scaleread=dino.openscale_serial.__main__:main",
+            "scaleconvert=dino.recording:main",
         ],
     },
 )
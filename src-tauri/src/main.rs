@@ -10,6 +10,9 @@ use std::str::FromStr;
 use tauri::Manager;
 
 const HOSTPORT: &str = "127.0.0.1:12345";
+// Events start with their ASCII character; version 1 follows it with a header (see dino/socket_rpc.py)
+const EVENT_VERSION: u8 = 1;
+const EVENT_HEADER_LEN: usize = 24;
 const SCORE_FILE: &str = ".dino_score";
 
 #[tauri::command]
@@ -55,15 +58,27 @@ fn jump(window: tauri::Window) {
         .set_read_timeout(None)
         .expect("set_read_timeout call failed");
 
-    let mut buf = [0; 2];
+    // Roomy enough for the whole header: a datagram that doesn't fit is an error on Windows
+    let mut buf = [0; 64];
+    let mut expected_seq: Option<u32> = None;
 
     std::thread::spawn(move || loop {
         match socket.recv_from(&mut buf) {
-            Ok((_amt, _src)) => {
-                let parsed: &str = std::str::from_utf8(&buf[..1]).unwrap().trim();
+            Ok((amt, _src)) if amt > 0 => {
+                if amt >= EVENT_HEADER_LEN && buf[1] == EVENT_VERSION {
+                    let seq = u32::from_le_bytes([buf[2], buf[3], buf[4], buf[5]]);
+                    if let Some(expected) = expected_seq {
+                        if seq != expected {
+                            println!("Expected event {}, got {}", expected, seq);
+                        }
+                    }
+                    expected_seq = Some(seq.wrapping_add(1));
+                }
+                let parsed: &str = std::str::from_utf8(&buf[..1]).unwrap_or("").trim();
                 println!("Received: {}", parsed);
                 window.emit(parsed, ()).unwrap();
             }
+            Ok(_) => {}
             Err(e) => {
                 println!("{}", e);
             }